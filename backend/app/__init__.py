@@ -4,26 +4,78 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
-def create_app():
+def create_app(socketio_client_manager=None):
+    """
+    Create the Flask app.
+
+    Args:
+        socketio_client_manager: The client manager of the Socket.IO server
+            when SOCKETIO_MESSAGE_QUEUE is not set, e.g. the emitter of the
+            asyncio server in app/asgi.py
+
+    Returns:
+        Flask: The app
+    """
     from flask import Flask
     from flask_cors import CORS
+    from werkzeug.middleware.proxy_fix import ProxyFix
 
     from config import Config as AppConfig
 
+    from .commands import register_commands
     from .extensions import db
     from .socket_events import socketio
+    from .utils.auth_cache import token_cache
+    from .utils.database_engine import init_database
+    from .utils.emit_coalescer import emit_coalescer
+    from .utils.membership_cache import contacts_cache, membership_cache
+    from .utils.message_writer import message_writer
+    from .utils.password_hashing import password_hasher
+    from .utils.presence import presence
+    from .utils.rate_limit import rate_limiter
+    from .utils.sent_messages import sent_message_cache
+    from .utils.compression import init_compression
+    from .utils.json_provider import init_json_provider
     from .utils.register_error_handlers import register_app_error_handlers
     from .utils.router import register_routes
+    from .utils.socket_queue import get_socketio_queue_options
 
     app = Flask(__name__)
     app.config.from_object(AppConfig)
+    init_json_provider(app)
 
-    CORS(app, resources={r"/*": {"origins": "http://localhost:5173"}})
+    CORS(
+        app,
+        resources={r"/*": {"origins": "http://localhost:5173"}},
+        expose_headers=["ETag"],
+    )
 
-    db.init_app(app)
-    socketio.init_app(app, cors_allowed_origins="http://localhost:5173")
+    init_database(app, db)
+    token_cache.resize(app.config["TOKEN_CACHE_SIZE"])
+    membership_cache.resize(app.config["MEMBERSHIP_CACHE_SIZE"])
+    contacts_cache.resize(app.config["MEMBERSHIP_CACHE_SIZE"])
+    sent_message_cache.resize(app.config["SENT_MESSAGE_CACHE_SIZE"])
+    password_hasher.init_app(app)
+    rate_limiter.init_app(app)
+    socketio_queue_options = get_socketio_queue_options(app)
+    if not socketio_queue_options and socketio_client_manager is not None:
+        socketio_queue_options = {"client_manager": socketio_client_manager}
+    socketio.init_app(
+        app,
+        cors_allowed_origins="http://localhost:5173",
+        **socketio_queue_options,
+    )
+    # Wrap the Socket.IO middleware too, so socket handlers see the client
+    # address behind the proxies like the routes do
+    if app.config["PROXY_FIX_X_FOR"]:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["PROXY_FIX_X_FOR"])
+    presence.init_app(app)
+    emit_coalescer.init_app(app)
+    message_writer.init_app(app)
 
     register_routes(app)
     register_app_error_handlers(app)
+    register_commands(app)
+    init_compression(app)
 
     return app
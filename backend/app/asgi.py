@@ -0,0 +1,94 @@
+import asyncio
+
+import socketio
+
+from . import create_app
+from .async_socket_events import register_async_socket_events
+from .utils.async_database import create_async_sessionmaker
+from .utils.socket_queue import get_async_socketio_manager
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:  # pragma: no cover - optional dependency
+    WsgiToAsgi = None
+
+
+class _EventLoopEmitter(socketio.Manager):
+    """
+    The client manager of the Flask-SocketIO server when there is no message
+    queue, so emits from REST routes, which run in threads, reach the clients
+    of the AsyncServer on its event loop.
+
+    Emits are dropped until the AsyncServer and its event loop are attached.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.sio = None
+        self.loop = None
+
+    def emit(
+        self,
+        event,
+        data,
+        namespace,
+        room=None,
+        skip_sid=None,
+        callback=None,
+        to=None,
+        **kwargs,
+    ):
+        if self.sio is None or self.loop is None:
+            return
+
+        asyncio.run_coroutine_threadsafe(
+            self.sio.emit(
+                event, data, to=to or room, skip_sid=skip_sid, namespace=namespace
+            ),
+            self.loop,
+        )
+
+
+def create_asgi_app():
+    """
+    Create the ASGI application of the asyncio server mode.
+
+    Serves the same REST blueprints and socket events as `python run.py`,
+    with the socket events handled by a python-socketio AsyncServer on an
+    asyncio event loop. Run one event loop per core with:
+
+        uvicorn app.asgi:create_asgi_app --factory --workers 4
+
+    Several workers need a redis:// or amqp:// SOCKETIO_MESSAGE_QUEUE, like
+    the threaded server.
+
+    Returns:
+        callable: The ASGI application, Socket.IO on /socket.io and the
+            Flask app everywhere else
+    """
+    if WsgiToAsgi is None:
+        raise RuntimeError("The asgiref package is required for the asyncio server")
+
+    # Without a message queue, REST emits go through the emitter. With one,
+    # they are published to it and the AsyncServer picks them up like those
+    # of any other worker
+    emitter = _EventLoopEmitter()
+    app = create_app(socketio_client_manager=emitter)
+    client_manager = get_async_socketio_manager(app)
+
+    sio = socketio.AsyncServer(
+        async_mode="asgi",
+        client_manager=client_manager,
+        cors_allowed_origins="http://localhost:5173",
+    )
+    register_async_socket_events(sio, app, create_async_sessionmaker(app))
+    emitter.sio = sio
+
+    asgi_app = socketio.ASGIApp(sio, other_asgi_app=WsgiToAsgi(app))
+
+    async def application(scope, receive, send):
+        if emitter.loop is None:
+            emitter.loop = asyncio.get_running_loop()
+        await asgi_app(scope, receive, send)
+
+    return application
@@ -0,0 +1,456 @@
+import asyncio
+from functools import wraps
+
+import jwt
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from .errors.database_errors import MessageWriterBusy
+from .errors.request_errors import RateLimitExceeded
+from .models import Message, User
+from .utils.auth_cache import (
+    DEFAULT_TOKEN_CACHE_TTL,
+    UserSnapshot,
+    cache_token,
+    get_cached_token,
+)
+from .utils.chat_utility import (
+    DEFAULT_FETCH_RANGE_LIMIT,
+    last_message_update,
+    message_range_select,
+    next_message_seq_update,
+    parse_message_range,
+    socket_message_payload,
+    unread_message_update,
+)
+from .utils.emit_coalescer import emit_coalescer
+from .utils.membership_cache import authorize_chat_async
+from .utils.message_writer import message_writer
+from .utils.presence import presence
+from .utils.rate_limit import forwarded_client_address, rate_limiter
+from .utils.read_receipts import read_cursor_buffer
+from .utils.read_replica import record_write
+from .utils.sent_messages import (
+    get_sent_message_ack,
+    is_valid_client_msg_id,
+    message_ack,
+    remember_sent_message,
+    sent_message_select,
+)
+
+
+async def store_message_async(db_session, message):
+    """
+    Like chat_utility.store_message, on an asyncio session.
+
+    Args:
+        db_session (AsyncSession): The session, committed by the caller
+        message (Message): The new message
+    """
+    # Take the chat's next sequence number, which locks the chat until the
+    # message is committed
+    result = await db_session.execute(next_message_seq_update(message.chat_id))
+    message.seq = result.scalar_one()
+    db_session.add(message)
+    await db_session.flush()
+
+    # Update the chat's last message pointer and the members' unread counts
+    # in the same transaction
+    await db_session.execute(last_message_update(message))
+    await db_session.execute(unread_message_update(message))
+
+
+async def _wait_for_writer(future, message):
+    """
+    Wait for the message writer to store a message, like MessageWriter.write.
+
+    Returns:
+        Message: The stored message, or the given one, still unsaved, when
+            the writer did not pick it up in time and the caller must store
+            it
+
+    Raises:
+        MessageWriterBusy: If the writer took the message but did not commit
+            it in time
+    """
+    try:
+        return await asyncio.wait_for(
+            asyncio.shield(asyncio.wrap_future(future)), message_writer.timeout
+        )
+    except asyncio.TimeoutError:
+        if message_writer.cancel(future):
+            return message
+
+    # The writer is storing the message, give it one more chance
+    try:
+        return await asyncio.wait_for(
+            asyncio.wrap_future(future), message_writer.timeout
+        )
+    except asyncio.TimeoutError:
+        raise MessageWriterBusy()
+
+
+def register_async_socket_events(sio, app, session_factory):
+    """
+    Register the socket events of socket_events.py on a python-socketio
+    AsyncServer, for the asyncio server mode (see app/asgi.py).
+
+    The handlers behave like their threaded counterparts but query the
+    database through an asyncio session, so one event loop can hold many
+    connections while waiting on the database.
+
+    Args:
+        sio (socketio.AsyncServer): The server to register the events on
+        app (Flask): The Flask app, for its config and app context
+        session_factory (async_sessionmaker): Creates the database sessions
+    """
+
+    def client_address(sid):
+        environ = sio.get_environ(sid) or {}
+        client = environ.get("asgi.scope", {}).get("client")
+        return forwarded_client_address(
+            client[0] if client else environ.get("REMOTE_ADDR"),
+            environ.get("HTTP_X_FORWARDED_FOR"),
+            app.config["PROXY_FIX_X_FOR"],
+        )
+
+    def rate_limited_event(event, error_event="error"):
+        def decorator(f):
+            @wraps(f)
+            async def decorated(sid, *args):
+                try:
+                    rate_limiter.hit("ip", client_address(sid))
+                    user_id = (await sio.get_session(sid)).get("user_id")
+                    if user_id:
+                        rate_limiter.hit(event, user_id)
+                except RateLimitExceeded as e:
+                    await sio.emit(
+                        error_event,
+                        {"message": e.message, "retry_after": e.retry_after},
+                        to=sid,
+                    )
+                    return False
+
+                return await f(sid, *args)
+
+            return decorated
+
+        return decorator
+
+    async def get_token_user(token):
+        cached = get_cached_token(token)
+        if cached:
+            return cached[1]
+
+        try:
+            claims = jwt.decode(token, app.config["SECRET_KEY"], algorithms=["HS256"])
+        except jwt.InvalidTokenError:
+            print("Invalid token")
+            return None
+
+        async with session_factory() as db_session:
+            user = await db_session.get(User, claims.get("user_id"))
+        if not user:
+            print("User not found")
+            return None
+
+        user_snapshot = UserSnapshot.from_user(user)
+        cache_token(
+            token,
+            claims,
+            user_snapshot,
+            app.config.get("TOKEN_CACHE_TTL", DEFAULT_TOKEN_CACHE_TTL),
+        )
+        return user_snapshot
+
+    @sio.on("connect")
+    async def handle_connect(sid, environ, auth):
+        # Throttle reconnect storms by client address
+        try:
+            rate_limiter.hit("connect", client_address(sid))
+        except RateLimitExceeded:
+            return False  # Reject the connection
+
+        token = auth.get("token") if auth else None
+
+        if not token and "HTTP_AUTHORIZATION" in environ:
+            token = environ["HTTP_AUTHORIZATION"]
+
+        if not token:
+            print("No token provided")
+            return False  # Reject the connection
+
+        user = await get_token_user(token)
+        if not user:
+            return False  # Reject the connection
+
+        # Store user's information in the session
+        await sio.save_session(
+            sid,
+            {
+                "user_id": user.id,
+                "user": {"id": user.id, "name": user.name, "username": user.username},
+            },
+        )
+
+        # Add user to the connected users shared by all workers
+        with app.app_context():
+            presence.connect(user.id, sid)
+
+        # User joins their own room for personal notifications
+        await sio.enter_room(sid, f"user_{user.id}")
+
+        print(f"User {user.id} connected to the socket")
+        print(f"🟢 :: Client connected to the socket")
+
+    @sio.on("join-chat")
+    @rate_limited_event("join-chat")
+    async def handle_join_chat(sid, data):
+        user_id = (await sio.get_session(sid)).get("user_id")
+        if not user_id:
+            await sio.disconnect(sid)
+            return False
+
+        chat_id = data.get("chat_id")
+        if not chat_id:
+            await sio.emit(
+                "error", {"message": "Chat ID is required to join a chat"}, to=sid
+            )
+            return False
+
+        # Check if user is a member of the chat
+        async with session_factory() as db_session:
+            with app.app_context():
+                is_member = await authorize_chat_async(
+                    sio, sid, db_session, chat_id, user_id
+                )
+        if not is_member:
+            await sio.emit(
+                "error", {"message": "You are not a member of this chat"}, to=sid
+            )
+            return False
+
+        await sio.enter_room(sid, f"chat_{chat_id}")
+        await sio.emit("joined-chat", {"chat_id": chat_id}, to=sid)
+
+    @sio.on("send-message")
+    @rate_limited_event("send-message", error_event="send-message:error")
+    async def handle_send_message(sid, data):
+        user_id = (await sio.get_session(sid)).get("user_id")
+        if not user_id:
+            await sio.disconnect(sid)
+            return False
+
+        chat_id = data.get("chat_id")
+        content = data.get("content")
+        client_msg_id = data.get("client_msg_id")
+
+        if not chat_id or not content:
+            await sio.emit(
+                "send-message:error",
+                {"message": "Chat ID and content are required to send a message"},
+                to=sid,
+            )
+            return False
+
+        if client_msg_id is not None and not is_valid_client_msg_id(client_msg_id):
+            await sio.emit(
+                "send-message:error",
+                {"message": "Invalid client message ID"},
+                to=sid,
+            )
+            return False
+
+        async with session_factory() as db_session:
+            # Check if user is a member of the chat, usually answered
+            # from the chats the connection has already joined
+            with app.app_context():
+                is_member = await authorize_chat_async(
+                    sio, sid, db_session, chat_id, user_id
+                )
+            if not is_member:
+                await sio.emit(
+                    "send-message:error",
+                    {"message": "You are not a member of this chat"},
+                    to=sid,
+                )
+                return False
+
+            # A retry of a message this worker just stored is acked
+            # again without being stored or broadcast twice
+            if client_msg_id:
+                ack = get_sent_message_ack(user_id, client_msg_id)
+                if ack:
+                    return ack
+
+            # Create a new message
+            message = Message(
+                content=content,
+                sender_id=user_id,
+                chat_id=chat_id,
+                client_msg_id=client_msg_id,
+            )
+
+            try:
+                if message_writer.enabled:
+                    # Committed together with the other messages waiting
+                    # for the writer thread, the message is only emitted
+                    # once it is durable
+                    with app.app_context():
+                        future = message_writer.submit(message)
+                    message = await _wait_for_writer(future, message)
+                if message.seq is None:
+                    # The writer is off, or handed the message back
+                    await store_message_async(db_session, message)
+                    await db_session.commit()
+            except MessageWriterBusy as e:
+                await sio.emit("send-message:error", {"message": e.message}, to=sid)
+                return False
+            except IntegrityError as e:
+                await db_session.rollback()
+
+                # A retry that reached another worker, or raced the
+                # original, hits the unique (sender_id, client_msg_id)
+                # constraint
+                original = None
+                if client_msg_id:
+                    result = await db_session.execute(
+                        sent_message_select(user_id, client_msg_id)
+                    )
+                    original = result.scalar_one_or_none()
+                if original:
+                    with app.app_context():
+                        remember_sent_message(original)
+                    return message_ack(original, duplicate=True)
+
+                await sio.emit("send-message:error", {"message": str(e)}, to=sid)
+                return False
+            except SQLAlchemyError as e:
+                await db_session.rollback()
+                await sio.emit("send-message:error", {"message": str(e)}, to=sid)
+                return False
+
+        with app.app_context():
+            remember_sent_message(message)
+            record_write(user_id)
+
+        # Prepare message data
+        message_data = socket_message_payload(message)
+
+        # Busy rooms get their messages in batches when coalescing is on
+        if emit_coalescer.enabled:
+            emit_coalescer.emit(
+                "new-message",
+                message_data,
+                room=f"chat_{chat_id}",
+                batch_event="new-messages",
+            )
+        else:
+            await sio.emit("new-message", message_data, room=f"chat_{chat_id}")
+
+        # Acknowledge the send with the server id and sequence number
+        return message_ack(message)
+
+    @sio.on("mark-read")
+    @rate_limited_event("mark-read")
+    async def handle_mark_read(sid, data):
+        user_id = (await sio.get_session(sid)).get("user_id")
+        if not user_id:
+            await sio.disconnect(sid)
+            return False
+
+        chat_id = data.get("chat_id")
+        message_id = data.get("message_id")
+
+        if not chat_id or not message_id:
+            await sio.emit(
+                "error",
+                {
+                    "message": "Chat ID and message ID are required to mark a chat as read"
+                },
+                to=sid,
+            )
+            return False
+
+        # Read cursors are buffered and written in batches by a background
+        # thread, the membership is checked when the buffer is flushed
+        with app.app_context():
+            read_cursor_buffer.add(chat_id, user_id, message_id)
+
+    @sio.on("fetch-range")
+    @rate_limited_event("fetch-range")
+    async def handle_fetch_range(sid, data):
+        user_id = (await sio.get_session(sid)).get("user_id")
+        if not user_id:
+            await sio.disconnect(sid)
+            return False
+
+        message_range = parse_message_range(
+            data, app.config.get("FETCH_RANGE_LIMIT", DEFAULT_FETCH_RANGE_LIMIT)
+        )
+        if not message_range:
+            await sio.emit(
+                "error",
+                {"message": "Chat ID and a valid from_seq and to_seq are required"},
+                to=sid,
+            )
+            return False
+
+        chat_id, from_seq, to_seq = message_range
+        async with session_factory() as db_session:
+            with app.app_context():
+                is_member = await authorize_chat_async(
+                    sio, sid, db_session, chat_id, user_id
+                )
+            if not is_member:
+                await sio.emit(
+                    "error",
+                    {"message": "You are not a member of this chat"},
+                    to=sid,
+                )
+                return False
+
+            result = await db_session.execute(
+                message_range_select(chat_id, from_seq, to_seq)
+            )
+            messages = result.all()
+
+        await sio.emit(
+            "fetched-range",
+            {
+                "chat_id": chat_id,
+                "from_seq": from_seq,
+                "to_seq": to_seq,
+                "messages": [socket_message_payload(message) for message in messages],
+            },
+            to=sid,
+        )
+
+    @sio.on("leave_chat")
+    @rate_limited_event("leave_chat")
+    async def handle_leave_chat(sid, data):
+        user_id = (await sio.get_session(sid)).get("user_id")
+        if not user_id:
+            await sio.disconnect(sid)
+            return False
+
+        chat_id = data.get("chat_id")
+        if not chat_id:
+            await sio.emit(
+                "error", {"message": "Chat ID is required to leave a chat"}, to=sid
+            )
+            return False
+
+        # Leave the chat room
+        await sio.leave_room(sid, f"chat_{chat_id}")
+        await sio.emit("left-chat", {"chat_id": chat_id}, to=sid)
+        print(f"User {user_id} left chat {chat_id}")
+
+    @sio.on("disconnect")
+    async def handle_disconnect(sid, reason=None):
+        user_id = (await sio.get_session(sid)).get("user_id")
+        if user_id:
+            # Remove user from the connected users
+            with app.app_context():
+                presence.disconnect(user_id, sid)
+        print(f"User {user_id} disconnected from the socket")
+        print(f"🔴 :: Client disconnected from the socket")
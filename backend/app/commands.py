@@ -0,0 +1,225 @@
+import click
+from flask import Flask, current_app
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, func, select, update
+
+from .extensions import db
+from .models import Chat, ChatMember, DirectChat, Message
+from .utils.chat_utility import (
+    LAST_MESSAGE_PREVIEW_LENGTH,
+    direct_chat_key,
+    next_message_seq_update,
+)
+from .utils.local_pubsub import LocalPubSubBroker
+from .utils.message_search import rebuild_search_index
+from .utils.read_replica import REPLICA_BIND
+from .utils.schema_upgrade import upgrade_schema
+from .utils.sqlite_replicator import SQLiteReplicator
+from .utils.user_search import rebuild_user_search_index
+
+
+@click.command("upgrade-schema")
+@with_appcontext
+def upgrade_schema_command():
+    """Add the tables, columns and indexes missing from an existing database."""
+    with db.engine.begin() as connection:
+        changes = upgrade_schema(connection, db.metadata)
+
+    for change in changes:
+        click.echo(change)
+    click.echo(f"Made {len(changes)} schema changes")
+
+
+@click.command("backfill-last-messages")
+@with_appcontext
+def backfill_last_messages():
+    """Populate the last message pointer of every existing chat."""
+
+    def last_message(column):
+        return (
+            select(column)
+            .where(Message.chat_id == Chat.id)
+            .order_by(Message.sent_at.desc(), Message.id.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+
+    # A single correlated UPDATE, each subquery walks the (chat_id, sent_at,
+    # id) index backwards and stops at the first row. updated_at is kept
+    # untouched, this is not a user-visible change
+    result = db.session.execute(
+        update(Chat)
+        .where(select(Message.id).where(Message.chat_id == Chat.id).exists())
+        .values(
+            last_message_id=last_message(Message.id),
+            last_message_at=last_message(Message.sent_at),
+            last_message_sender_id=last_message(Message.sender_id),
+            last_message_preview=last_message(
+                func.substr(Message.content, 1, LAST_MESSAGE_PREVIEW_LENGTH)
+            ),
+            updated_at=Chat.updated_at,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+    click.echo(f"Backfilled the last message of {result.rowcount} chats")
+
+
+@click.command("backfill-message-seqs")
+@with_appcontext
+def backfill_message_seqs():
+    """
+    Number the messages sent before messages had sequence numbers.
+
+    Run it before serving the version that adds them, so the backfilled
+    messages come before every new one.
+    """
+    numbered = 0
+    chat_ids = [
+        chat_id
+        for (chat_id,) in db.session.query(Message.chat_id)
+        .filter(Message.seq.is_(None))
+        .distinct()
+    ]
+
+    for chat_id in chat_ids:
+        message_ids = [
+            message_id
+            for (message_id,) in db.session.query(Message.id)
+            .filter(Message.chat_id == chat_id, Message.seq.is_(None))
+            .order_by(Message.sent_at, Message.id)
+        ]
+        last_seq = db.session.execute(
+            next_message_seq_update(chat_id, count=len(message_ids))
+        ).scalar_one()
+
+        first_seq = last_seq - len(message_ids) + 1
+        db.session.execute(
+            update(Message.__table__)
+            .where(Message.__table__.c.id == bindparam("message_id"))
+            .values(seq=bindparam("seq")),
+            [
+                {"message_id": message_id, "seq": first_seq + offset}
+                for offset, message_id in enumerate(message_ids)
+            ],
+        )
+        db.session.commit()
+        numbered += len(message_ids)
+
+    click.echo(f"Numbered {numbered} messages in {len(chat_ids)} chats")
+
+
+@click.command("rebuild-search-index")
+@with_appcontext
+def rebuild_message_search_index():
+    """Create the message full-text index and repopulate it."""
+    dialect = rebuild_search_index()
+    click.echo(f"Rebuilt the message search index for {dialect}")
+
+
+@click.command("rebuild-user-search-index")
+@click.option("--batch-size", default=1000, show_default=True)
+@with_appcontext
+def rebuild_user_search(batch_size):
+    """Rebuild the trigram index used by user search."""
+    indexed = rebuild_user_search_index(batch_size=batch_size)
+    click.echo(f"Indexed {indexed} users for search")
+
+
+@click.command("backfill-direct-chats")
+@with_appcontext
+def backfill_direct_chats():
+    """Create the pair record of every existing one-on-one chat."""
+    created = 0
+    existing_chat_ids = {chat_id for (chat_id,) in db.session.query(DirectChat.chat_id)}
+    seen_pairs = set(db.session.query(DirectChat.user_low_id, DirectChat.user_high_id))
+
+    one_on_one_chats = (
+        Chat.query.filter(Chat.chat_type == "one-on-one")
+        .order_by(Chat.created_at)
+        .all()
+    )
+    for chat in one_on_one_chats:
+        if chat.id in existing_chat_ids:
+            continue
+
+        member_ids = [
+            member_id
+            for (member_id,) in db.session.query(ChatMember.member_id).filter_by(
+                chat_id=chat.id
+            )
+        ]
+        if len(member_ids) != 2:
+            continue
+
+        pair = direct_chat_key(*member_ids)
+        if pair in seen_pairs:
+            # Keep the oldest chat when a pair already has duplicates
+            click.echo(f"Skipping duplicate direct chat {chat.id}")
+            continue
+
+        db.session.add(
+            DirectChat(user_low_id=pair[0], user_high_id=pair[1], chat_id=chat.id)
+        )
+        seen_pairs.add(pair)
+        created += 1
+
+    db.session.commit()
+    click.echo(f"Created {created} direct chat records")
+
+
+@click.command("run-socket-broker")
+@click.option("--url", default=None, help="Defaults to SOCKETIO_MESSAGE_QUEUE.")
+@with_appcontext
+def run_socket_broker(url):
+    """Run the broker of a local:// Socket.IO message queue."""
+    url = url or current_app.config.get("SOCKETIO_MESSAGE_QUEUE")
+    if not url or not url.startswith("local://"):
+        raise click.UsageError("A local://host:port message queue URL is required")
+
+    click.echo(f"Relaying Socket.IO messages on {url}")
+    LocalPubSubBroker(
+        url, authkey=current_app.config["SECRET_KEY"].encode()
+    ).serve_forever()
+
+
+@click.command("run-sqlite-replicator")
+@click.option(
+    "--delay",
+    default=1.0,
+    show_default=True,
+    help="Seconds before a change reaches the replica.",
+)
+@click.option("--interval", default=0.2, show_default=True)
+@with_appcontext
+def run_sqlite_replicator(delay, interval):
+    """Copy the primary SQLite database to the replica, with a delay."""
+    engines = db.engines
+    if REPLICA_BIND not in engines:
+        raise click.UsageError("REPLICA_DATABASE_URI is not set")
+
+    primary, replica = engines[None].url, engines[REPLICA_BIND].url
+    if primary.get_backend_name() != "sqlite" or replica.get_backend_name() != "sqlite":
+        raise click.UsageError("Both databases must be SQLite files")
+
+    click.echo(f"Replicating {primary.database} to {replica.database} ({delay}s)")
+    SQLiteReplicator(
+        primary.database, replica.database, delay, interval
+    ).serve_forever()
+
+
+def register_commands(app: Flask):
+    """
+    Registers the CLI commands for the app.
+
+    :param app: The Flask app to register the commands with
+    """
+    app.cli.add_command(upgrade_schema_command)
+    app.cli.add_command(backfill_last_messages)
+    app.cli.add_command(backfill_message_seqs)
+    app.cli.add_command(rebuild_message_search_index)
+    app.cli.add_command(rebuild_user_search)
+    app.cli.add_command(backfill_direct_chats)
+    app.cli.add_command(run_socket_broker)
+    app.cli.add_command(run_sqlite_replicator)
@@ -9,6 +9,10 @@ class ApplicationErrors(Enum):
     AUTH_TOKEN_DECODE_ERROR = "AUTH_TOKEN_DECODE_ERROR"
     AUTH_USER_NOT_FOUND = "AUTH_USER_NOT_FOUND"
     AUTH_DATABASE_ERROR = "AUTH_DATABASE_ERROR"
+    AUTH_HASHING_BUSY = "AUTH_HASHING_BUSY"
+    DATABASE_WRITER_BUSY = "DATABASE_WRITER_BUSY"
+    REQUEST_INVALID_CURSOR = "REQUEST_INVALID_CURSOR"
+    REQUEST_RATE_LIMITED = "REQUEST_RATE_LIMITED"
 
 
 class AppException(Exception):
@@ -14,3 +14,18 @@ class UserNotFound(AppException):
             message="The user associated with the authentication token no longer exists.",
             status_code=404,
         )
+
+
+class PasswordHashingBusy(AppException):
+    def __init__(self):
+        """
+        Initializes an instance of the PasswordHashingBusy class.
+
+        :return: an instance of PasswordHashingBusy
+        """
+        super().__init__(
+            error_code=ApplicationErrors.AUTH_HASHING_BUSY,
+            error="Service busy",
+            message="Too many sign-ins are being processed. Please try again shortly.",
+            status_code=503,
+        )
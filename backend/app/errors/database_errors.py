@@ -15,3 +15,18 @@ class DatabaseError(AppException):
             message=f"An error occurred while retrieving user: {original_error}",
             status_code=500,
         )
+
+
+class MessageWriterBusy(AppException):
+    def __init__(self):
+        """
+        Initializes an instance of the MessageWriterBusy class.
+
+        :return: an instance of MessageWriterBusy
+        """
+        super().__init__(
+            error_code=ApplicationErrors.DATABASE_WRITER_BUSY,
+            error="Service busy",
+            message="Too many messages are being sent. Please try again shortly.",
+            status_code=503,
+        )
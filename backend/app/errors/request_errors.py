@@ -0,0 +1,36 @@
+import math
+
+from . import AppException, ApplicationErrors
+
+
+class InvalidCursor(AppException):
+    def __init__(self):
+        """
+        Initializes an instance of the InvalidCursor class.
+
+        :return: an instance of InvalidCursor
+        """
+        super().__init__(
+            error_code=ApplicationErrors.REQUEST_INVALID_CURSOR,
+            error="Invalid cursor",
+            message="The pagination cursor is malformed or no longer valid.",
+            status_code=400,
+        )
+
+
+class RateLimitExceeded(AppException):
+    def __init__(self, retry_after: float):
+        """
+        Initializes an instance of the RateLimitExceeded class.
+
+        :param retry_after: the number of seconds until the call is allowed
+        :return: an instance of RateLimitExceeded
+        """
+        self.retry_after = math.ceil(retry_after)
+        self.headers = {"Retry-After": str(self.retry_after)}
+        super().__init__(
+            error_code=ApplicationErrors.REQUEST_RATE_LIMITED,
+            error="Too many requests",
+            message=f"Rate limit exceeded. Try again in {self.retry_after} seconds.",
+            status_code=429,
+        )
@@ -1,5 +1,7 @@
 from flask_socketio import SocketIO
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from .utils.read_replica import RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 socketio = SocketIO()
@@ -29,6 +29,16 @@ class User(db.Model):
     )  # Optional for profile pictures
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
+    # When the user's last socket connection closed, written in batches by
+    # utils/presence.py
+    last_seen = db.Column(db.DateTime, nullable=True)
+
+    # Bumped whenever the user's list of pending chat requests changes, used
+    # to answer conditional GETs without running the list query
+    chat_requests_version = db.Column(
+        db.Integer, nullable=False, default=1, server_default="1"
+    )
+
     messages = db.relationship("Message", back_populates="author", lazy="dynamic")
     chat_memberships = db.relationship(
         "ChatMember", back_populates="member", lazy="dynamic"
@@ -48,6 +58,17 @@ class User(db.Model):
     )
 
 
+class UserSearchGram(db.Model):
+    __tablename__ = "user_search_grams"
+
+    # Trigrams of a user's name and username, maintained on write so user
+    # search can use an index instead of a leading wildcard LIKE
+    gram = db.Column(db.String(3), primary_key=True)
+    user_id = db.Column(
+        db.String, db.ForeignKey("users.id"), primary_key=True, index=True
+    )
+
+
 class Chat(db.Model):
     __tablename__ = "chats"
 
@@ -61,7 +82,25 @@ class Chat(db.Model):
         onupdate=lambda: datetime.now(timezone.utc),
     )
 
+    # Denormalized pointer to the latest message, maintained on write so the
+    # chat list never has to scan the messages table
+    last_message_id = db.Column(db.String, nullable=True)
+    last_message_at = db.Column(db.DateTime, nullable=True, index=True)
+    last_message_sender_id = db.Column(
+        db.String, db.ForeignKey("users.id"), nullable=True
+    )
+    last_message_preview = db.Column(db.String, nullable=True)
+
+    # Bumped on every change to the chat, its messages or its members'
+    # profiles, used to answer conditional GETs
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    # The sequence number of the chat's latest message, incremented in the
+    # transaction inserting each message
+    last_seq = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
     messages = db.relationship("Message", back_populates="chat", lazy="dynamic")
+    last_message_sender = db.relationship("User", foreign_keys=[last_message_sender_id])
     memberships = db.relationship(
         "ChatMember",
         back_populates="chat",
@@ -86,6 +125,14 @@ class Message(db.Model):
         db.String, db.ForeignKey("media.id"), nullable=True
     )  # For files and images
 
+    # Position of the message in its chat, 1 for the first message and
+    # without gaps, so clients can tell which messages they missed. Only
+    # NULL for messages older than the column until backfill-message-seqs.
+    seq = db.Column(db.Integer, nullable=True)
+
+    # The sender's own id for the message, so a retried send is stored once
+    client_msg_id = db.Column(db.String, nullable=True)
+
     chat = db.relationship("Chat", back_populates="messages")
     author = db.relationship("User", back_populates="messages")
     media = db.relationship("Media", back_populates="messages")
@@ -95,6 +142,13 @@ class Message(db.Model):
             "(content IS NOT NULL) OR (media_id IS NOT NULL)",
             name="check_content_or_media_id",
         ),
+        # Serves keyset pagination over a chat's history
+        db.Index("ix_messages_chat_id_sent_at_id", "chat_id", "sent_at", "id"),
+        # Serves fetching a range of a chat's messages by sequence number
+        UniqueConstraint("chat_id", "seq", name="uq_messages_chat_id_seq"),
+        UniqueConstraint(
+            "sender_id", "client_msg_id", name="uq_messages_sender_id_client_msg_id"
+        ),
     )
 
 
@@ -115,14 +169,49 @@ class ChatMember(db.Model):
     __tablename__ = "chat_members"
 
     chat_id = db.Column(db.String, db.ForeignKey("chats.id"), primary_key=True)
-    member_id = db.Column(db.String, db.ForeignKey("users.id"), primary_key=True)
+    member_id = db.Column(
+        db.String, db.ForeignKey("users.id"), primary_key=True, index=True
+    )
     member_role = db.Column(db.String, nullable=False)  # 'admin', 'member'
     joined_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(
+        db.DateTime,
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
+
+    # Read cursor: the newest message the member has read and when it was
+    # sent, plus the number of messages from others after it
+    last_read_message_id = db.Column(db.String, nullable=True)
+    last_read_at = db.Column(db.DateTime, nullable=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    # Bumped whenever the read state above changes
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
 
     chat = db.relationship("Chat", back_populates="memberships")
     member = db.relationship("User", back_populates="chat_memberships")
 
 
+class DirectChat(db.Model):
+    __tablename__ = "direct_chats"
+
+    # The two users of a one-on-one chat, stored as an ordered pair so each
+    # pair of users can only ever have one direct chat
+    user_low_id = db.Column(db.String, db.ForeignKey("users.id"), primary_key=True)
+    user_high_id = db.Column(db.String, db.ForeignKey("users.id"), primary_key=True)
+    chat_id = db.Column(
+        db.String, db.ForeignKey("chats.id"), nullable=False, unique=True
+    )
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    chat = db.relationship("Chat")
+
+    __table_args__ = (
+        CheckConstraint("user_low_id < user_high_id", name="check_direct_chat_order"),
+    )
+
+
 class ChatRequest(db.Model):
     __tablename__ = "chat_requests"
 
@@ -160,4 +249,12 @@ class ChatRequest(db.Model):
             "receiver_id",
             name="uq_chat_request_sender_receiver",
         ),
+        # Serves the paginated inbox of pending requests
+        db.Index(
+            "ix_chat_requests_receiver_status_created_at",
+            "receiver_id",
+            "status",
+            "created_at",
+            "id",
+        ),
     )
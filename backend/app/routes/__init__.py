@@ -1,5 +1,7 @@
 from .auth_route import auth
 from .chats_route import chats
+from .metrics_route import metrics
+from .sync_route import sync
 from .user_routes import users
 
-__all__ = ["auth", "chats", "users"]
+__all__ = ["auth", "chats", "metrics", "sync", "users"]
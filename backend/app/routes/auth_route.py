@@ -2,8 +2,9 @@ from datetime import timedelta
 
 from flask import Blueprint, jsonify, request
 from marshmallow import ValidationError
-from werkzeug.security import check_password_hash
 
+from ..errors.auth_errors import PasswordHashingBusy
+from ..extensions import db
 from ..models import User
 from ..schema import login_schema, signup_schema
 from ..utils.jwt_utility import (
@@ -11,7 +12,9 @@ from ..utils.jwt_utility import (
     create_refresh_token,
     refresh_access_token,
 )
+from ..utils.password_hashing import password_hasher
 from ..utils.response import send_response
+from ..utils.serializers import user_serializer
 from ..utils.user_utility import create_user
 
 auth = Blueprint("auth", __name__, url_prefix="/auth")
@@ -52,7 +55,17 @@ def login():
             status_code=404,
         )
 
-    if user and check_password_hash(user.password_hash, password):
+    if user and password_hasher.verify(user.password_hash, password):
+        # Upgrade hashes made with an older method or work factor while the
+        # plain text password is at hand. A busy hasher just defers this to
+        # the next login.
+        if password_hasher.needs_rehash(user.password_hash):
+            try:
+                user.password_hash = password_hasher.hash(password)
+                db.session.commit()
+            except PasswordHashingBusy:
+                pass
+
         token_payload = {"user_id": user.id}
 
         # Generate access and refresh tokens
@@ -67,12 +80,9 @@ def login():
             data={
                 "token": token,
                 "refreshToken": refresh_token,
-                "user": {
-                    "id": user.id,
-                    "username": user.username,
-                    "email": user.email,
-                    "profile_picture": user.profile_picture,
-                },
+                "user": user_serializer.dump(
+                    user, only=("id", "username", "email", "profile_picture")
+                ),
             },
             message="Login successful",
             status_code=200,
@@ -1,139 +1,90 @@
-from datetime import datetime, timezone
-
 from flask import Blueprint, request
-from sqlalchemy import and_, desc, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload
 
+from ..errors.request_errors import InvalidCursor
 from ..extensions import db, socketio
 from ..models import Chat, ChatMember, ChatRequest, Message, User
+from ..utils.chat_utility import (
+    build_chat_info,
+    bump_chat_requests_version,
+    create_direct_chat,
+    get_chat_list_version,
+    get_direct_chat,
+    get_direct_chats,
+)
+from ..utils.membership_cache import invalidate_chat_membership
+from ..utils.message_search import search_messages
+from ..utils.pagination import (
+    decode_cursor,
+    decode_timestamp_cursor,
+    encode_cursor,
+    get_cursor_limit,
+    is_truthy,
+    keyset_condition,
+)
 from ..utils.protected_route import access_required
-from ..utils.response import send_response
+from ..utils.read_receipts import advance_read_cursor, read_cursor_buffer
+from ..utils.read_replica import read_only_route
+from ..utils.response import (
+    is_not_modified,
+    make_etag,
+    send_not_modified,
+    send_response,
+)
+from ..utils.serializers import (
+    USER_SUMMARY_FIELDS,
+    chat_request_serializer,
+    get_fieldsets,
+    message_serializer,
+    search_result_serializer,
+    user_serializer,
+)
 
 chats = Blueprint("chats", __name__, url_prefix="/chats")
 
+# Upper bound on the number of chat requests responded to in one call
+MAX_BULK_REQUESTS = 500
+
 
 @chats.route("/", methods=["GET"], strict_slashes=False)
 @access_required
+@read_only_route
 def get_conversations(user):
-    # Subquery to get the latest message for each chat
-    last_message_subq = (
-        db.session.query(
-            Message.chat_id, func.max(Message.sent_at).label("last_sent_at")
-        )
-        .group_by(Message.chat_id)
-        .subquery()
+    # Answer polling clients from the version counters alone when nothing
+    # in their chat list changed
+    etag = make_etag(
+        "chats",
+        user.id,
+        *get_chat_list_version(user.id),
+        request.query_string.decode(),
     )
+    if is_not_modified(etag):
+        return send_not_modified(etag)
 
-    # Join the subquery with the message table to get the last message details
-    last_message = (
-        db.session.query(
-            Message.id,
-            Message.chat_id,
-            Message.content,
-            Message.sent_at,
-            Message.sender_id,
-            User.username.label("sender_username"),
-            last_message_subq.c.last_sent_at.label("last_message_sent_at"),
-        )
-        .join(
-            last_message_subq,
-            and_(
-                Message.chat_id == last_message_subq.c.chat_id,
-                Message.sent_at == last_message_subq.c.last_sent_at,
-            ),
-        )
-        .join(User, Message.sender_id == User.id)
-        .subquery()
-    )
+    fieldsets = get_fieldsets(request.args)
 
-    # Retrieve chats where the user is a member
+    # Retrieve chats where the user is a member, newest activity first. The
+    # last message is read from the pointer stored on the chat itself.
     user_chats = (
         Chat.query.join(ChatMember)
         .filter(ChatMember.member_id == user.id)
-        .options(joinedload(Chat.memberships).joinedload(ChatMember.member))
-        .outerjoin(last_message, last_message.c.chat_id == Chat.id)
-        .add_columns(
-            last_message.c.id.label("last_message_id"),
-            last_message.c.content.label("last_message_content"),
-            last_message.c.sent_at.label("last_message_sent_at"),
-            last_message.c.sender_id.label("last_message_sender_id"),
-            last_message.c.sender_username.label("last_message_sender_username"),
+        .options(
+            joinedload(Chat.memberships).joinedload(ChatMember.member),
+            joinedload(Chat.last_message_sender),
         )
-        .order_by(desc(last_message.c.last_message_sent_at))
+        .order_by(Chat.last_message_at.desc().nulls_last(), Chat.created_at.desc())
         .all()
     )
 
-    chats_data = []
-    for chat_tuple in user_chats:
-        chat = chat_tuple[0]
-        last_message_id = chat_tuple[1]
-        last_message_content = chat_tuple[2]
-        last_message_sent_at = chat_tuple[3]
-        last_message_sender_id = chat_tuple[4]
-        last_message_sender_username = chat_tuple[5]
-
-        # Determine the members data based on chat type
-        if chat.chat_type == "one-on-one":
-            # Get the friend (other member) data
-            friend_member = next(
-                (member for member in chat.memberships if member.member.id != user.id),
-                None,
-            )
-            if friend_member:
-                members_data = {
-                    "id": friend_member.member.id,
-                    "name": friend_member.member.name,
-                    "username": friend_member.member.username,
-                    "profile_picture": friend_member.member.profile_picture,
-                    "email": friend_member.member.email,
-                }
-            else:
-                # Handle the case where the friend is not found
-                members_data = None
-        else:
-            # For group chats, include all members except the current user
-            members_data = [
-                {
-                    "id": member.member.id,
-                    "name": member.member.name,
-                    "username": member.member.username,
-                    "profile_picture": member.member.profile_picture,
-                    "email": member.member.email,
-                }
-                for member in chat.memberships
-                if member.member.id != user.id
-            ]
-
-        # Also include the last message if it exists
-        if last_message_id:
-            last_message_data = {
-                "id": last_message_id,
-                "content": last_message_content,
-                "sent_at": last_message_sent_at.isoformat(),
-                "sender": {
-                    "id": last_message_sender_id,
-                    "name": last_message_sender_username,
-                },
-            }
-        else:
-            last_message_data = None  # No messages in the chat yet
-
-        chat_info = {
-            "id": chat.id,
-            "name": chat.name,
-            "chat_type": chat.chat_type,
-            "created_at": chat.created_at.isoformat(),
-            "updated_at": chat.updated_at.isoformat(),
-            "members": members_data,
-            "last_message": last_message_data,
-        }
-        chats_data.append(chat_info)
+    chats_data = [build_chat_info(chat, user, fieldsets) for chat in user_chats]
 
     return send_response(
         data=chats_data,
         message="Chats fetched successfully",
         success=True,
         status_code=200,
+        etag=etag,
     )
 
 
@@ -171,15 +122,7 @@ def handle_send_chat_request(user):
         )
 
     # Check if a chat already exists between the two users
-    existing_chat = (
-        Chat.query.filter(Chat.chat_type == "one-on-one")
-        .join(ChatMember)
-        .filter(ChatMember.member_id.in_([user.id, receiver_id]))
-        .group_by(Chat.id)
-        .having(db.func.count(Chat.id) == 2)
-        .first()
-    )
-    if existing_chat:
+    if get_direct_chat(user.id, receiver_id):
         return send_response(
             data={"error": "Chat already exists with this user."},
             message="Failed to send chat request",
@@ -204,17 +147,13 @@ def handle_send_chat_request(user):
         sender_id=user.id, receiver_id=receiver_id, status="pending"
     )
     db.session.add(chat_request)
+    bump_chat_requests_version(receiver_id)
     db.session.commit()
 
     # Notify the receiver via WebSocket
     notification_data = {
         "chat_id": chat_request.id,
-        "sender": {
-            "id": user.id,
-            "name": user.name,
-            "username": user.username,
-            "profile_picture": user.profile_picture,
-        },
+        "sender": user_serializer.dump(user, only=USER_SUMMARY_FIELDS),
         "created_at": chat_request.created_at.isoformat(),
     }
 
@@ -252,94 +191,120 @@ def respond_to_chat_request(user, request_id):
             success=False,
         )
 
-    chat_request.status = status
-    db.session.commit()
+    _respond_to_chat_requests(user, [chat_request], status)
 
-    if status == "accepted":
-        # Create a new chat
-        chat = Chat(chat_type="one-on-one")
-        db.session.add(chat)
-        db.session.commit()
-
-        # Add both users to the chat
-        member1 = ChatMember(
-            chat_id=chat.id,
-            member_id=chat_request.sender_id,
-            member_role="member",
-            joined_at=datetime.now(timezone.utc),
-        )
-        member2 = ChatMember(
-            chat_id=chat.id,
-            member_id=user.id,
-            member_role="member",
-            joined_at=datetime.now(timezone.utc),
-        )
-        db.session.add_all([member1, member2])
-        db.session.commit()
+    return send_response(
+        message="Chat request responded successfully", success=True, status_code=200
+    )
 
-        response_data = {
-            "request_id": request_id,
-            "status": "accepted",
-            "chat_id": chat.id,
-            "chat_type": chat.chat_type,
-            "created_at": chat.created_at.isoformat(),
-        }
 
-        socketio.emit(
-            "chat-request:accepted",
-            response_data,
-            to=f"user_{chat_request.sender_id}",
-        )
-    else:
-        chat_request.status = status
-        db.session.commit()
+@chats.route("/requests/receive", methods=["PUT"])
+@access_required
+def respond_to_chat_requests(user):
+    data = request.get_json()
+    status = data.get("status")
+    request_ids = data.get("request_ids")
 
-        # Notify the sender about the request rejection
-        response_data = {"request_id": request_id, "status": "rejected"}
-        socketio.emit(
-            "chat-request:rejected",
-            response_data,
-            to=f"user_{chat_request.sender_id}",
+    if status not in ["accepted", "rejected"]:
+        return send_response(message="Invalid status", status_code=400, success=False)
+
+    if (
+        not isinstance(request_ids, list)
+        or not request_ids
+        or len(request_ids) > MAX_BULK_REQUESTS
+    ):
+        return send_response(
+            message=f"Between 1 and {MAX_BULK_REQUESTS} request IDs are required",
+            status_code=400,
+            success=False,
         )
 
+    chat_requests = ChatRequest.query.filter(
+        ChatRequest.id.in_(request_ids),
+        ChatRequest.receiver_id == user.id,
+        ChatRequest.status == "pending",
+    ).all()
+
+    responded = set(_respond_to_chat_requests(user, chat_requests, status))
+
+    # Report the requests that were missing or already responded to
+    failed_ids = [
+        request_id
+        for request_id in dict.fromkeys(request_ids)
+        if request_id not in responded
+    ]
+
     return send_response(
-        message="Chat request responded successfully", success=True, status_code=200
+        data={"responded": sorted(responded), "failed": failed_ids},
+        message="Chat requests responded successfully",
+        success=True,
+        status_code=200,
     )
 
 
 @chats.route("/requests", methods=["GET"])
 @access_required
+@read_only_route
 def get_chat_requests(user):
-    # Fetch all pending chat requests received by the user
-    pending_requests = ChatRequest.query.filter_by(
-        receiver_id=user.id, status="pending"
-    ).all()
+    limit = get_cursor_limit(request.args)
+    cursor = request.args.get("cursor")
 
-    requests_data = []
-    for request in pending_requests:
-        sender = User.query.get(request.sender_id)
-        request_info = {
-            "id": request.id,
-            "sender": {
-                "id": request.sender_id,
-                "name": sender.name if sender else None,
-                "username": sender.username if sender else None,
-                "profile_picture": sender.profile_picture if sender else None,
-            },
-            "created_at": request.created_at.isoformat(),
-        }
-        requests_data.append(request_info)
+    requests_version = (
+        db.session.query(User.chat_requests_version).filter_by(id=user.id).scalar()
+    )
+    etag = make_etag(
+        "chat-requests", user.id, requests_version, request.query_string.decode()
+    )
+    if is_not_modified(etag):
+        return send_not_modified(etag)
+
+    fieldsets = get_fieldsets(request.args)
+
+    # Fetch a page of the pending chat requests received by the user, newest
+    # first, together with their senders
+    query = (
+        ChatRequest.query.filter_by(receiver_id=user.id, status="pending")
+        .options(joinedload(ChatRequest.sender))
+        .order_by(ChatRequest.created_at.desc(), ChatRequest.id.desc())
+    )
+    if cursor:
+        created_at, request_id = decode_timestamp_cursor(cursor)
+        query = query.filter(
+            keyset_condition(
+                ChatRequest.created_at, ChatRequest.id, created_at, request_id
+            )
+        )
+
+    pending_requests = query.limit(limit + 1).all()
+    has_more = len(pending_requests) > limit
+    pending_requests = pending_requests[:limit]
+
+    requests_data = chat_request_serializer.dump_many(
+        pending_requests, only=("id", "sender", "created_at"), fieldsets=fieldsets
+    )
+
+    pagination_info = {
+        "limit": limit,
+        "has_more": has_more,
+        "next_cursor": (
+            encode_cursor(pending_requests[-1].created_at, pending_requests[-1].id)
+            if has_more
+            else None
+        ),
+    }
 
     return send_response(
-        data=requests_data,
+        data={"requests": requests_data, "pagination": pagination_info},
         message="Chat requests fetched successfully",
         success=True,
         status_code=200,
+        etag=etag,
     )
 
 
 @chats.route("/<string:chat_id>/messages", methods=["GET"])
 @access_required
+@read_only_route
 def get_chat_messages(user, chat_id):
     is_member = ChatMember.query.filter_by(chat_id=chat_id, member_id=user.id).first()
     if not is_member:
@@ -347,6 +312,16 @@ def get_chat_messages(user, chat_id):
             message="You are not a member of this chat.", success=False, status_code=403
         )
 
+    # The page only changes when the chat's version does
+    chat_version = db.session.query(Chat.version).filter_by(id=chat_id).scalar()
+    etag = make_etag(
+        "messages", user.id, chat_id, chat_version, request.query_string.decode()
+    )
+    if is_not_modified(etag):
+        return send_not_modified(etag)
+
+    fieldsets = get_fieldsets(request.args)
+
     # Fetch the chat with its members
     chat = (
         Chat.query.filter_by(id=chat_id)
@@ -362,14 +337,9 @@ def get_chat_messages(user, chat_id):
             (member for member in chat.memberships if member.member_id != user.id), None
         )
         if friend_member:
-            friend = friend_member.member
-            friend_data = {
-                "id": friend.id,
-                "name": friend.name,
-                "username": friend.username,
-                "profile_picture": friend.profile_picture,
-                "email": friend.email,
-            }
+            friend_data = user_serializer.dump(
+                friend_member.member, fieldsets=fieldsets
+            )
         else:
             return send_response(
                 message="Friend not found in the chat.", success=False, status_code=404
@@ -378,7 +348,156 @@ def get_chat_messages(user, chat_id):
         # For group chats, fetch the friend's data
         friend_data = None
 
-    # Pagination parameters
+    # Cursor mode is used as soon as the client passes `before` or `after`. An
+    # empty `before` starts from the newest message.
+    if "before" in request.args or "after" in request.args:
+        messages, pagination_info = _paginate_messages_by_cursor(chat_id)
+    else:
+        messages, pagination_info = _paginate_messages_by_page(chat_id)
+
+    # Build messages data
+    messages_data = message_serializer.dump_many(
+        messages,
+        only=("id", "seq", "content", "sent_at", "sender"),
+        fieldsets=fieldsets,
+    )
+
+    response_data = {
+        "friend": friend_data,
+        "messages": messages_data,
+        "pagination": pagination_info,
+    }
+
+    return send_response(
+        data=response_data,
+        message="Messages fetched successfully",
+        success=True,
+        status_code=200,
+        etag=etag,
+    )
+
+
+@chats.route("/<string:chat_id>/read", methods=["POST"])
+@access_required
+def mark_chat_read(user, chat_id):
+    data = request.get_json(silent=True) or {}
+
+    membership = ChatMember.query.filter_by(chat_id=chat_id, member_id=user.id).first()
+    if not membership:
+        return send_response(
+            message="You are not a member of this chat.", success=False, status_code=403
+        )
+
+    # Without a message id everything up to the latest message is read
+    message_id = data.get("message_id")
+    if not message_id:
+        chat = Chat.query.get(chat_id)
+        message_id = chat.last_message_id if chat else None
+
+    if message_id:
+        # This write supersedes any cursor still buffered from the socket
+        read_cursor_buffer.discard(chat_id, user.id)
+        membership = advance_read_cursor(chat_id, user.id, message_id)
+        if not membership:
+            return send_response(
+                message="Message not found in this chat.",
+                success=False,
+                status_code=404,
+            )
+
+    return send_response(
+        data={
+            "chat_id": chat_id,
+            "last_read_message_id": membership.last_read_message_id,
+            "unread_count": membership.unread_count,
+        },
+        message="Chat marked as read",
+        success=True,
+        status_code=200,
+    )
+
+
+@chats.route("/messages/search", methods=["GET"])
+@access_required
+def search_all_messages(user):
+    return _search_messages_response(user)
+
+
+@chats.route("/<string:chat_id>/messages/search", methods=["GET"])
+@access_required
+def search_chat_messages(user, chat_id):
+    is_member = ChatMember.query.filter_by(chat_id=chat_id, member_id=user.id).first()
+    if not is_member:
+        return send_response(
+            message="You are not a member of this chat.", success=False, status_code=403
+        )
+
+    return _search_messages_response(user, chat_id)
+
+
+def _search_messages_response(user, chat_id=None):
+    """
+    Run a full-text search over the user's messages and build the response.
+
+    Results are ranked by relevance and paginated with an opaque `cursor`.
+
+    Returns:
+        A JSON response with the ranked results and the pagination info
+    """
+    search_query = request.args.get("query", "").strip()
+    limit = get_cursor_limit(request.args)
+    if not search_query:
+        return send_response(
+            data={
+                "results": [],
+                "pagination": {"limit": limit, "has_more": False, "next_cursor": None},
+            },
+            message="No search query provided",
+            success=True,
+            status_code=200,
+        )
+
+    after = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        score, message_id = decode_cursor(cursor)
+        if not isinstance(score, (int, float)):
+            raise InvalidCursor()
+        after = (score, message_id)
+
+    rows, has_more = search_messages(
+        user.id, search_query, chat_id=chat_id, after=after, limit=limit
+    )
+
+    results = search_result_serializer.dump_many(
+        rows, fieldsets=get_fieldsets(request.args)
+    )
+
+    pagination_info = {
+        "limit": limit,
+        "has_more": has_more,
+        "next_cursor": (
+            encode_cursor(rows[-1].score, rows[-1].id) if has_more else None
+        ),
+    }
+
+    return send_response(
+        data={"results": results, "pagination": pagination_info},
+        message="Messages fetched successfully",
+        success=True,
+        status_code=200,
+    )
+
+
+def _paginate_messages_by_page(chat_id):
+    """
+    Offset pagination over a chat's history, oldest message first.
+
+    Kept for clients that still send `page`/`per_page`.
+
+    Returns:
+        tuple: (messages, pagination_info)
+    """
     page = request.args.get("page", 1, type=int)
     per_page = request.args.get("per_page", 10, type=int)
 
@@ -388,23 +507,6 @@ def get_chat_messages(user, chat_id):
         .order_by(Message.sent_at.asc())
         .paginate(page=page, per_page=per_page, error_out=False)
     )
-    messages = pagination.items
-
-    # Build messages data
-    messages_data = [
-        {
-            "id": message.id,
-            "content": message.content,
-            "sent_at": message.sent_at.isoformat(),
-            "sender": {
-                "id": message.sender_id,
-                "name": message.author.name,
-                "username": message.author.username,
-                "profile_picture": message.author.profile_picture,
-            },
-        }
-        for message in messages
-    ]
 
     pagination_info = {
         "page": pagination.page,
@@ -413,15 +515,151 @@ def get_chat_messages(user, chat_id):
         "total_items": pagination.total,
     }
 
-    response_data = {
-        "friend": friend_data,
-        "messages": messages_data,
-        "pagination": pagination_info,
+    return pagination.items, pagination_info
+
+
+def _paginate_messages_by_cursor(chat_id):
+    """
+    Keyset pagination over a chat's history using `(sent_at, id)` cursors.
+
+    Without a cursor the newest page is returned. `before` walks towards older
+    messages and `after` towards newer ones. Messages within a page are always
+    returned oldest first. The total count is only computed when the client
+    asks for it with `include_total`.
+
+    Returns:
+        tuple: (messages, pagination_info)
+    """
+    limit = get_cursor_limit(request.args)
+    before = request.args.get("before")
+    after = request.args.get("after")
+
+    query = Message.query.filter_by(chat_id=chat_id).options(joinedload(Message.author))
+
+    if after:
+        sent_at, message_id = decode_timestamp_cursor(after)
+        query = query.filter(
+            keyset_condition(
+                Message.sent_at, Message.id, sent_at, message_id, before=False
+            )
+        ).order_by(Message.sent_at.asc(), Message.id.asc())
+    else:
+        if before:
+            sent_at, message_id = decode_timestamp_cursor(before)
+            query = query.filter(
+                keyset_condition(Message.sent_at, Message.id, sent_at, message_id)
+            )
+        query = query.order_by(Message.sent_at.desc(), Message.id.desc())
+
+    # Fetch one extra row to know whether there is another page
+    messages = query.limit(limit + 1).all()
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    if not after:
+        messages.reverse()
+
+    pagination_info = {
+        "limit": limit,
+        "has_more": has_more,
+        "before": (
+            encode_cursor(messages[0].sent_at, messages[0].id) if messages else None
+        ),
+        "after": (
+            encode_cursor(messages[-1].sent_at, messages[-1].id) if messages else None
+        ),
     }
 
-    return send_response(
-        data=response_data,
-        message="Messages fetched successfully",
-        success=True,
-        status_code=200,
-    )
+    if is_truthy(request.args.get("include_total")):
+        pagination_info["total_items"] = Message.query.filter_by(
+            chat_id=chat_id
+        ).count()
+
+    return messages, pagination_info
+
+
+def _respond_to_chat_requests(user, chat_requests, status):
+    """
+    Accept or reject pending chat requests received by the user in a single
+    transaction and notify their senders.
+
+    Accepting reuses the direct chat a pair of users already has, or creates
+    it. If a concurrent accept creates one of the chats first, the unique pair
+    key makes the commit fail and the whole batch is retried once, which then
+    picks up the chat created by the other request.
+
+    Args:
+        user: The user the requests were sent to
+        chat_requests (list): The pending ChatRequest rows
+        status (str): "accepted" or "rejected"
+
+    Returns:
+        list: The ids of the requests that were responded to
+    """
+    request_ids = [chat_request.id for chat_request in chat_requests]
+
+    for attempt in range(2):
+        notifications = []
+        changed_chat_ids = set()
+        try:
+            direct_chats = (
+                get_direct_chats(
+                    user.id, [chat_request.sender_id for chat_request in chat_requests]
+                )
+                if status == "accepted"
+                else {}
+            )
+
+            for chat_request in chat_requests:
+                chat_request.status = status
+
+                if status == "accepted":
+                    direct_chat = direct_chats.get(chat_request.sender_id)
+                    chat = (
+                        direct_chat.chat
+                        if direct_chat
+                        else create_direct_chat(chat_request.sender_id, user.id)
+                    )
+                    changed_chat_ids.add(chat.id)
+                    response_data = {
+                        "request_id": chat_request.id,
+                        "status": "accepted",
+                        "chat_id": chat.id,
+                        "chat_type": chat.chat_type,
+                        "created_at": chat.created_at.isoformat(),
+                    }
+                else:
+                    response_data = {
+                        "request_id": chat_request.id,
+                        "status": "rejected",
+                    }
+
+                notifications.append((chat_request.sender_id, response_data))
+
+            if notifications:
+                bump_chat_requests_version(user.id)
+            db.session.commit()
+            break
+        except IntegrityError:
+            db.session.rollback()
+            if attempt:
+                raise
+
+            chat_requests = ChatRequest.query.filter(
+                ChatRequest.id.in_(request_ids), ChatRequest.status == "pending"
+            ).all()
+
+    # Accepting only ever adds memberships, but drop what is cached for the
+    # chats anyway so every membership change goes through the same path
+    for chat_id in changed_chat_ids:
+        invalidate_chat_membership(chat_id=chat_id)
+
+    # Notify the senders about the response
+    for sender_id, response_data in notifications:
+        socketio.emit(
+            f"chat-request:{status}",
+            response_data,
+            to=f"user_{sender_id}",
+        )
+
+    return [response_data["request_id"] for _, response_data in notifications]
@@ -0,0 +1,39 @@
+from flask import Blueprint
+
+from ..utils.auth_cache import token_cache
+from ..utils.emit_coalescer import emit_coalescer
+from ..utils.membership_cache import contacts_cache, membership_cache
+from ..utils.message_writer import message_writer
+from ..utils.presence import presence
+from ..utils.protected_route import access_required
+from ..utils.rate_limit import rate_limiter
+from ..utils.read_replica import replica_stats
+from ..utils.response import send_response
+from ..utils.sent_messages import sent_message_cache
+
+metrics = Blueprint("metrics", __name__, url_prefix="/metrics")
+
+
+@metrics.route("/", methods=["GET"], strict_slashes=False)
+@access_required
+def get_metrics(user):
+    """
+    Return the counters of the in-process caches of the worker serving the
+    request.
+    """
+    return send_response(
+        data={
+            "token_cache": token_cache.stats(),
+            "membership_cache": membership_cache.stats(),
+            "contacts_cache": contacts_cache.stats(),
+            "sent_message_cache": sent_message_cache.stats(),
+            "presence": presence.stats(),
+            "emit_coalescer": emit_coalescer.stats(),
+            "message_writer": message_writer.stats(),
+            "rate_limits": rate_limiter.stats(),
+            "read_replica": replica_stats(),
+        },
+        message="Metrics fetched successfully",
+        success=True,
+        status_code=200,
+    )
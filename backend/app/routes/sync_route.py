@@ -0,0 +1,179 @@
+from datetime import datetime, timedelta, timezone
+
+from flask import Blueprint, current_app, request
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
+
+from ..models import Chat, ChatMember, ChatRequest, Message
+from ..utils.chat_utility import build_chat_info
+from ..utils.pagination import (
+    decode_timestamp_cursor,
+    encode_cursor,
+    keyset_condition,
+)
+from ..utils.protected_route import access_required
+from ..utils.response import send_response
+from ..utils.serializers import (
+    chat_request_serializer,
+    get_fieldsets,
+    membership_serializer,
+    message_serializer,
+)
+
+sync = Blueprint("sync", __name__, url_prefix="/sync")
+
+DEFAULT_SYNC_MESSAGE_LIMIT = 500
+
+# Changes are read back this far behind the clock, so rows written by
+# transactions that were still in flight when a cursor was issued are not
+# skipped. Clients de-duplicate by id.
+SYNC_CLOCK_SKEW = timedelta(seconds=5)
+
+
+@sync.route("/", methods=["GET"], strict_slashes=False)
+@access_required
+def get_changes(user):
+    """
+    Return everything that changed for the user since a sync cursor.
+
+    Without `since`, no changes are returned, only a cursor to start syncing
+    from after the client has loaded its initial state. Messages are bounded
+    per call; while `has_more` is true the client should call again with the
+    returned cursor. The changed chats, memberships and chat requests are only
+    sent by the first of those calls, the following ones continue the
+    messages of the same change window, which ends when its first page was
+    read. The next window starts from there.
+    """
+    since = request.args.get("since")
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    if not since:
+        return send_response(
+            data={
+                "chats": [],
+                "memberships": [],
+                "chat_requests": [],
+                "messages": [],
+                "cursor": encode_cursor(now - SYNC_CLOCK_SKEW, None),
+                "has_more": False,
+            },
+            message="Sync cursor created",
+            success=True,
+            status_code=200,
+        )
+
+    changed_since, page_cursor = decode_timestamp_cursor(since)
+    window_end, message_cursor = now, None
+    if page_cursor:
+        # The later pages of a window keep the time its first page was read
+        window_end, message_cursor = decode_timestamp_cursor(page_cursor)
+    fieldsets = get_fieldsets(request.args)
+    message_limit = current_app.config.get(
+        "SYNC_MESSAGE_LIMIT", DEFAULT_SYNC_MESSAGE_LIMIT
+    )
+
+    user_chat_ids = (
+        ChatMember.query.with_entities(ChatMember.chat_id)
+        .filter(ChatMember.member_id == user.id)
+        .scalar_subquery()
+    )
+
+    if page_cursor:
+        # The rest of the change window was sent with its first page
+        changed_chats, changed_memberships, changed_requests = [], [], []
+    else:
+        # Chats whose details or last message changed
+        changed_chats = (
+            Chat.query.filter(
+                Chat.id.in_(user_chat_ids), Chat.updated_at > changed_since
+            )
+            .options(
+                joinedload(Chat.memberships).joinedload(ChatMember.member),
+                joinedload(Chat.last_message_sender),
+            )
+            .all()
+        )
+
+        # The user's own memberships with a new read state, and members who
+        # joined the user's chats
+        changed_memberships = ChatMember.query.filter(
+            ChatMember.chat_id.in_(user_chat_ids),
+            or_(
+                ChatMember.joined_at > changed_since,
+                (ChatMember.member_id == user.id)
+                & (ChatMember.updated_at > changed_since),
+            ),
+        ).all()
+
+        # Requests sent or received by the user that were created or responded to
+        changed_requests = ChatRequest.query.filter(
+            or_(ChatRequest.receiver_id == user.id, ChatRequest.sender_id == user.id),
+            ChatRequest.updated_at > changed_since,
+        ).all()
+
+    # New messages in the user's chats up to the end of the window, oldest
+    # first, continuing from the last message of the previous call
+    messages_query = Message.query.filter(
+        Message.chat_id.in_(user_chat_ids), Message.sent_at <= window_end
+    )
+    if message_cursor:
+        message_sent_at, message_id = decode_timestamp_cursor(message_cursor)
+        messages_query = messages_query.filter(
+            keyset_condition(
+                Message.sent_at, Message.id, message_sent_at, message_id, before=False
+            )
+        )
+    else:
+        messages_query = messages_query.filter(Message.sent_at > changed_since)
+
+    messages = (
+        messages_query.order_by(Message.sent_at.asc(), Message.id.asc())
+        .limit(message_limit + 1)
+        .all()
+    )
+    has_more = len(messages) > message_limit
+    messages = messages[:message_limit]
+
+    if has_more:
+        # Keep the change window and resume the messages where we stopped
+        cursor = encode_cursor(
+            changed_since,
+            encode_cursor(
+                window_end, encode_cursor(messages[-1].sent_at, messages[-1].id)
+            ),
+        )
+    else:
+        # Everything that changed after the window's first page was read is
+        # sent by the next window
+        cursor = encode_cursor(window_end - SYNC_CLOCK_SKEW, None)
+
+    return send_response(
+        data={
+            "chats": [build_chat_info(chat, user, fieldsets) for chat in changed_chats],
+            "memberships": membership_serializer.dump_many(
+                changed_memberships, fieldsets=fieldsets
+            ),
+            "chat_requests": chat_request_serializer.dump_many(
+                changed_requests,
+                only=(
+                    "id",
+                    "sender_id",
+                    "receiver_id",
+                    "status",
+                    "created_at",
+                    "updated_at",
+                ),
+                fieldsets=fieldsets,
+            ),
+            "messages": message_serializer.dump_many(
+                messages,
+                only=("id", "seq", "content", "sent_at", "chat_id", "sender_id"),
+                fieldsets=fieldsets,
+            ),
+            "cursor": cursor,
+            "has_more": has_more,
+        },
+        message="Changes fetched successfully",
+        success=True,
+        status_code=200,
+    )
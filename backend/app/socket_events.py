@@ -1,16 +1,43 @@
-from flask import request, session
+from flask import current_app, request, session
 from flask_socketio import disconnect, emit, join_room, leave_room
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
+from .errors.database_errors import MessageWriterBusy
+from .errors.request_errors import RateLimitExceeded
 from .extensions import db, socketio
-from .models import ChatMember, Message, User
+from .models import Message, User
+from .utils.chat_utility import (
+    DEFAULT_FETCH_RANGE_LIMIT,
+    fetch_message_range,
+    parse_message_range,
+    socket_message_payload,
+    store_message,
+)
+from .utils.emit_coalescer import emit_coalescer
 from .utils.jwt_utility import get_user_id_from_token
-
-connect_users = {}
+from .utils.membership_cache import authorize_chat
+from .utils.message_writer import message_writer
+from .utils.presence import presence
+from .utils.rate_limit import rate_limited_event, rate_limiter
+from .utils.read_receipts import read_cursor_buffer
+from .utils.read_replica import set_session_user
+from .utils.sent_messages import (
+    find_sent_message,
+    get_sent_message_ack,
+    is_valid_client_msg_id,
+    message_ack,
+    remember_sent_message,
+)
 
 
 @socketio.on("connect")
 def handle_connect(auth):
+    # Throttle reconnect storms by client address
+    try:
+        rate_limiter.hit("connect", request.remote_addr)
+    except RateLimitExceeded:
+        return False  # Reject the connection
+
     token = auth.get("token") if auth else None
 
     if not token and "Authorization" in request.headers:
@@ -35,8 +62,8 @@ def handle_connect(auth):
     session["user_id"] = user_id
     session["user"] = {"id": user.id, "name": user.name, "username": user.username}
 
-    # Add user to the list of connected users
-    connect_users[user_id] = request.sid
+    # Add user to the connected users shared by all workers
+    presence.connect(user_id, request.sid)
 
     # User joins their own room for personal notifications
     join_room(f"user_{user_id}")
@@ -46,6 +73,7 @@ def handle_connect(auth):
 
 
 @socketio.on("join-chat")
+@rate_limited_event("join-chat")
 def handle_join_chat(data):
     user_id = session.get("user_id")
     if not user_id:
@@ -58,8 +86,7 @@ def handle_join_chat(data):
         return False
 
     # Check if user is a member of the chat
-    is_member = ChatMember.query.filter_by(chat_id=chat_id, member_id=user_id).first()
-    if not is_member:
+    if not authorize_chat(session, chat_id, user_id):
         emit("error", {"message": "You are not a member of this chat"})
         return False
 
@@ -68,6 +95,7 @@ def handle_join_chat(data):
 
 
 @socketio.on("send-message")
+@rate_limited_event("send-message", error_event="send-message:error")
 def handle_send_message(data):
     user_id = session.get("user_id")
     if not user_id:
@@ -76,6 +104,7 @@ def handle_send_message(data):
 
     chat_id = data.get("chat_id")
     content = data.get("content")
+    client_msg_id = data.get("client_msg_id")
 
     if not chat_id or not content:
         emit(
@@ -84,36 +113,143 @@ def handle_send_message(data):
         )
         return False
 
-    # Check if user is a member of the chat
-    is_member = ChatMember.query.filter_by(chat_id=chat_id, member_id=user_id).first()
-    if not is_member:
+    if client_msg_id is not None and not is_valid_client_msg_id(client_msg_id):
+        emit("send-message:error", {"message": "Invalid client message ID"})
+        return False
+
+    # Check if user is a member of the chat, usually answered from the
+    # chats the connection has already joined
+    if not authorize_chat(session, chat_id, user_id):
         emit("send-message:error", {"message": "You are not a member of this chat"})
         return False
 
-    # Create a new message
-    message = Message(content=content, sender_id=user_id, chat_id=chat_id)
+    # A retry of a message this worker just stored is acked again without
+    # being stored or broadcast twice
+    if client_msg_id:
+        ack = get_sent_message_ack(user_id, client_msg_id)
+        if ack:
+            return ack
 
+    # Create a new message
+    message = Message(
+        content=content,
+        sender_id=user_id,
+        chat_id=chat_id,
+        client_msg_id=client_msg_id,
+    )
+
+    set_session_user(user_id)
     try:
-        db.session.add(message)
-        db.session.commit()
-
-        # Prepare message data
-        message_data = {
-            "id": message.id,
-            "content": message.content,
-            "sent_at": message.sent_at.isoformat(),
-            "chat_id": chat_id,
-            "sender_id": user_id,
-        }
+        if message_writer.enabled:
+            # Committed together with the other messages waiting for the
+            # writer thread, the message is only emitted once it is durable.
+            # Return this thread's connection to the pool first, or waiting
+            # handlers can leave the writer without one.
+            db.session.close()
+            message = message_writer.write(message)
+        else:
+            store_message(message)
+            db.session.commit()
+    except MessageWriterBusy as e:
+        emit("send-message:error", {"message": e.message})
+        return False
+    except IntegrityError as e:
+        db.session.rollback()
 
-        emit("new-message", message_data, room=f"chat_{chat_id}")
+        # A retry that reached another worker, or raced the original, hits
+        # the unique (sender_id, client_msg_id) constraint
+        original = client_msg_id and find_sent_message(user_id, client_msg_id)
+        if original:
+            remember_sent_message(original)
+            return message_ack(original, duplicate=True)
+
+        emit("send-message:error", {"message": str(e)})
+        return False
     except SQLAlchemyError as e:
         db.session.rollback()
         emit("send-message:error", {"message": str(e)})
         return False
 
+    remember_sent_message(message)
+
+    # Prepare message data
+    message_data = socket_message_payload(message)
+
+    # Busy rooms get their messages in batches when coalescing is on
+    emit_coalescer.emit(
+        "new-message",
+        message_data,
+        room=f"chat_{chat_id}",
+        batch_event="new-messages",
+    )
+
+    # Acknowledge the send with the server id and sequence number
+    return message_ack(message)
+
+
+@socketio.on("mark-read")
+@rate_limited_event("mark-read")
+def handle_mark_read(data):
+    user_id = session.get("user_id")
+    if not user_id:
+        disconnect()
+        return False
+
+    chat_id = data.get("chat_id")
+    message_id = data.get("message_id")
+
+    if not chat_id or not message_id:
+        emit(
+            "error",
+            {"message": "Chat ID and message ID are required to mark a chat as read"},
+        )
+        return False
+
+    # Read cursors are buffered and written in batches, the membership is
+    # checked when the buffer is flushed
+    read_cursor_buffer.add(chat_id, user_id, message_id)
+
+
+@socketio.on("fetch-range")
+@rate_limited_event("fetch-range")
+def handle_fetch_range(data):
+    user_id = session.get("user_id")
+    if not user_id:
+        disconnect()
+        return False
+
+    message_range = parse_message_range(
+        data,
+        current_app.config.get("FETCH_RANGE_LIMIT", DEFAULT_FETCH_RANGE_LIMIT),
+    )
+    if not message_range:
+        emit(
+            "error",
+            {"message": "Chat ID and a valid from_seq and to_seq are required"},
+        )
+        return False
+
+    chat_id, from_seq, to_seq = message_range
+    if not authorize_chat(session, chat_id, user_id):
+        emit("error", {"message": "You are not a member of this chat"})
+        return False
+
+    # Answered from the (chat_id, seq) index, so repairing a gap costs one
+    # small read
+    messages = fetch_message_range(chat_id, from_seq, to_seq)
+    emit(
+        "fetched-range",
+        {
+            "chat_id": chat_id,
+            "from_seq": from_seq,
+            "to_seq": to_seq,
+            "messages": [socket_message_payload(message) for message in messages],
+        },
+    )
+
 
 @socketio.on("leave_chat")
+@rate_limited_event("leave_chat")
 def handle_leave_chat(data):
     user_id = session.get("user_id")
     if not user_id:
@@ -134,8 +270,8 @@ def handle_leave_chat(data):
 @socketio.on("disconnect")
 def handle_disconnect():
     user_id = session.get("user_id")
-    if user_id in connect_users:
-        # Remove user from the list of connected users
-        del connect_users[user_id]
+    if user_id:
+        # Remove user from the connected users
+        presence.disconnect(user_id, request.sid)
     print(f"User {user_id} disconnected from the socket")
     print(f"🔴 :: Client disconnected from the socket")
@@ -0,0 +1,87 @@
+import os
+
+from flask import Flask
+from sqlalchemy.engine import make_url
+
+from .database_engine import (
+    apply_sqlite_pragmas,
+    get_engine_options,
+    get_sqlite_pragmas,
+)
+
+try:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+except ImportError:  # pragma: no cover - optional dependency
+    async_sessionmaker = create_async_engine = None
+
+# The asyncio driver used for each database backend
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+}
+
+
+def get_async_database_uri(app: Flask):
+    """
+    Get the database URI of the asyncio server.
+
+    ASYNC_DATABASE_URI is used when set, otherwise SQLALCHEMY_DATABASE_URI
+    with its driver swapped for the asyncio one, e.g. sqlite+aiosqlite.
+
+    Args:
+        app (Flask): The Flask app to read the config from
+
+    Returns:
+        str: The database URI
+    """
+    uri = app.config.get("ASYNC_DATABASE_URI")
+    if uri:
+        return uri
+
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(
+            f"No asyncio driver known for {backend}, set ASYNC_DATABASE_URI"
+        )
+
+    if backend == "sqlite" and url.database and url.database != ":memory:":
+        # Flask-SQLAlchemy resolves relative SQLite paths against the
+        # instance folder, so both servers must open the same file
+        url = url.set(database=_resolve_sqlite_path(app, url.database))
+
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(
+        hide_password=False
+    )
+
+
+def _resolve_sqlite_path(app: Flask, database: str):
+    if os.path.isabs(database):
+        return database
+    return os.path.join(app.instance_path, database)
+
+
+def create_async_sessionmaker(app: Flask):
+    """
+    Create the session factory of the asyncio server.
+
+    Sessions do not expire their objects on commit, so handlers can keep
+    reading a message after committing it, like with the sync session. The
+    engine gets the same pool options and SQLite pragmas as the sync one.
+
+    Args:
+        app (Flask): The Flask app to read the config from
+
+    Returns:
+        async_sessionmaker: The session factory
+    """
+    if create_async_engine is None:
+        raise RuntimeError(
+            "The asyncio server requires sqlalchemy[asyncio] and an asyncio driver"
+        )
+
+    uri = get_async_database_uri(app)
+    engine = create_async_engine(uri, **get_engine_options(app, uri))
+    apply_sqlite_pragmas(engine.sync_engine, get_sqlite_pragmas(app))
+    return async_sessionmaker(engine, expire_on_commit=False)
@@ -0,0 +1,101 @@
+import hashlib
+import time
+from typing import NamedTuple
+
+from .cache import TTLCache
+
+DEFAULT_TOKEN_CACHE_SIZE = 10000
+DEFAULT_TOKEN_CACHE_TTL = 60
+
+
+class UserSnapshot(NamedTuple):
+    """
+    The fields of the current user that protected routes read, detached from
+    the database session so it can be cached across requests.
+    """
+
+    id: str
+    name: str
+    username: str
+    email: str
+    profile_picture: str
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            id=user.id,
+            name=user.name,
+            username=user.username,
+            email=user.email,
+            profile_picture=user.profile_picture,
+        )
+
+
+# Verified token claims and the snapshot of their user, keyed by the
+# token's digest
+token_cache = TTLCache(DEFAULT_TOKEN_CACHE_SIZE)
+
+
+def token_digest(token: str):
+    """
+    Hash a token into its cache key, so raw tokens are never kept in memory
+    longer than the request.
+
+    Args:
+        token (str): The raw JWT
+
+    Returns:
+        str: The SHA-256 hex digest of the token
+    """
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def get_cached_token(token: str):
+    """
+    Look up a previously verified token.
+
+    Args:
+        token (str): The raw JWT
+
+    Returns:
+        tuple: (claims, user_snapshot), or None if the token is not cached
+    """
+    return token_cache.get(token_digest(token))
+
+
+def cache_token(token: str, claims: dict, user_snapshot: UserSnapshot, ttl: float):
+    """
+    Remember a verified token and its user.
+
+    The entry never outlives the token's own expiry.
+
+    Args:
+        token (str): The raw JWT
+        claims (dict): The verified claims
+        user_snapshot (UserSnapshot): The token's user
+        ttl (float): The maximum number of seconds to keep the entry
+    """
+    expires_at = claims.get("exp")
+    if expires_at is not None:
+        ttl = min(ttl, expires_at - time.time())
+
+    token_cache.set(
+        token_digest(token),
+        (claims, user_snapshot),
+        ttl,
+        tags=(user_snapshot.id,),
+    )
+
+
+def invalidate_user_tokens(user_id: str):
+    """
+    Drop the cached tokens of a user, e.g. after their profile changed or
+    their account was deleted.
+
+    Only the cache of the current process is cleared, other processes pick
+    up the change once their entries expire after TOKEN_CACHE_TTL seconds.
+
+    Args:
+        user_id (str): The user whose tokens to drop
+    """
+    token_cache.invalidate_tag(user_id)
@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    A thread-safe, bounded LRU cache whose entries expire after a per-entry
+    time to live.
+
+    Entries can be tagged, e.g. with the id of the user they belong to, so
+    every entry derived from a row can be dropped when that row changes.
+
+    Args:
+        max_size (int): The maximum number of entries kept
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """
+        Look up a live entry and mark it as recently used.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            The cached value, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at, tags = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float, tags: tuple = ()):
+        """
+        Store a value, evicting the least recently used entries when full.
+
+        Args:
+            key: The cache key
+            value: The value to store
+            ttl (float): Seconds until the entry expires. Nothing is stored
+                when it is not positive.
+            tags (tuple): Tags the entry can be invalidated by
+        """
+        if ttl <= 0 or self.max_size <= 0:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, time.monotonic() + ttl, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_tag(self, tag):
+        """
+        Drop every entry carrying a tag.
+
+        Args:
+            tag: The tag to invalidate
+        """
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def resize(self, max_size: int):
+        """
+        Change the maximum number of entries, evicting the least recently
+        used ones if the cache is now too large.
+
+        Args:
+            max_size (int): The new maximum size
+        """
+        with self._lock:
+            self.max_size = max_size
+            while len(self._entries) > max(max_size, 0):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self):
+        """
+        Get the cache's counters.
+
+        Returns:
+            dict: The size, hits, misses, hit rate, evictions and
+                invalidations since the process started
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key):
+        # Must be called with the lock held
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
@@ -0,0 +1,524 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, case, or_, select, update
+
+from ..extensions import db
+from ..models import Chat, ChatMember, ChatRequest, DirectChat, Message, User
+from .serializers import last_message_serializer, user_serializer
+
+LAST_MESSAGE_PREVIEW_LENGTH = 100
+DEFAULT_FETCH_RANGE_LIMIT = 200
+
+
+def get_message_preview(content: str):
+    """
+    Shorten a message's content for the chat list.
+
+    Args:
+        content (str): The message content
+
+    Returns:
+        str: The content truncated to LAST_MESSAGE_PREVIEW_LENGTH characters,
+            or None if the message has no text
+    """
+    if content is None:
+        return None
+    return content[:LAST_MESSAGE_PREVIEW_LENGTH]
+
+
+def next_message_seq_update(chat_id: str, count: int = 1):
+    """
+    Build the UPDATE taking the next sequence number of a chat.
+
+    The chat row stays locked until the transaction ends, so concurrent
+    messages of the same chat get consecutive numbers in commit order.
+
+    Args:
+        chat_id (str): The chat the message is sent to
+        count (int): How many numbers to take, the last one is returned
+
+    Returns:
+        Update: The statement returning the new sequence number, for a
+            sync or async session to execute
+    """
+    return (
+        update(Chat)
+        .where(Chat.id == chat_id)
+        .values({Chat.last_seq: Chat.last_seq + count})
+        .returning(Chat.last_seq)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def assign_message_seq(message: Message):
+    """
+    Give a new message the next sequence number of its chat.
+
+    Must be called in the transaction that inserts the message, before it
+    is flushed.
+
+    Args:
+        message (Message): The new message
+    """
+    message.seq = db.session.execute(
+        next_message_seq_update(message.chat_id)
+    ).scalar_one()
+
+
+def socket_message_payload(message: Message):
+    """
+    Build the socket payload of a message.
+
+    Args:
+        message: The message, or a row with the same columns
+
+    Returns:
+        dict: The message fields, with `sent_at` in ISO format
+    """
+    return {
+        "id": message.id,
+        "seq": message.seq,
+        "content": message.content,
+        "sent_at": message.sent_at.isoformat(),
+        "chat_id": message.chat_id,
+        "sender_id": message.sender_id,
+        "client_msg_id": message.client_msg_id,
+    }
+
+
+def message_range_select(chat_id: str, from_seq: int, to_seq: int):
+    """
+    Build the SELECT of the messages of a chat with a sequence number in a
+    range, answered from the `(chat_id, seq)` index.
+
+    Args:
+        chat_id (str): The chat
+        from_seq (int): The first sequence number, inclusive
+        to_seq (int): The last sequence number, inclusive
+
+    Returns:
+        Select: The statement, for a sync or async session to execute
+    """
+    return (
+        select(
+            Message.id,
+            Message.seq,
+            Message.content,
+            Message.sent_at,
+            Message.chat_id,
+            Message.sender_id,
+            Message.client_msg_id,
+        )
+        .where(
+            Message.chat_id == chat_id,
+            Message.seq >= from_seq,
+            Message.seq <= to_seq,
+        )
+        .order_by(Message.seq)
+    )
+
+
+def parse_message_range(data: dict, limit: int):
+    """
+    Read the range of a fetch-range socket event.
+
+    Ranges longer than `limit` are cut, the client asks for the rest from
+    the last message it got.
+
+    Args:
+        data (dict): The event data, with `chat_id`, `from_seq` and `to_seq`
+        limit (int): The maximum number of messages in a range
+
+    Returns:
+        tuple: (chat_id, from_seq, to_seq), or None if the range is invalid
+    """
+    chat_id = data.get("chat_id")
+    try:
+        from_seq = int(data.get("from_seq"))
+        to_seq = int(data.get("to_seq"))
+    except (TypeError, ValueError):
+        return None
+
+    if not chat_id or from_seq < 1 or to_seq < from_seq:
+        return None
+
+    return chat_id, from_seq, min(to_seq, from_seq + limit - 1)
+
+
+def fetch_message_range(chat_id: str, from_seq: int, to_seq: int):
+    """
+    Load the messages of a chat with a sequence number in a range.
+
+    Args:
+        chat_id (str): The chat
+        from_seq (int): The first sequence number, inclusive
+        to_seq (int): The last sequence number, inclusive
+
+    Returns:
+        list: The message rows, by sequence number
+    """
+    return db.session.execute(message_range_select(chat_id, from_seq, to_seq)).all()
+
+
+def last_message_update(message: Message):
+    """
+    Build the UPDATE pointing the message's chat at it as the latest message.
+
+    Args:
+        message (Message): The newly inserted message
+
+    Returns:
+        Update: The statement, for a sync or async session to execute
+    """
+    return (
+        update(Chat)
+        .where(Chat.id == message.chat_id)
+        .values(
+            {
+                Chat.last_message_id: message.id,
+                Chat.last_message_at: message.sent_at,
+                Chat.last_message_sender_id: message.sender_id,
+                Chat.last_message_preview: get_message_preview(message.content),
+                Chat.version: Chat.version + 1,
+            }
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def unread_message_update(message: Message):
+    """
+    Build the UPDATE counting the message as unread for every other member
+    of its chat and moving the sender's own read cursor past it.
+
+    Args:
+        message (Message): The newly inserted message
+
+    Returns:
+        Update: The statement, for a sync or async session to execute
+    """
+    is_sender = ChatMember.member_id == message.sender_id
+    return (
+        update(ChatMember)
+        .where(ChatMember.chat_id == message.chat_id)
+        .values(
+            {
+                ChatMember.unread_count: case(
+                    (is_sender, 0), else_=ChatMember.unread_count + 1
+                ),
+                ChatMember.last_read_message_id: case(
+                    (is_sender, message.id), else_=ChatMember.last_read_message_id
+                ),
+                ChatMember.last_read_at: case(
+                    (is_sender, message.sent_at), else_=ChatMember.last_read_at
+                ),
+                ChatMember.version: ChatMember.version + 1,
+            }
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def store_message(message: Message):
+    """
+    Insert a new message with the next sequence number of its chat, and
+    update the chat's last message pointer and the members' unread counts.
+
+    The caller commits, so several messages can share one transaction.
+
+    Args:
+        message (Message): The new message
+    """
+    # Take the chat's next sequence number, which locks the chat until the
+    # message is committed
+    assign_message_seq(message)
+    db.session.add(message)
+    db.session.flush()
+
+    # Update the chat's last message pointer and the members' unread counts
+    # in the same transaction
+    record_last_message(message)
+    record_unread_message(message)
+
+
+def record_last_message(message: Message):
+    """
+    Point the message's chat at it as the latest message.
+
+    Must be called after the message has been flushed and before the
+    transaction is committed, so the chat and message rows are written
+    together.
+
+    Args:
+        message (Message): The newly inserted message
+    """
+    db.session.execute(last_message_update(message))
+
+
+def record_unread_message(message: Message):
+    """
+    Count the message as unread for every other member of its chat and move
+    the sender's own read cursor past it, in a single UPDATE.
+
+    Like record_last_message, this must run in the transaction that inserts
+    the message.
+
+    Args:
+        message (Message): The newly inserted message
+    """
+    db.session.execute(unread_message_update(message))
+
+
+def direct_chat_key(user_id: str, other_user_id: str):
+    """
+    Order a pair of user ids the way they are stored in DirectChat.
+
+    Args:
+        user_id (str): One of the users
+        other_user_id (str): The other user
+
+    Returns:
+        tuple: (user_low_id, user_high_id)
+    """
+    return min(user_id, other_user_id), max(user_id, other_user_id)
+
+
+def get_direct_chat(user_id: str, other_user_id: str):
+    """
+    Find the one-on-one chat between two users.
+
+    Args:
+        user_id (str): One of the users
+        other_user_id (str): The other user
+
+    Returns:
+        DirectChat: The pair record, or None if the users have no chat
+    """
+    return DirectChat.query.get(direct_chat_key(user_id, other_user_id))
+
+
+def get_direct_chats(user_id: str, other_user_ids: list):
+    """
+    Find the one-on-one chats between a user and many other users in a
+    single query.
+
+    Args:
+        user_id (str): The user the chats are looked up for
+        other_user_ids (list): The ids of the other users
+
+    Returns:
+        dict: Maps the id of every other user the user has a direct chat
+            with to the DirectChat record
+    """
+    if not other_user_ids:
+        return {}
+
+    direct_chats = DirectChat.query.filter(
+        or_(
+            and_(
+                DirectChat.user_low_id == user_id,
+                DirectChat.user_high_id.in_(other_user_ids),
+            ),
+            and_(
+                DirectChat.user_high_id == user_id,
+                DirectChat.user_low_id.in_(other_user_ids),
+            ),
+        )
+    ).all()
+
+    return {
+        (
+            direct_chat.user_high_id
+            if direct_chat.user_low_id == user_id
+            else direct_chat.user_low_id
+        ): direct_chat
+        for direct_chat in direct_chats
+    }
+
+
+def create_direct_chat(user_id: str, other_user_id: str):
+    """
+    Create a one-on-one chat between two users along with its pair record.
+
+    The rows are only flushed, committing is left to the caller. If the users
+    already have a direct chat, e.g. because of a concurrent request, the
+    unique pair key makes the flush raise an IntegrityError.
+
+    Args:
+        user_id (str): One of the users
+        other_user_id (str): The other user
+
+    Returns:
+        Chat: The newly created chat
+    """
+    chat = Chat(chat_type="one-on-one")
+    db.session.add(chat)
+    db.session.flush()
+
+    user_low_id, user_high_id = direct_chat_key(user_id, other_user_id)
+    joined_at = datetime.now(timezone.utc)
+    db.session.add_all(
+        [
+            ChatMember(
+                chat_id=chat.id,
+                member_id=user_id,
+                member_role="member",
+                joined_at=joined_at,
+            ),
+            ChatMember(
+                chat_id=chat.id,
+                member_id=other_user_id,
+                member_role="member",
+                joined_at=joined_at,
+            ),
+            DirectChat(
+                user_low_id=user_low_id,
+                user_high_id=user_high_id,
+                chat_id=chat.id,
+            ),
+        ]
+    )
+    db.session.flush()
+
+    return chat
+
+
+def build_chat_info(chat: Chat, user, fieldsets: tuple = ()):
+    """
+    Build the chat list entry of a chat as seen by one of its members.
+
+    The chat's memberships (with their members) and last message sender
+    should be eager loaded.
+
+    Args:
+        chat (Chat): The chat to describe
+        user: The member the chat is shown to
+        fieldsets (tuple): The sparse fieldsets requested by the client
+
+    Returns:
+        dict: The chat info
+    """
+    serialize_member = user_serializer.compile(fieldsets=fieldsets)
+
+    # Determine the members data based on chat type
+    if chat.chat_type == "one-on-one":
+        # Get the friend (other member) data
+        friend_member = next(
+            (member for member in chat.memberships if member.member.id != user.id),
+            None,
+        )
+        # The friend may not be found, e.g. if their account was deleted
+        members_data = serialize_member(friend_member.member) if friend_member else None
+    else:
+        # For group chats, include all members except the current user
+        members_data = [
+            serialize_member(member.member)
+            for member in chat.memberships
+            if member.member.id != user.id
+        ]
+
+    # Also include the last message if it exists
+    if chat.last_message_id:
+        last_message_data = last_message_serializer.dump(chat, fieldsets=fieldsets)
+    else:
+        last_message_data = None  # No messages in the chat yet
+
+    # The user's own membership holds the read cursor and unread count
+    own_membership = next(
+        (member for member in chat.memberships if member.member_id == user.id),
+        None,
+    )
+
+    chat_info = {
+        "id": chat.id,
+        "name": chat.name,
+        "chat_type": chat.chat_type,
+        "created_at": chat.created_at,
+        "updated_at": chat.updated_at,
+        "members": members_data,
+        "last_message": last_message_data,
+        "last_seq": chat.last_seq,
+        "unread_count": own_membership.unread_count if own_membership else 0,
+        "last_read_message_id": (
+            own_membership.last_read_message_id if own_membership else None
+        ),
+    }
+
+    return chat_info
+
+
+def get_chat_list_version(user_id: str):
+    """
+    Get a cheap fingerprint of everything shown in a user's chat list.
+
+    Chat and membership versions only ever grow, so the versions of the
+    user's chats change whenever any chat in the list, or the user's read
+    state in it, changes. They are kept per chat, as sums could add up to the
+    same value after a chat was left and another one joined.
+
+    Args:
+        user_id (str): The user whose chat list is fingerprinted
+
+    Returns:
+        tuple: The (chat_id, chat_version, membership_version) of every chat
+            of the user, ordered by chat id
+    """
+    return tuple(
+        tuple(row)
+        for row in db.session.query(
+            ChatMember.chat_id, Chat.version, ChatMember.version
+        )
+        .join(Chat, Chat.id == ChatMember.chat_id)
+        .filter(ChatMember.member_id == user_id)
+        .order_by(ChatMember.chat_id)
+    )
+
+
+def bump_member_chat_versions(*user_ids: str):
+    """
+    Invalidate the cached views of every chat some users are members of, e.g.
+    after a user changed their profile or went offline.
+
+    Args:
+        *user_ids (str): The members whose chats changed
+    """
+    member_chat_ids = (
+        db.session.query(ChatMember.chat_id)
+        .filter(ChatMember.member_id.in_(user_ids))
+        .scalar_subquery()
+    )
+    Chat.query.filter(Chat.id.in_(member_chat_ids)).update(
+        {Chat.version: Chat.version + 1}, synchronize_session=False
+    )
+
+
+def bump_chat_requests_version(user_id: str):
+    """
+    Invalidate the cached list of pending chat requests of a user.
+
+    Args:
+        user_id (str): The receiver of the requests
+    """
+    User.query.filter(User.id == user_id).update(
+        {User.chat_requests_version: User.chat_requests_version + 1},
+        synchronize_session=False,
+    )
+
+
+def bump_sender_requests_versions(user_id: str):
+    """
+    Invalidate the cached chat request lists showing a user as the sender,
+    e.g. after the user changed their profile.
+
+    Args:
+        user_id (str): The sender of the requests
+    """
+    receiver_ids = (
+        db.session.query(ChatRequest.receiver_id)
+        .filter(ChatRequest.sender_id == user_id, ChatRequest.status == "pending")
+        .scalar_subquery()
+    )
+    User.query.filter(User.id.in_(receiver_ids)).update(
+        {User.chat_requests_version: User.chat_requests_version + 1},
+        synchronize_session=False,
+    )
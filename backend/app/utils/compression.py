@@ -0,0 +1,87 @@
+import gzip
+
+from flask import Flask, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+DEFAULT_MIN_SIZE = 1024
+COMPRESSIBLE_MIMETYPES = ("application/json",)
+
+
+def _choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress_response(response, min_size: int, gzip_level: int, brotli_quality: int):
+    """
+    Compress a JSON response with brotli or gzip if the client accepts it and
+    the body is large enough to be worth it.
+
+    A strong ETag is turned into a weak one, since the compressed body is no
+    longer byte-for-byte the representation it identified.
+
+    :param response: The response to compress
+    :param min_size: The minimum body size in bytes to compress
+    :param gzip_level: The gzip compression level
+    :param brotli_quality: The brotli quality
+
+    :return: The response, compressed in place when applicable
+    """
+    if (
+        response.status_code < 200
+        or response.status_code >= 300
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+
+    body = response.get_data()
+    if len(body) < min_size:
+        return response
+
+    encoding = _choose_encoding()
+    if encoding == "br":
+        body = brotli.compress(body, quality=brotli_quality)
+    elif encoding == "gzip":
+        body = gzip.compress(body, compresslevel=gzip_level)
+    else:
+        return response
+
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+    return response
+
+
+def init_compression(app: Flask):
+    """
+    Register the response compression hook, unless disabled with the
+    COMPRESS_RESPONSES config option.
+
+    :param app: The Flask app to register the hook with
+    """
+    if not app.config.get("COMPRESS_RESPONSES", True):
+        return
+
+    min_size = app.config.get("COMPRESS_MIN_SIZE", DEFAULT_MIN_SIZE)
+    gzip_level = app.config.get("COMPRESS_GZIP_LEVEL", 6)
+    brotli_quality = app.config.get("COMPRESS_BROTLI_QUALITY", 4)
+
+    @app.after_request
+    def compress(response):
+        return compress_response(response, min_size, gzip_level, brotli_quality)
@@ -0,0 +1,122 @@
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+
+# Pragmas of the "production" SQLite profile, with the config option that
+# sets each one
+SQLITE_PRODUCTION_PRAGMAS = {
+    "journal_mode": "SQLITE_JOURNAL_MODE",
+    "synchronous": "SQLITE_SYNCHRONOUS",
+    "busy_timeout": "SQLITE_BUSY_TIMEOUT",
+    "mmap_size": "SQLITE_MMAP_SIZE",
+    "cache_size": "SQLITE_CACHE_SIZE",
+    "temp_store": "SQLITE_TEMP_STORE",
+}
+
+# Pool options of the engine, with the config option that sets each one
+POOL_OPTIONS = {
+    "pool_size": "DATABASE_POOL_SIZE",
+    "max_overflow": "DATABASE_MAX_OVERFLOW",
+    "pool_timeout": "DATABASE_POOL_TIMEOUT",
+    "pool_recycle": "DATABASE_POOL_RECYCLE",
+}
+
+
+def get_engine_options(app: Flask, uri: str = None):
+    """
+    Build the engine options of a database from the DATABASE_POOL_* config
+    options.
+
+    In-memory SQLite databases get no pool options, they share a single
+    connection.
+
+    Args:
+        app (Flask): The Flask app to read the config from
+        uri (str): The database URI, SQLALCHEMY_DATABASE_URI by default
+
+    Returns:
+        dict: The keyword arguments of create_engine
+    """
+    url = make_url(uri or app.config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() == "sqlite" and _is_memory_database(url):
+        return {}
+
+    return {
+        option: app.config[key]
+        for option, key in POOL_OPTIONS.items()
+        if app.config.get(key) is not None
+    }
+
+
+def get_sqlite_pragmas(app: Flask):
+    """
+    Get the pragmas to run on every new SQLite connection.
+
+    Args:
+        app (Flask): The Flask app to read the config from
+
+    Returns:
+        dict: The pragma values by name, empty unless SQLITE_PROFILE is
+            "production"
+    """
+    if app.config.get("SQLITE_PROFILE") != "production":
+        return {}
+
+    return {
+        pragma: app.config[key]
+        for pragma, key in SQLITE_PRODUCTION_PRAGMAS.items()
+        if app.config.get(key) is not None
+    }
+
+
+def apply_sqlite_pragmas(engine: Engine, pragmas: dict):
+    """
+    Run the pragmas on every new connection of a SQLite engine.
+
+    WAL journaling lets readers run while a writer commits, and
+    synchronous=NORMAL only syncs the WAL at checkpoints instead of on
+    every commit, which is still safe from corruption in WAL mode.
+
+    Args:
+        engine (Engine): The engine, or the sync_engine of an AsyncEngine
+        pragmas (dict): The pragma values by name
+    """
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma, value in pragmas.items():
+                cursor.execute(f"PRAGMA {pragma}={value}")
+        finally:
+            cursor.close()
+
+
+def init_database(app: Flask, db):
+    """
+    Set up the Flask-SQLAlchemy extension with the pool options and SQLite
+    pragmas of the config.
+
+    Options set in SQLALCHEMY_ENGINE_OPTIONS take precedence over the
+    DATABASE_POOL_* ones.
+
+    Args:
+        app (Flask): The Flask app
+        db (SQLAlchemy): The extension to initialize
+    """
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        **get_engine_options(app),
+        **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}),
+    }
+    db.init_app(app)
+
+    pragmas = get_sqlite_pragmas(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_sqlite_pragmas(engine, pragmas)
+
+
+def _is_memory_database(url):
+    return url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
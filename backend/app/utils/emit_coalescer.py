@@ -0,0 +1,177 @@
+import threading
+from collections import deque
+
+from flask import Flask
+
+from ..extensions import socketio
+
+DEFAULT_COALESCE_WINDOW = 0.005
+DEFAULT_COALESCE_MAX_BATCH = 32
+
+
+class EmitCoalescer:
+    """
+    Batches the events emitted to a room within a short window into one
+    frame, e.g. a burst of `new-message` events in a busy group chat into a
+    single `new-messages` event carrying the list of messages.
+
+    Events wait at most EMIT_COALESCE_WINDOW seconds, and a room's batch is
+    sent as soon as it holds EMIT_COALESCE_MAX_BATCH events. A batch of one
+    is sent as the plain event. Disabled unless EMIT_COALESCE_ENABLED is
+    set, in which case clients must handle the batch events.
+
+    Batches of a room are sent one at a time, in the order they were closed,
+    whether they filled up or were flushed by the timer.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.window = DEFAULT_COALESCE_WINDOW
+        self.max_batch = DEFAULT_COALESCE_MAX_BATCH
+        self._pending = {}
+        self._outboxes = {}
+        self._flush_scheduled = False
+        self._lock = threading.Lock()
+        self._counters = {
+            "events": 0,
+            "frames": 0,
+            "batches": 0,
+            "frames_saved": 0,
+            "bytes_saved": 0,
+        }
+
+    def init_app(self, app: Flask):
+        """
+        Configure the coalescer from the EMIT_COALESCE_* config options.
+
+        Args:
+            app (Flask): The Flask app to read the config from
+        """
+        self.enabled = app.config.get("EMIT_COALESCE_ENABLED", False)
+        self.window = app.config.get("EMIT_COALESCE_WINDOW", DEFAULT_COALESCE_WINDOW)
+        self.max_batch = app.config.get(
+            "EMIT_COALESCE_MAX_BATCH", DEFAULT_COALESCE_MAX_BATCH
+        )
+
+    def emit(self, event: str, data, room: str, batch_event: str):
+        """
+        Emit an event to a room, batched with the other events emitted to it
+        within the window.
+
+        Args:
+            event (str): The event name, used when sent on its own
+            data: The event payload
+            room (str): The room to emit to
+            batch_event (str): The event name of a batch, whose payload is
+                the list of the batched payloads in emit order
+        """
+        if not self.enabled:
+            self._send(event, batch_event, room, [data])
+            return
+
+        key = (event, batch_event, room)
+        drain = False
+        schedule_flush = False
+        with self._lock:
+            batch = self._pending.setdefault(key, [])
+            batch.append(data)
+            if len(batch) >= self.max_batch:
+                drain = self._close_batch(key)
+            elif not self._flush_scheduled:
+                schedule_flush = self._flush_scheduled = True
+
+        if drain:
+            self._drain(key)
+        if schedule_flush:
+            socketio.start_background_task(self._flush_later)
+
+    def flush(self):
+        """
+        Send every pending batch right away.
+
+        Returns:
+            int: The number of frames sent
+        """
+        with self._lock:
+            keys = list(self._pending)
+            to_drain = [key for key in keys if self._close_batch(key)]
+            self._flush_scheduled = False
+
+        for key in to_drain:
+            self._drain(key)
+
+        return len(keys)
+
+    def stats(self):
+        """
+        Get the coalescing counters.
+
+        Returns:
+            dict: Whether coalescing is enabled, and the events emitted,
+                frames sent, batches sent, and the frames and payload bytes
+                saved per room since the process started
+        """
+        with self._lock:
+            return {"enabled": self.enabled, **self._counters}
+
+    def _close_batch(self, key):
+        # Moves the pending batch of a key to its outbox, must be called with
+        # the lock held. Returns True if the caller must send the outbox, or
+        # False if another thread is already sending it
+        is_sending = key in self._outboxes
+        self._outboxes.setdefault(key, deque()).append(self._pending.pop(key))
+        return not is_sending
+
+    def _drain(self, key):
+        # Sends the outbox of a key until it is empty, so a batch is never
+        # sent while an older batch of the same room is still being sent. A
+        # failed emit is raised once the rest of the outbox was sent
+        event, batch_event, room = key
+        error = None
+        while True:
+            with self._lock:
+                outbox = self._outboxes[key]
+                if not outbox:
+                    del self._outboxes[key]
+                    break
+                batch = outbox.popleft()
+
+            try:
+                self._send(event, batch_event, room, batch)
+            except Exception as e:
+                error = error or e
+
+        if error:
+            raise error
+
+    def _flush_later(self):
+        socketio.sleep(self.window)
+        self.flush()
+
+    def _send(self, event, batch_event, room, batch):
+        if len(batch) == 1:
+            socketio.emit(event, batch[0], to=room)
+        else:
+            socketio.emit(batch_event, batch, to=room)
+
+        with self._lock:
+            self._counters["events"] += len(batch)
+            self._counters["frames"] += 1
+            if len(batch) > 1:
+                self._counters["batches"] += 1
+                self._counters["frames_saved"] += len(batch) - 1
+                self._counters["bytes_saved"] += _framing_bytes_saved(
+                    event, batch_event, len(batch)
+                )
+
+
+def _framing_bytes_saved(event: str, batch_event: str, count: int):
+    # Socket.IO frames an event as `42["<event>",<payload>]` and a batch as
+    # `42["<batch_event>",[<payload>,...]]`, the payloads are the same bytes
+    # either way
+    separate = count * (len(event) + 7)
+    batched = len(batch_event) + 9 + (count - 1)
+    return separate - batched
+
+
+emit_coalescer = EmitCoalescer()
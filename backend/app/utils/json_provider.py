@@ -0,0 +1,72 @@
+from datetime import date, datetime
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+class IsoDefaultJSONProvider(DefaultJSONProvider):
+    """
+    The stdlib JSON provider, with dates serialized as ISO 8601 strings
+    instead of HTTP dates, so routes can return datetimes as they are.
+    """
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, (datetime, date)):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+
+class OrjsonProvider(IsoDefaultJSONProvider):
+    """
+    A JSON provider backed by orjson, which serializes datetimes natively and
+    encodes responses several times faster than the stdlib.
+
+    Only encoding goes through orjson, decoding request bodies is left to
+    the stdlib provider.
+    """
+
+    def dumps(self, obj, **kwargs):
+        # orjson does not support the stdlib's formatting options, fall back
+        # to the stdlib for callers that rely on them
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(
+            obj, default=self.default, option=orjson.OPT_NON_STR_KEYS
+        ).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS),
+            mimetype=self.mimetype,
+        )
+
+
+JSON_PROVIDERS = {
+    "orjson": OrjsonProvider,
+    "std": IsoDefaultJSONProvider,
+}
+
+
+def init_json_provider(app: Flask):
+    """
+    Install the JSON provider selected by the JSON_PROVIDER config option.
+
+    Falls back to the stdlib provider when orjson is not installed.
+
+    :param app: The Flask app to install the provider on
+    """
+    name = app.config.get("JSON_PROVIDER", "orjson")
+    if name not in JSON_PROVIDERS:
+        raise ValueError(f"Unknown JSON provider: {name}")
+
+    if name == "orjson" and orjson is None:
+        name = "std"
+
+    app.json = JSON_PROVIDERS[name](app)
@@ -0,0 +1,161 @@
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from socketio import PubSubManager
+
+# Longest wait between two attempts to reconnect to the broker, in seconds
+MAX_RETRY_SLEEP = 60
+
+
+def parse_local_url(url: str):
+    """
+    Split a `local://host:port` message queue URL into a socket address.
+
+    Args:
+        url (str): The message queue URL
+
+    Returns:
+        tuple: (host, port)
+    """
+    host, _, port = url[len("local://") :].rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class LocalPubSubBroker:
+    """
+    A minimal message broker relaying Socket.IO pub/sub messages between
+    processes on one machine, so several workers can be run and tested
+    without Redis or RabbitMQ.
+
+    Every message published by a worker is forwarded to all subscribed
+    workers, including the publisher, like a Redis channel.
+
+    Args:
+        url (str): The `local://host:port` address to listen on
+        authkey (bytes): The key clients must authenticate with
+    """
+
+    def __init__(self, url: str, authkey: bytes):
+        self.address = parse_local_url(url)
+        self.authkey = authkey
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def serve_forever(self):
+        """Accept workers and relay their messages until the process exits."""
+        with Listener(self.address, authkey=self.authkey) as listener:
+            while True:
+                # accept() runs the authentication handshake, a client that
+                # fails it or hangs up must not stop the broker
+                try:
+                    connection = listener.accept()
+                except (AuthenticationError, EOFError, OSError):
+                    continue
+                threading.Thread(
+                    target=self._handle, args=(connection,), daemon=True
+                ).start()
+
+    def _handle(self, connection):
+        try:
+            role = connection.recv()
+            if role == "subscribe":
+                with self._lock:
+                    self._subscribers.append(connection)
+                return
+
+            while True:
+                message = connection.recv()
+                with self._lock:
+                    subscribers = list(self._subscribers)
+                for subscriber in subscribers:
+                    try:
+                        subscriber.send(message)
+                    except (EOFError, OSError):
+                        with self._lock:
+                            if subscriber in self._subscribers:
+                                self._subscribers.remove(subscriber)
+        except (EOFError, OSError):
+            connection.close()
+
+
+class LocalPubSubManager(PubSubManager):
+    """
+    A python-socketio client manager that talks to a LocalPubSubBroker.
+
+    A stand-in for the Redis and Kombu managers in tests and local
+    multi-process setups.
+
+    Args:
+        url (str): The `local://host:port` address of the broker
+        authkey (bytes): The key to authenticate with the broker
+        channel (str): The channel name, messages of other channels are
+            ignored
+        write_only (bool): Only publish, e.g. from a process without
+            connected clients
+    """
+
+    name = "local"
+
+    def __init__(self, url: str, authkey: bytes, channel="socketio", write_only=False):
+        super().__init__(channel=channel, write_only=write_only)
+        self.address = parse_local_url(url)
+        self.authkey = authkey
+        self._publisher = None
+        self._publish_lock = threading.Lock()
+
+    def _publish(self, data):
+        # Like python-socketio's Redis manager, a failed publish is retried
+        # once on a new connection, e.g. after the broker restarted, then
+        # dropped
+        with self._publish_lock:
+            for attempt in range(2):
+                try:
+                    if self._publisher is None:
+                        self._publisher = Client(self.address, authkey=self.authkey)
+                        self._publisher.send("publish")
+                    self._publisher.send((self.channel, data))
+                    return
+                except (EOFError, OSError) as e:
+                    self._close_publisher()
+                    self._get_logger().error(
+                        "Cannot publish to the local broker, %s: %s",
+                        "giving up" if attempt else "retrying",
+                        e,
+                    )
+
+    def _close_publisher(self):
+        if self._publisher is not None:
+            try:
+                self._publisher.close()
+            except OSError:
+                pass
+            self._publisher = None
+
+    def _listen(self):
+        retry_sleep = 1
+        while True:
+            try:
+                subscriber = Client(self.address, authkey=self.authkey)
+            except (EOFError, OSError) as e:
+                self._get_logger().error(
+                    "Cannot connect to the local broker, retrying in %ss: %s",
+                    retry_sleep,
+                    e,
+                )
+                time.sleep(retry_sleep)
+                retry_sleep = min(retry_sleep * 2, MAX_RETRY_SLEEP)
+                continue
+
+            retry_sleep = 1
+            try:
+                subscriber.send("subscribe")
+                while True:
+                    channel, data = subscriber.recv()
+                    if channel == self.channel:
+                        yield data
+            except (EOFError, OSError) as e:
+                self._get_logger().error("Lost the local broker, reconnecting: %s", e)
+            finally:
+                subscriber.close()
@@ -0,0 +1,269 @@
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+
+from ..extensions import db
+from ..models import ChatMember
+from .cache import TTLCache
+from .read_replica import replica_bind
+
+DEFAULT_MEMBERSHIP_CACHE_SIZE = 100000
+DEFAULT_MEMBERSHIP_CACHE_TTL = 300
+
+# Confirmed (chat_id, member_id) memberships. Only positive lookups are
+# cached, so a new membership is visible right away and only removed ones
+# need to be invalidated.
+membership_cache = TTLCache(DEFAULT_MEMBERSHIP_CACHE_SIZE)
+
+# The users sharing at least one chat with a user, keyed by user id, for
+# the presence fan-out. Cleared whenever any membership changes.
+contacts_cache = TTLCache(DEFAULT_MEMBERSHIP_CACHE_SIZE)
+
+# Contacts of this many users are loaded per query
+CONTACTS_QUERY_BATCH_SIZE = 500
+
+# Bumped on every invalidation, so the chat sets kept on socket
+# connections can tell they are stale
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+def membership_select(chat_id: str, member_id: str):
+    """
+    Build the SELECT checking whether a user is a member of a chat.
+
+    Args:
+        chat_id (str): The chat
+        member_id (str): The user
+
+    Returns:
+        Select: The statement, for a sync or async session to execute
+    """
+    return (
+        select(ChatMember.chat_id)
+        .where(ChatMember.chat_id == chat_id, ChatMember.member_id == member_id)
+        .limit(1)
+    )
+
+
+def is_chat_member(chat_id: str, member_id: str):
+    """
+    Check whether a user is a member of a chat, through the process-wide
+    membership cache, then the read replica when there is one.
+
+    Args:
+        chat_id (str): The chat
+        member_id (str): The user
+
+    Returns:
+        bool: True if the user is a member of the chat
+    """
+    if membership_cache.get((chat_id, member_id)):
+        return True
+
+    bind = replica_bind(member_id)
+    is_member = (
+        db.session.execute(
+            membership_select(chat_id, member_id), bind_arguments={"bind": bind}
+        ).first()
+        is not None
+    )
+    if not is_member and bind is not None:
+        # The replica may not have a membership that was just created
+        is_member = (
+            db.session.execute(membership_select(chat_id, member_id)).first()
+            is not None
+        )
+    if is_member:
+        _remember_membership(chat_id, member_id)
+
+    return is_member
+
+
+async def is_chat_member_async(session, chat_id: str, member_id: str):
+    """
+    Like is_chat_member, for the asyncio server.
+
+    Args:
+        session (AsyncSession): The database session to query on a miss
+        chat_id (str): The chat
+        member_id (str): The user
+
+    Returns:
+        bool: True if the user is a member of the chat
+    """
+    if membership_cache.get((chat_id, member_id)):
+        return True
+
+    result = await session.execute(membership_select(chat_id, member_id))
+    is_member = result.first() is not None
+    if is_member:
+        _remember_membership(chat_id, member_id)
+
+    return is_member
+
+
+def _remember_membership(chat_id: str, member_id: str):
+    membership_cache.set(
+        (chat_id, member_id),
+        True,
+        current_app.config.get("MEMBERSHIP_CACHE_TTL", DEFAULT_MEMBERSHIP_CACHE_TTL),
+        tags=(("chat", chat_id), ("member", member_id)),
+    )
+
+
+def invalidate_chat_membership(chat_id: str = None, member_id: str = None):
+    """
+    Forget cached memberships after they changed, e.g. when a member leaves
+    a chat or a user is deleted.
+
+    Only the caches of the current process are cleared, other processes
+    pick up the change once their entries expire after MEMBERSHIP_CACHE_TTL
+    seconds.
+
+    Args:
+        chat_id (str, optional): Forget every membership of this chat
+        member_id (str, optional): Forget every membership of this user
+    """
+    global _generation
+
+    if chat_id:
+        membership_cache.invalidate_tag(("chat", chat_id))
+    if member_id:
+        membership_cache.invalidate_tag(("member", member_id))
+
+    # The contacts of every other member of the chat changed too, and
+    # memberships change rarely enough to start over
+    contacts_cache.clear()
+
+    with _generation_lock:
+        _generation += 1
+
+
+def get_chat_contacts(user_ids):
+    """
+    Get the users sharing at least one chat with each of the given users.
+
+    The contacts of all cache misses are loaded with one query per
+    CONTACTS_QUERY_BATCH_SIZE users, so a burst of presence changes costs a
+    single round trip.
+
+    Args:
+        user_ids: The users whose contacts to get
+
+    Returns:
+        dict: Maps every user id to a frozenset of contact user ids
+    """
+    contacts = {}
+    misses = []
+    for user_id in set(user_ids):
+        cached = contacts_cache.get(user_id)
+        if cached is None:
+            misses.append(user_id)
+        else:
+            contacts[user_id] = cached
+
+    if not misses:
+        return contacts
+
+    member = aliased(ChatMember)
+    contact = aliased(ChatMember)
+    loaded = {user_id: set() for user_id in misses}
+    for start in range(0, len(misses), CONTACTS_QUERY_BATCH_SIZE):
+        rows = db.session.execute(
+            select(member.member_id, contact.member_id)
+            .join(contact, contact.chat_id == member.chat_id)
+            .where(
+                member.member_id.in_(misses[start : start + CONTACTS_QUERY_BATCH_SIZE]),
+                contact.member_id != member.member_id,
+            )
+            .distinct()
+        )
+        for user_id, contact_id in rows:
+            loaded[user_id].add(contact_id)
+
+    ttl = current_app.config.get("MEMBERSHIP_CACHE_TTL", DEFAULT_MEMBERSHIP_CACHE_TTL)
+    for user_id, contact_ids in loaded.items():
+        contacts[user_id] = frozenset(contact_ids)
+        contacts_cache.set(user_id, contacts[user_id], ttl)
+
+    return contacts
+
+
+def authorize_chat(session, chat_id: str, member_id: str):
+    """
+    Check whether the user of a socket connection may use a chat.
+
+    The chats a connection was already authorized for are kept in its
+    session, so the message hot path does not hit the database or the
+    shared cache. The set is dropped whenever memberships are invalidated in
+    this process, and rebuilt every MEMBERSHIP_CACHE_TTL seconds so changes
+    made by other workers are picked up too.
+
+    Args:
+        session: The socket connection's session
+        chat_id (str): The chat
+        member_id (str): The connection's user
+
+    Returns:
+        bool: True if the user is a member of the chat
+    """
+    chat_ids = _get_connection_chat_ids(session)
+    if chat_id in chat_ids:
+        return True
+
+    if not is_chat_member(chat_id, member_id):
+        return False
+
+    chat_ids.add(chat_id)
+    return True
+
+
+async def authorize_chat_async(sio, sid: str, db_session, chat_id: str, member_id: str):
+    """
+    Like authorize_chat, for the asyncio server.
+
+    The socket session is only opened to read and update the authorized
+    chats, never while the database is queried, so a connection that closes
+    in the meantime does not make the handler save a session that is gone.
+
+    Args:
+        sio (socketio.AsyncServer): The server of the connection
+        sid (str): The connection
+        db_session (AsyncSession): The database session to query on a miss
+        chat_id (str): The chat
+        member_id (str): The connection's user
+
+    Returns:
+        bool: True if the user is a member of the chat
+    """
+    async with sio.session(sid) as session:
+        if chat_id in _get_connection_chat_ids(session):
+            return True
+
+    if not await is_chat_member_async(db_session, chat_id, member_id):
+        return False
+
+    try:
+        async with sio.session(sid) as session:
+            _get_connection_chat_ids(session).add(chat_id)
+    except KeyError:
+        pass  # The connection closed while the membership was checked
+    return True
+
+
+def _get_connection_chat_ids(session):
+    chat_ids = session.get("chat_ids")
+    ttl = current_app.config.get("MEMBERSHIP_CACHE_TTL", DEFAULT_MEMBERSHIP_CACHE_TTL)
+    if (
+        chat_ids is None
+        or session.get("chat_ids_generation") != _generation
+        or time.monotonic() - session.get("chat_ids_built_at", 0) >= ttl
+    ):
+        chat_ids = session["chat_ids"] = set()
+        session["chat_ids_generation"] = _generation
+        session["chat_ids_built_at"] = time.monotonic()
+    return chat_ids
@@ -0,0 +1,255 @@
+import html
+import re
+from types import SimpleNamespace
+
+from sqlalchemy import DDL, event, text
+
+from ..extensions import db
+from ..models import Message
+
+# The database marks matches with private use characters, which survive
+# HTML-escaping the snippet and are then replaced with the tags
+SNIPPET_START = "<mark>"
+SNIPPET_END = "</mark>"
+SNIPPET_START_MARKER = "\ue000"
+SNIPPET_END_MARKER = "\ue001"
+
+# SQLite keeps a separate FTS5 table in sync through triggers. The message id
+# is stored alongside the text because rowids of tables without an INTEGER
+# PRIMARY KEY are not stable across VACUUM.
+SQLITE_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        content, message_id UNINDEXED, chat_id UNINDEXED, tokenize = 'unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages
+    WHEN new.content IS NOT NULL BEGIN
+        INSERT INTO messages_fts (content, message_id, chat_id)
+        VALUES (new.content, new.id, new.chat_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+        DELETE FROM messages_fts WHERE message_id = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages
+    BEGIN
+        DELETE FROM messages_fts WHERE message_id = old.id;
+        INSERT INTO messages_fts (content, message_id, chat_id)
+        SELECT new.content, new.id, new.chat_id WHERE new.content IS NOT NULL;
+    END
+    """,
+]
+
+SQLITE_REBUILD_SQL = [
+    "DELETE FROM messages_fts",
+    """
+    INSERT INTO messages_fts (content, message_id, chat_id)
+    SELECT content, id, chat_id FROM messages WHERE content IS NOT NULL
+    """,
+]
+
+# Postgres maintains the tsvector itself as a generated column
+POSTGRES_INDEX_DDL = [
+    """
+    ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS ix_messages_search_vector
+    ON messages USING gin (search_vector)
+    """,
+]
+
+# Both queries rank with "lower score is better" so they share the keyset
+# filters and ordering applied around them
+SQLITE_SEARCH_SQL = """
+    SELECT m.id, m.chat_id, m.sent_at, m.sender_id,
+           u.name AS sender_name, u.username AS sender_username,
+           u.profile_picture AS sender_profile_picture,
+           snippet(messages_fts, 0, :mark_start, :mark_end, '…', 12) AS snippet,
+           bm25(messages_fts) AS score
+    FROM messages_fts
+    JOIN messages m ON m.id = messages_fts.message_id
+    JOIN chat_members cm ON cm.chat_id = m.chat_id AND cm.member_id = :user_id
+    JOIN users u ON u.id = m.sender_id
+    WHERE messages_fts MATCH :match
+"""
+
+POSTGRES_SEARCH_SQL = """
+    SELECT m.id, m.chat_id, m.sent_at, m.sender_id,
+           u.name AS sender_name, u.username AS sender_username,
+           u.profile_picture AS sender_profile_picture,
+           ts_headline('simple', m.content, q,
+               'StartSel=' || :mark_start || ',StopSel=' || :mark_end
+               || ',MaxWords=24,MinWords=8') AS snippet,
+           -ts_rank_cd(m.search_vector, q) AS score
+    FROM messages m
+    CROSS JOIN to_tsquery('simple', :match) q
+    JOIN chat_members cm ON cm.chat_id = m.chat_id AND cm.member_id = :user_id
+    JOIN users u ON u.id = m.sender_id
+    WHERE m.search_vector @@ q
+"""
+
+RANKED_SEARCH_SQL = """
+    SELECT * FROM ({search}) ranked
+    WHERE 1 = 1 {filters}
+    ORDER BY score, id
+    LIMIT :limit
+"""
+
+
+def _execute_ddl(statements, connection):
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+def _create_index_after_messages(target, connection, **kwargs):
+    if connection.dialect.name == "sqlite":
+        _execute_ddl(SQLITE_INDEX_DDL, connection)
+    elif connection.dialect.name == "postgresql":
+        _execute_ddl(POSTGRES_INDEX_DDL, connection)
+
+
+event.listen(Message.__table__, "after_create", _create_index_after_messages)
+event.listen(
+    Message.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS messages_fts").execute_if(dialect="sqlite"),
+)
+
+
+def rebuild_search_index():
+    """
+    Create the full-text index if it is missing and repopulate it from the
+    messages table.
+
+    Returns:
+        str: The name of the database dialect the index was built for
+    """
+    connection = db.session.connection()
+    dialect = connection.dialect.name
+
+    if dialect == "sqlite":
+        _execute_ddl(SQLITE_INDEX_DDL, connection)
+        _execute_ddl(SQLITE_REBUILD_SQL, connection)
+    elif dialect == "postgresql":
+        # The generated column backfills itself when it is added
+        _execute_ddl(POSTGRES_INDEX_DDL, connection)
+    else:
+        raise RuntimeError(f"Full-text search is not supported on {dialect}")
+
+    db.session.commit()
+    return dialect
+
+
+def build_match_query(search_query: str, dialect: str):
+    """
+    Turn free text from the user into a safe full-text query.
+
+    Every word must match and the last word is matched as a prefix, so results
+    keep up with the user while they type.
+
+    Args:
+        search_query (str): The raw search text
+        dialect (str): The database dialect name
+
+    Returns:
+        str: The match expression, or None if the text contains no words
+    """
+    terms = re.findall(r"\w+", search_query.lower())
+    if not terms:
+        return None
+
+    if dialect == "postgresql":
+        return " & ".join(terms[:-1] + [f"{terms[-1]}:*"])
+
+    return " ".join(f'"{term}"' for term in terms[:-1]) + f' "{terms[-1]}"*'
+
+
+def search_messages(
+    user_id: str, search_query: str, chat_id: str = None, after=None, limit=20
+):
+    """
+    Search the content of messages in the chats the user is a member of.
+
+    Results are ordered by relevance and paginated with a `(score, id)`
+    keyset.
+
+    Args:
+        user_id (str): The user performing the search
+        search_query (str): The raw search text
+        chat_id (str, optional): Restrict the search to a single chat
+        after (tuple, optional): The `(score, id)` of the last result of the
+            previous page
+        limit (int): The maximum number of results to return
+
+    Returns:
+        tuple: (results, has_more), the results with HTML-safe snippets
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "sqlite":
+        sql = SQLITE_SEARCH_SQL
+    elif dialect == "postgresql":
+        sql = POSTGRES_SEARCH_SQL
+    else:
+        raise RuntimeError(f"Full-text search is not supported on {dialect}")
+
+    match = build_match_query(search_query, dialect)
+    if not match:
+        return [], False
+
+    params = {
+        "user_id": user_id,
+        "match": match,
+        "mark_start": SNIPPET_START_MARKER,
+        "mark_end": SNIPPET_END_MARKER,
+        "limit": limit + 1,
+    }
+    filters = []
+
+    if chat_id:
+        filters.append("AND chat_id = :chat_id")
+        params["chat_id"] = chat_id
+
+    if after:
+        params["after_score"], params["after_id"] = after
+        filters.append(
+            "AND (score > :after_score OR (score = :after_score AND id > :after_id))"
+        )
+
+    statement = text(
+        RANKED_SEARCH_SQL.format(search=sql, filters=" ".join(filters))
+    ).columns(sent_at=db.DateTime)
+    rows = db.session.execute(statement, params).all()
+
+    results = [
+        SimpleNamespace(**{**row._mapping, "snippet": highlight_snippet(row.snippet)})
+        for row in rows[:limit]
+    ]
+    return results, len(rows) > limit
+
+
+def highlight_snippet(snippet: str):
+    """
+    Make a snippet safe to render as HTML, with its matches in <mark> tags.
+
+    Args:
+        snippet (str): The snippet, with matches between the marker
+            characters
+
+    Returns:
+        str: The HTML-escaped snippet, or None
+    """
+    if snippet is None:
+        return None
+
+    return (
+        html.escape(snippet)
+        .replace(SNIPPET_START_MARKER, SNIPPET_START)
+        .replace(SNIPPET_END_MARKER, SNIPPET_END)
+    )
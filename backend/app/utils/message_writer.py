@@ -0,0 +1,294 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from flask import Flask, current_app
+from sqlalchemy.orm import make_transient
+
+from ..errors.database_errors import MessageWriterBusy
+from ..extensions import db, socketio
+from ..models import Message
+from .chat_utility import store_message
+from .read_replica import record_write
+
+DEFAULT_WRITER_BATCH_SIZE = 100
+DEFAULT_WRITER_MAX_DELAY = 0
+DEFAULT_WRITER_QUEUE_SIZE = 1000
+DEFAULT_WRITER_TIMEOUT = 5
+
+
+class MessageWriter:
+    """
+    Stores incoming messages from a single writer thread, committing them in
+    micro-batches so a burst of messages costs one commit, and one fsync,
+    instead of one per message. With SQLite it also keeps the socket
+    handlers from competing for the database lock.
+
+    The writer takes up to MESSAGE_WRITER_BATCH_SIZE queued messages, so a
+    batch holds the messages that arrived during the previous commit, and
+    waits up to MESSAGE_WRITER_MAX_DELAY seconds for more if set. When a
+    batch fails, e.g. on a retried client_msg_id, its messages are written
+    one by one, so only the failing message is rejected.
+
+    Disabled unless MESSAGE_WRITER_ENABLED is set, in which case socket
+    handlers wait for their message's batch to be committed before emitting
+    and acking it. A handler that waited MESSAGE_WRITER_TIMEOUT seconds for
+    a message the writer has not picked up yet stores it itself.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.batch_size = DEFAULT_WRITER_BATCH_SIZE
+        self.max_delay = DEFAULT_WRITER_MAX_DELAY
+        self.timeout = DEFAULT_WRITER_TIMEOUT
+        self._queue = queue.Queue(DEFAULT_WRITER_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._writer_started = False
+        self._counters = {
+            "messages": 0,
+            "batches": 0,
+            "failed": 0,
+            "rejected": 0,
+            "fallbacks": 0,
+            "crashes": 0,
+            "largest_batch": 0,
+        }
+
+    def init_app(self, app: Flask):
+        """
+        Configure the writer from the MESSAGE_WRITER_* config options.
+
+        Args:
+            app (Flask): The Flask app to read the config from
+        """
+        self.enabled = app.config.get("MESSAGE_WRITER_ENABLED", False)
+        self.batch_size = app.config.get(
+            "MESSAGE_WRITER_BATCH_SIZE", DEFAULT_WRITER_BATCH_SIZE
+        )
+        self.max_delay = app.config.get(
+            "MESSAGE_WRITER_MAX_DELAY", DEFAULT_WRITER_MAX_DELAY
+        )
+        self.timeout = app.config.get("MESSAGE_WRITER_TIMEOUT", DEFAULT_WRITER_TIMEOUT)
+        self._queue = queue.Queue(
+            app.config.get("MESSAGE_WRITER_QUEUE_SIZE", DEFAULT_WRITER_QUEUE_SIZE)
+        )
+
+    def submit(self, message: Message):
+        """
+        Queue a new message to be stored.
+
+        Must be called inside an application context.
+
+        Args:
+            message (Message): The new message, not yet added to a session
+
+        Returns:
+            Future: Resolves to the message, detached and fully loaded, once
+                it is committed, or to the database error that rejected it.
+                Cancelling it before the writer picks the message up drops
+                the message.
+
+        Raises:
+            MessageWriterBusy: If the queue is full
+        """
+        future = Future()
+        try:
+            self._queue.put_nowait((message, future))
+        except queue.Full:
+            with self._lock:
+                self._counters["rejected"] += 1
+            raise MessageWriterBusy()
+
+        self._start_writer()
+        return future
+
+    def write(self, message: Message):
+        """
+        Store a new message and wait until it is committed.
+
+        When the writer has not picked the message up within
+        MESSAGE_WRITER_TIMEOUT seconds, e.g. because it is stuck, the
+        message is stored and committed on the caller's session instead.
+
+        Must be called inside an application context.
+
+        Args:
+            message (Message): The new message, not yet added to a session
+
+        Returns:
+            Message: The stored message, detached and fully loaded when
+                stored by the writer
+
+        Raises:
+            MessageWriterBusy: If the queue is full, or the writer took the
+                message but did not commit it in time
+            SQLAlchemyError: If the message could not be stored
+        """
+        future = self.submit(message)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            if not self.cancel(future):
+                # The writer is storing the message, give it one more chance
+                try:
+                    return future.result(timeout=self.timeout)
+                except FutureTimeoutError:
+                    raise MessageWriterBusy()
+
+        store_message(message)
+        db.session.commit()
+        return message
+
+    def cancel(self, future: Future):
+        """
+        Take back a message the writer has not picked up yet, so the caller
+        can store it on its own.
+
+        Args:
+            future (Future): The future returned by submit
+
+        Returns:
+            bool: True if the writer will not store the message
+        """
+        if not future.cancel():
+            return False
+
+        with self._lock:
+            self._counters["fallbacks"] += 1
+        return True
+
+    def stats(self):
+        """
+        Get the writer's counters.
+
+        Returns:
+            dict: Whether the writer is enabled, the queued messages, and
+                the messages, batches, failed and rejected messages and the
+                largest batch since the process started
+        """
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "queued": self._queue.qsize(),
+                **self._counters,
+            }
+
+    def _start_writer(self):
+        with self._lock:
+            start_writer = not self._writer_started
+            self._writer_started = True
+
+        if start_writer:
+            socketio.start_background_task(self._run, current_app._get_current_object())
+
+    def _run(self, app):
+        try:
+            while True:
+                batch = self._next_batch()
+                if not batch:
+                    continue
+
+                try:
+                    with app.app_context():
+                        self._write_batch(batch)
+                except Exception as e:
+                    # Fail the batch's messages instead of leaving their
+                    # handlers waiting, and keep serving the next ones
+                    app.logger.exception("Message writer failed to store a batch")
+                    with self._lock:
+                        self._counters["crashes"] += 1
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            # The next submit starts a new writer if this one ever exits
+            with self._lock:
+                self._writer_started = False
+
+    def _next_batch(self):
+        batch = []
+        self._take(batch, self._queue.get())
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    item = self._queue.get(timeout=timeout)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._take(batch, item)
+        return batch
+
+    def _take(self, batch, item):
+        # Skip the messages their handlers took back after timing out
+        if item[1].set_running_or_notify_cancel():
+            batch.append(item)
+
+    def _write_batch(self, batch):
+        with self._lock:
+            self._counters["batches"] += 1
+            self._counters["largest_batch"] = max(
+                self._counters["largest_batch"], len(batch)
+            )
+
+        try:
+            self._commit([message for message, _ in batch])
+        except Exception as e:
+            self._rollback([message for message, _ in batch])
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                self._count(1, failed=1)
+                return
+
+            # Find the failing messages, the others still get stored
+            for message, future in batch:
+                self._write_one(message, future)
+            return
+
+        for message, future in batch:
+            future.set_result(message)
+        self._count(len(batch), failed=0)
+
+    def _write_one(self, message, future):
+        try:
+            self._commit([message])
+        except Exception as e:
+            self._rollback([message])
+            future.set_exception(e)
+            self._count(1, failed=1)
+            return
+
+        future.set_result(message)
+        self._count(1, failed=0)
+
+    def _commit(self, messages):
+        for message in messages:
+            store_message(message)
+
+        # Detach the messages before committing, so they keep their loaded
+        # state for the handler threads instead of being expired
+        for message in messages:
+            db.session.expunge(message)
+        db.session.commit()
+
+        for message in messages:
+            record_write(message.sender_id)
+
+    def _rollback(self, messages):
+        db.session.rollback()
+
+        # Make the messages new again, so they can be inserted on retry
+        for message in messages:
+            make_transient(message)
+
+    def _count(self, size, failed):
+        with self._lock:
+            self._counters["messages"] += size - failed
+            self._counters["failed"] += failed
+
+
+message_writer = MessageWriter()
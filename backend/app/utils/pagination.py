@@ -0,0 +1,142 @@
+import base64
+import json
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, or_
+
+from ..errors.request_errors import InvalidCursor
+
+DEFAULT_CURSOR_LIMIT = 20
+MAX_CURSOR_LIMIT = 100
+
+
+def encode_cursor(*values):
+    """
+    Encode the sort key of a row into an opaque, URL-safe cursor.
+
+    Datetimes are stored as ISO 8601 strings, everything else must be JSON
+    serializable.
+
+    Args:
+        *values: The sort key values, e.g. (sent_at, id)
+
+    Returns:
+        str: The encoded cursor
+    """
+    parts = [
+        value.isoformat() if isinstance(value, datetime) else value for value in values
+    ]
+    raw = json.dumps(parts, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int = 2):
+    """
+    Decode a cursor produced by `encode_cursor`.
+
+    Args:
+        cursor (str): The encoded cursor
+        size (int): The number of values the cursor is expected to hold
+
+    Returns:
+        list: The decoded sort key values
+
+    Raises:
+        InvalidCursor: If the cursor cannot be decoded
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        parts = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor()
+
+    if not isinstance(parts, list) or len(parts) != size:
+        raise InvalidCursor()
+
+    return parts
+
+
+def decode_timestamp_cursor(cursor: str):
+    """
+    Decode a `(timestamp, id)` cursor.
+
+    Timestamps are normalized to naive UTC so they compare the same way as the
+    values stored in the database.
+
+    Args:
+        cursor (str): The encoded cursor
+
+    Returns:
+        tuple: (timestamp, id)
+
+    Raises:
+        InvalidCursor: If the cursor cannot be decoded
+    """
+    timestamp, row_id = decode_cursor(cursor)
+    try:
+        timestamp = datetime.fromisoformat(timestamp)
+    except (ValueError, TypeError):
+        raise InvalidCursor()
+
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return timestamp, row_id
+
+
+def keyset_condition(sort_column, id_column, sort_value, id_value, before=True):
+    """
+    Build the WHERE clause that selects rows strictly before or after a cursor.
+
+    The comparison is expanded manually rather than using a row-value
+    comparison so it works on every database we support.
+
+    Args:
+        sort_column: The primary sort column
+        id_column: The tie-breaking unique column
+        sort_value: The sort value of the cursor row
+        id_value: The id of the cursor row
+        before (bool): Select rows ordered before the cursor when True,
+            after it otherwise
+
+    Returns:
+        The SQLAlchemy boolean expression
+    """
+    if before:
+        return or_(
+            sort_column < sort_value,
+            and_(sort_column == sort_value, id_column < id_value),
+        )
+
+    return or_(
+        sort_column > sort_value,
+        and_(sort_column == sort_value, id_column > id_value),
+    )
+
+
+def get_cursor_limit(args, default: int = DEFAULT_CURSOR_LIMIT):
+    """
+    Read the `limit` query parameter, clamped to a sane range.
+
+    Args:
+        args: The request arguments
+        default (int): The limit to use when none is provided
+
+    Returns:
+        int: The page size
+    """
+    limit = args.get("limit", default, type=int)
+    return max(1, min(limit, MAX_CURSOR_LIMIT))
+
+
+def is_truthy(value):
+    """
+    Check whether a query string flag is set.
+
+    Args:
+        value: The raw query string value
+
+    Returns:
+        bool: True for "1", "true", "yes" and "on"
+    """
+    return str(value).lower() in ("1", "true", "yes", "on")
@@ -0,0 +1,139 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, current_app
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS,
+    check_password_hash,
+    generate_password_hash,
+)
+
+from ..errors.auth_errors import PasswordHashingBusy
+
+DEFAULT_HASH_METHOD = "scrypt:32768:8:1"
+DEFAULT_HASH_WORKERS = 2
+DEFAULT_HASH_QUEUE_SIZE = 32
+
+
+def normalize_hash_method(method: str):
+    """
+    Spell out the default parameters of a werkzeug hash method, the way they
+    are written into the hashes it produces.
+
+    Args:
+        method (str): The method, e.g. "scrypt" or "pbkdf2:sha256:600000"
+
+    Returns:
+        str: The method with all its parameters
+    """
+    name, *params = method.split(":")
+    if name == "scrypt":
+        defaults = ["32768", "8", "1"]
+    elif name == "pbkdf2":
+        defaults = ["sha256", str(DEFAULT_PBKDF2_ITERATIONS)]
+    else:
+        return method
+
+    return ":".join([name, *params, *defaults[len(params) :]])
+
+
+class PasswordHasher:
+    """
+    Runs password hashing on a small pool of worker threads.
+
+    Hashing is deliberately slow, so running it on the threads that serve
+    requests and socket events lets a burst of logins delay everything else.
+    The pool caps how many hashes run at once. When more than
+    PASSWORD_HASH_QUEUE_SIZE hashes are waiting, new ones are rejected with
+    a 503 instead of piling up.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app: Flask):
+        """
+        Create the worker pool from the app's config.
+
+        Args:
+            app (Flask): The Flask app to read the config from
+        """
+        workers = app.config.get("PASSWORD_HASH_WORKERS", DEFAULT_HASH_WORKERS)
+        queue_size = app.config.get("PASSWORD_HASH_QUEUE_SIZE", DEFAULT_HASH_QUEUE_SIZE)
+
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="password-hasher"
+            )
+            # Hashes running plus hashes waiting for a worker
+            self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def hash(self, password: str):
+        """
+        Hash a password with the configured PASSWORD_HASH_METHOD.
+
+        Args:
+            password (str): The plain text password
+
+        Returns:
+            str: The password hash
+
+        Raises:
+            PasswordHashingBusy: If too many hashes are already queued
+        """
+        method = current_app.config.get("PASSWORD_HASH_METHOD", DEFAULT_HASH_METHOD)
+        return self._run(generate_password_hash, password, method=method)
+
+    def verify(self, password_hash: str, password: str):
+        """
+        Check a password against its hash.
+
+        Args:
+            password_hash (str): The stored hash
+            password (str): The plain text password
+
+        Returns:
+            bool: True if the password matches
+
+        Raises:
+            PasswordHashingBusy: If too many hashes are already queued
+        """
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash: str):
+        """
+        Check whether a hash was made with another method or work factor than
+        the configured PASSWORD_HASH_METHOD.
+
+        Args:
+            password_hash (str): The stored hash
+
+        Returns:
+            bool: True if the hash should be replaced
+        """
+        method = current_app.config.get("PASSWORD_HASH_METHOD", DEFAULT_HASH_METHOD)
+        hash_method = password_hash.split("$", 1)[0]
+        return normalize_hash_method(hash_method) != normalize_hash_method(method)
+
+    def _run(self, func, *args, **kwargs):
+        if self._executor is None:
+            self.init_app(current_app)
+
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHashingBusy()
+
+        try:
+            future = self._executor.submit(func, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+
+password_hasher = PasswordHasher()
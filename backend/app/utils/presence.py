@@ -0,0 +1,514 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import Flask, current_app
+from sqlalchemy import bindparam, update
+
+from ..extensions import db, socketio
+from ..models import User
+from .chat_utility import bump_member_chat_versions
+from .membership_cache import get_chat_contacts
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+DEFAULT_PRESENCE_FLUSH_INTERVAL = 1.0
+DEFAULT_PRESENCE_HEARTBEAT_INTERVAL = 15.0
+DEFAULT_PRESENCE_TIMEOUT = 60.0
+
+
+class MemoryPresenceStore:
+    """
+    Tracks the socket connections of every online user in the memory of the
+    current process. Only suitable when a single worker serves sockets.
+
+    A user is online while they have at least one connection, e.g. one per
+    open tab or device. Every connection carries the time of its last
+    heartbeat, so connections of a worker that died can be expired.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def connect(self, user_id: str, sid: str):
+        """
+        Record a user's socket connection.
+
+        Args:
+            user_id (str): The connected user
+            sid (str): The socket session id
+
+        Returns:
+            bool: True if it is the user's first connection, i.e. the user
+                just came online
+        """
+        with self._lock:
+            sids = self._sessions.setdefault(user_id, {})
+            sids[sid] = time.time()
+            return len(sids) == 1
+
+    def disconnect(self, user_id: str, sid: str):
+        """
+        Forget a user's socket connection.
+
+        Args:
+            user_id (str): The disconnected user
+            sid (str): The socket session id
+
+        Returns:
+            bool: True if it was the user's last connection, i.e. the user
+                just went offline
+        """
+        with self._lock:
+            sids = self._sessions.get(user_id)
+            if not sids or sids.pop(sid, None) is None:
+                return False
+            if sids:
+                return False
+            del self._sessions[user_id]
+            return True
+
+    def heartbeat(self, connections):
+        """
+        Mark connections as alive.
+
+        Args:
+            connections: (user_id, sid) pairs of live connections
+        """
+        now = time.time()
+        with self._lock:
+            for user_id, sid in connections:
+                sids = self._sessions.get(user_id)
+                if sids is not None and sid in sids:
+                    sids[sid] = now
+
+    def expire(self, timeout: float):
+        """
+        Drop the connections without a heartbeat for `timeout` seconds.
+
+        Args:
+            timeout (float): Seconds after which a connection is stale
+
+        Returns:
+            list: The users who went offline
+        """
+        deadline = time.time() - timeout
+        with self._lock:
+            stale = [
+                (user_id, sid)
+                for user_id, sids in self._sessions.items()
+                for sid, seen_at in sids.items()
+                if seen_at < deadline
+            ]
+
+        return [user_id for user_id, sid in stale if self.disconnect(user_id, sid)]
+
+    def get_sids(self, user_id: str):
+        """
+        Get the socket session ids of a user.
+
+        Args:
+            user_id (str): The user
+
+        Returns:
+            set: The sids of every connection of the user
+        """
+        with self._lock:
+            return set(self._sessions.get(user_id, ()))
+
+    def online_users(self, user_ids):
+        """
+        Filter users down to those who are online.
+
+        Args:
+            user_ids: The users to check
+
+        Returns:
+            set: The ids of the online users
+        """
+        with self._lock:
+            return {user_id for user_id in user_ids if user_id in self._sessions}
+
+    def is_online(self, user_id: str):
+        """
+        Check whether a user has a socket connection.
+
+        Args:
+            user_id (str): The user
+
+        Returns:
+            bool: True if the user is connected to any worker
+        """
+        return bool(self.online_users((user_id,)))
+
+
+class RedisPresenceStore(MemoryPresenceStore):
+    """
+    Tracks the socket connections of online users in Redis, so every worker
+    process sees the same presence.
+
+    The connections of each user are kept in a hash of sid to heartbeat
+    time, and all connections in a sorted set by heartbeat time, so stale
+    ones can be found without scanning every user.
+
+    Args:
+        url (str): The Redis connection URL
+        prefix (str): Prepended to every key
+    """
+
+    def __init__(self, url: str, prefix: str = "presence:"):
+        if redis is None:
+            raise RuntimeError("The redis package is required for Redis presence")
+
+        self.prefix = prefix
+        self.heartbeats_key = prefix + "heartbeats"
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+
+    def _user_key(self, user_id: str):
+        return f"{self.prefix}user:{user_id}"
+
+    def connect(self, user_id: str, sid: str):
+        now = time.time()
+        pipeline = self._client.pipeline()
+        pipeline.hset(self._user_key(user_id), sid, now)
+        pipeline.zadd(self.heartbeats_key, {f"{user_id}:{sid}": now})
+        pipeline.hlen(self._user_key(user_id))
+        return pipeline.execute()[-1] == 1
+
+    def disconnect(self, user_id: str, sid: str):
+        pipeline = self._client.pipeline()
+        pipeline.hdel(self._user_key(user_id), sid)
+        pipeline.zrem(self.heartbeats_key, f"{user_id}:{sid}")
+        pipeline.hlen(self._user_key(user_id))
+        removed, _, remaining = pipeline.execute()
+        return bool(removed) and remaining == 0
+
+    def heartbeat(self, connections):
+        connections = list(connections)
+        if not connections:
+            return
+
+        now = time.time()
+        pipeline = self._client.pipeline()
+        for user_id, sid in connections:
+            pipeline.zadd(self.heartbeats_key, {f"{user_id}:{sid}": now}, xx=True)
+        pipeline.execute()
+
+    def expire(self, timeout: float):
+        stale = self._client.zrangebyscore(
+            self.heartbeats_key, "-inf", time.time() - timeout
+        )
+        offline = []
+        for member in stale:
+            user_id, _, sid = member.rpartition(":")
+            if self.disconnect(user_id, sid):
+                offline.append(user_id)
+        return offline
+
+    def get_sids(self, user_id: str):
+        return set(self._client.hkeys(self._user_key(user_id)))
+
+    def online_users(self, user_ids):
+        user_ids = list(user_ids)
+        pipeline = self._client.pipeline()
+        for user_id in user_ids:
+            pipeline.exists(self._user_key(user_id))
+        return {
+            user_id for user_id, exists in zip(user_ids, pipeline.execute()) if exists
+        }
+
+
+def create_presence_store(url: str = None):
+    """
+    Create the presence store for a PRESENCE_STORAGE_URL.
+
+    Args:
+        url (str, optional): A redis:// URL to share presence between
+            workers. Presence is kept in process memory otherwise.
+
+    Returns:
+        The presence store
+    """
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisPresenceStore(url)
+    return MemoryPresenceStore()
+
+
+class Presence:
+    """
+    Tracks who is online and tells the users sharing a chat with them.
+
+    Changes are not sent right away but collected for
+    PRESENCE_FLUSH_INTERVAL seconds. A user who disconnects and reconnects
+    within the interval, e.g. during a reconnect storm after a deploy,
+    causes no event and no write at all. Otherwise every flush:
+
+    - writes the `last_seen` of the users who went offline in one UPDATE
+    - loads the contacts of all changed users in one query, usually
+      answered from the contacts cache
+    - sends each online contact a single `presence` event listing every
+      change they should see
+
+    so a contact gets at most one presence event per interval.
+
+    The worker refreshes the heartbeats of its own connections every
+    PRESENCE_HEARTBEAT_INTERVAL seconds. Connections without a heartbeat
+    for PRESENCE_TIMEOUT seconds, i.e. those of a worker that died, are
+    expired.
+    """
+
+    def __init__(self):
+        self.store = MemoryPresenceStore()
+        self.flush_interval = DEFAULT_PRESENCE_FLUSH_INTERVAL
+        self.heartbeat_interval = DEFAULT_PRESENCE_HEARTBEAT_INTERVAL
+        self.timeout = DEFAULT_PRESENCE_TIMEOUT
+
+        # Connections of this worker, by sid
+        self._local = {}
+        # Pending changes by user: (was_online, online, changed_at)
+        self._changes = {}
+        # New connections waiting for the list of their online contacts
+        self._snapshots = []
+        self._lock = threading.Lock()
+        self._flusher_started = False
+        self._last_heartbeat = 0.0
+        self._counters = {"events": 0, "last_seen_writes": 0, "flaps": 0}
+
+    def init_app(self, app: Flask):
+        """
+        Create the store and read the timings from the PRESENCE_* config
+        options.
+
+        Args:
+            app (Flask): The Flask app to read the config from
+        """
+        self.store = create_presence_store(app.config.get("PRESENCE_STORAGE_URL"))
+        self.flush_interval = app.config.get(
+            "PRESENCE_FLUSH_INTERVAL", DEFAULT_PRESENCE_FLUSH_INTERVAL
+        )
+        self.heartbeat_interval = app.config.get(
+            "PRESENCE_HEARTBEAT_INTERVAL", DEFAULT_PRESENCE_HEARTBEAT_INTERVAL
+        )
+        self.timeout = app.config.get("PRESENCE_TIMEOUT", DEFAULT_PRESENCE_TIMEOUT)
+
+    def connect(self, user_id: str, sid: str):
+        """
+        Record a new socket connection of a user.
+
+        Must be called inside an application context.
+
+        Args:
+            user_id (str): The connected user
+            sid (str): The socket session id
+        """
+        came_online = self.store.connect(user_id, sid)
+        with self._lock:
+            self._local[sid] = user_id
+            self._snapshots.append((user_id, sid))
+            if came_online:
+                self._record_change(user_id, True)
+        self._start_flusher()
+
+    def disconnect(self, user_id: str, sid: str):
+        """
+        Forget a closed socket connection of a user.
+
+        Must be called inside an application context.
+
+        Args:
+            user_id (str): The disconnected user
+            sid (str): The socket session id
+        """
+        went_offline = self.store.disconnect(user_id, sid)
+        with self._lock:
+            self._local.pop(sid, None)
+            if went_offline:
+                self._record_change(user_id, False)
+        self._start_flusher()
+
+    def get_sids(self, user_id: str):
+        return self.store.get_sids(user_id)
+
+    def is_online(self, user_id: str):
+        return self.store.is_online(user_id)
+
+    def flush(self):
+        """
+        Refresh heartbeats, expire stale connections, then write and send
+        the pending changes.
+
+        Must be called inside an application context.
+
+        Returns:
+            int: The number of presence events sent
+        """
+        now = time.monotonic()
+        if now - self._last_heartbeat >= self.heartbeat_interval:
+            self._last_heartbeat = now
+            with self._lock:
+                connections = [(user_id, sid) for sid, user_id in self._local.items()]
+            self.store.heartbeat(connections)
+            expired = self.store.expire(self.timeout)
+            with self._lock:
+                for user_id in expired:
+                    self._record_change(user_id, False)
+
+        with self._lock:
+            changes, self._changes = self._changes, {}
+            # Connections that closed before the flush need no snapshot
+            snapshots = [
+                (user_id, sid) for user_id, sid in self._snapshots if sid in self._local
+            ]
+            self._snapshots = []
+
+        # Users who flapped back to where they were have nothing to report
+        changes = {
+            user_id: (online, changed_at)
+            for user_id, (was_online, online, changed_at) in changes.items()
+            if online != was_online
+        }
+        if not changes and not snapshots:
+            return 0
+
+        self._write_last_seen(
+            {
+                user_id: changed_at
+                for user_id, (online, changed_at) in changes.items()
+                if not online
+            }
+        )
+
+        contacts = get_chat_contacts(
+            list(changes) + [user_id for user_id, _ in snapshots]
+        )
+        events = self._send_changes(changes, contacts)
+        events += self._send_snapshots(snapshots, contacts)
+
+        with self._lock:
+            self._counters["events"] += events
+        return events
+
+    def stats(self):
+        """
+        Get the presence counters of this worker.
+
+        Returns:
+            dict: The local connections, pending changes, and the events
+                sent, last seen times written and flaps dropped since the
+                process started
+        """
+        with self._lock:
+            return {
+                "local_connections": len(self._local),
+                "pending_changes": len(self._changes),
+                **self._counters,
+            }
+
+    def _record_change(self, user_id, online):
+        # Must be called with the lock held
+        pending = self._changes.get(user_id)
+        was_online = pending[0] if pending else not online
+        if pending and online == was_online:
+            self._counters["flaps"] += 1
+        self._changes[user_id] = (
+            was_online,
+            online,
+            datetime.now(timezone.utc).replace(tzinfo=None),
+        )
+
+    def _write_last_seen(self, last_seen):
+        if not last_seen:
+            return
+
+        # A Core executemany, unlike an ORM bulk update, does not fail when
+        # a user was deleted in the meantime
+        users = User.__table__
+        try:
+            db.session.execute(
+                update(users)
+                .where(users.c.id == bindparam("user_id"))
+                .values(last_seen=bindparam("seen_at")),
+                [
+                    {"user_id": user_id, "seen_at": seen_at}
+                    for user_id, seen_at in last_seen.items()
+                ],
+            )
+            # The chats show their members' last seen time
+            bump_member_chat_versions(*last_seen)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Failed to update last seen times: {e}")
+            return
+
+        with self._lock:
+            self._counters["last_seen_writes"] += len(last_seen)
+
+    def _send_changes(self, changes, contacts):
+        # Group the changes by the contact who should see them
+        updates = {}
+        for user_id, (online, changed_at) in changes.items():
+            entry = {
+                "user_id": user_id,
+                "online": online,
+                "last_seen": None if online else changed_at.isoformat(),
+            }
+            for contact_id in contacts.get(user_id, ()):
+                updates.setdefault(contact_id, []).append(entry)
+
+        recipients = self.store.online_users(updates)
+        for contact_id in recipients:
+            socketio.emit(
+                "presence", {"users": updates[contact_id]}, to=f"user_{contact_id}"
+            )
+        return len(recipients)
+
+    def _send_snapshots(self, snapshots, contacts):
+        if not snapshots:
+            return 0
+
+        online = self.store.online_users(
+            {
+                contact_id
+                for user_id, _ in snapshots
+                for contact_id in contacts.get(user_id, ())
+            }
+        )
+        for user_id, sid in snapshots:
+            socketio.emit(
+                "presence",
+                {
+                    "users": [
+                        {"user_id": contact_id, "online": True, "last_seen": None}
+                        for contact_id in contacts.get(user_id, ())
+                        if contact_id in online
+                    ]
+                },
+                to=sid,
+            )
+        return len(snapshots)
+
+    def _start_flusher(self):
+        with self._lock:
+            start_flusher = not self._flusher_started
+            self._flusher_started = True
+
+        if start_flusher:
+            socketio.start_background_task(self._run, current_app._get_current_object())
+
+    def _run(self, app):
+        while True:
+            socketio.sleep(self.flush_interval)
+            with app.app_context():
+                try:
+                    self.flush()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Failed to flush presence: {e}")
+
+
+presence = Presence()
@@ -0,0 +1,310 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import NamedTuple
+
+from flask import Flask, request, session
+from flask_socketio import emit
+from werkzeug.http import parse_list_header
+
+from ..errors.request_errors import RateLimitExceeded
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+DEFAULT_MAX_BUCKETS = 100000
+
+
+class RateLimit(NamedTuple):
+    """
+    A token bucket policy: up to `limit` calls at once, refilled at `limit`
+    calls per `period` seconds.
+    """
+
+    limit: int
+    period: float
+
+
+# Policies are looked up by route endpoint or socket event name. Routes and
+# events without a policy of their own share the "default" one. "ip" and
+# "connect" are checked per client address, all others per user.
+DEFAULT_RATE_LIMITS = {
+    "default": RateLimit(300, 60),
+    "ip": RateLimit(1200, 60),
+    "connect": RateLimit(30, 60),
+    "users.search_users": RateLimit(60, 60),
+    "chats.handle_send_chat_request": RateLimit(20, 60),
+    "send-message": RateLimit(30, 10),
+    "join-chat": RateLimit(60, 60),
+    "mark-read": RateLimit(120, 60),
+    "fetch-range": RateLimit(60, 60),
+}
+
+
+class MemoryRateLimitStore:
+    """
+    Keeps token buckets in the memory of the current process.
+
+    Buckets that were not used for a while are evicted first once
+    `max_buckets` is reached. An evicted bucket simply starts full again.
+
+    Args:
+        max_buckets (int): The maximum number of buckets kept
+    """
+
+    def __init__(self, max_buckets: int = DEFAULT_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key: str, limit: int, period: float):
+        """
+        Take a token from a bucket.
+
+        Args:
+            key (str): The bucket key
+            limit (int): The bucket's capacity
+            period (float): Seconds to refill the bucket from empty
+
+        Returns:
+            float: 0 if the call is allowed, otherwise the seconds until a
+                token is available
+        """
+        rate = limit / period
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (limit, now))
+            tokens = min(limit, tokens + (now - updated_at) * rate)
+
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0.0
+            else:
+                retry_after = (1 - tokens) / rate
+
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+
+        return retry_after
+
+
+# Refills and takes a token atomically on the Redis server, with the
+# server's clock so every worker sees the same time
+REDIS_TOKEN_BUCKET_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local rate = limit / period
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(bucket[1]) or limit
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(limit, tokens + (now - updated_at) * rate)
+
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+
+redis.call("HSET", KEYS[1], "tokens", tokens, "updated_at", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(period))
+return tostring(retry_after)
+"""
+
+
+class RedisRateLimitStore:
+    """
+    Keeps token buckets in Redis, so every worker process shares them.
+
+    Args:
+        url (str): The Redis connection URL
+        prefix (str): Prepended to every bucket key
+    """
+
+    def __init__(self, url: str, prefix: str = "rate-limit:"):
+        if redis is None:
+            raise RuntimeError("The redis package is required for Redis rate limits")
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(REDIS_TOKEN_BUCKET_SCRIPT)
+
+    def consume(self, key: str, limit: int, period: float):
+        """
+        Take a token from a bucket.
+
+        Args:
+            key (str): The bucket key
+            limit (int): The bucket's capacity
+            period (float): Seconds to refill the bucket from empty
+
+        Returns:
+            float: 0 if the call is allowed, otherwise the seconds until a
+                token is available
+        """
+        return float(self._script(keys=[self.prefix + key], args=[limit, period]))
+
+
+def create_rate_limit_store(url: str):
+    """
+    Create the bucket store for a RATE_LIMIT_STORAGE_URL.
+
+    Args:
+        url (str): "memory://" for an in-process store, or a redis:// URL for
+            a store shared between workers
+
+    Returns:
+        The rate limit store
+    """
+    if url.startswith("memory://"):
+        return MemoryRateLimitStore()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisRateLimitStore(url)
+    raise ValueError(f"Unsupported rate limit storage: {url}")
+
+
+class RateLimiter:
+    """
+    Applies the per-route and per-event token bucket policies.
+
+    Counts the allowed and throttled calls of every policy.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.limits = dict(DEFAULT_RATE_LIMITS)
+        self.store = MemoryRateLimitStore()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app: Flask):
+        """
+        Configure the limiter from the RATE_LIMIT_* config options.
+
+        Args:
+            app (Flask): The Flask app to read the config from
+        """
+        self.enabled = app.config.get("RATE_LIMIT_ENABLED", True)
+        self.limits = {
+            **DEFAULT_RATE_LIMITS,
+            **{
+                name: RateLimit(*limit)
+                for name, limit in app.config.get("RATE_LIMITS", {}).items()
+            },
+        }
+        self.store = create_rate_limit_store(
+            app.config.get("RATE_LIMIT_STORAGE_URL", "memory://")
+        )
+
+    def hit(self, name: str, identity: str):
+        """
+        Count a call against a policy.
+
+        Args:
+            name (str): The policy name, i.e. the route endpoint or socket
+                event. Unknown names use the "default" policy.
+            identity (str): Who is making the call, e.g. a user id or an IP
+                address
+
+        Raises:
+            RateLimitExceeded: If the caller's bucket is empty
+        """
+        if not self.enabled:
+            return
+
+        if name not in self.limits:
+            name = "default"
+        limit = self.limits[name]
+
+        retry_after = self.store.consume(
+            f"{name}:{identity}", limit.limit, limit.period
+        )
+
+        with self._lock:
+            counters = self._counters.setdefault(name, {"allowed": 0, "throttled": 0})
+            counters["throttled" if retry_after else "allowed"] += 1
+
+        if retry_after:
+            raise RateLimitExceeded(retry_after)
+
+    def stats(self):
+        """
+        Get the allowed and throttled call counts of every policy.
+
+        Returns:
+            dict: Maps policy names to their counters
+        """
+        with self._lock:
+            return {name: dict(counters) for name, counters in self._counters.items()}
+
+
+rate_limiter = RateLimiter()
+
+
+def forwarded_client_address(
+    remote_addr: str, forwarded_for: str, trusted_proxies: int
+):
+    """
+    Get a client's address behind `trusted_proxies` reverse proxies, like
+    werkzeug's ProxyFix with x_for=trusted_proxies.
+
+    The routes and the threaded socket handlers get it from ProxyFix
+    through request.remote_addr. This is for the asyncio server's socket
+    handlers, whose requests do not go through the Flask app.
+
+    Args:
+        remote_addr (str): The address of the peer connected to the app
+        forwarded_for (str): The X-Forwarded-For header, if any
+        trusted_proxies (int): The PROXY_FIX_X_FOR config option
+
+    Returns:
+        str: The address `trusted_proxies` hops back in X-Forwarded-For, or
+            `remote_addr` if the header has fewer hops
+    """
+    if trusted_proxies and forwarded_for:
+        hops = parse_list_header(forwarded_for)
+        if len(hops) >= trusted_proxies:
+            return hops[-trusted_proxies]
+    return remote_addr
+
+
+def rate_limited_event(event: str, error_event: str = "error"):
+    """
+    Rate limit a socket event handler by user and by client address.
+
+    Throttled events are answered with `error_event` instead of being
+    handled.
+
+    Args:
+        event (str): The event name, used as the policy name
+        error_event (str): The event emitted back to throttled clients
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            try:
+                rate_limiter.hit("ip", request.remote_addr)
+                user_id = session.get("user_id")
+                if user_id:
+                    rate_limiter.hit(event, user_id)
+            except RateLimitExceeded as e:
+                emit(
+                    error_event,
+                    {"message": e.message, "retry_after": e.retry_after},
+                )
+                return False
+
+            return f(*args, **kwargs)
+
+        return decorated
+
+    return decorator
@@ -0,0 +1,162 @@
+import threading
+
+from flask import current_app
+from sqlalchemy import func, or_, select
+
+from ..extensions import db, socketio
+from ..models import ChatMember, Message
+from .pagination import keyset_condition
+
+DEFAULT_FLUSH_INTERVAL = 2.0
+
+
+def advance_read_cursor(chat_id: str, member_id: str, message_id: str):
+    """
+    Mark every message of a chat up to and including `message_id` as read.
+
+    The cursor only ever moves forward. The unread count is recomputed in the
+    same UPDATE from the messages after the new cursor, so a message that is
+    sent concurrently is never lost from the count.
+
+    Args:
+        chat_id (str): The chat being read
+        member_id (str): The member reading it
+        message_id (str): The newest message the member has seen
+
+    Returns:
+        ChatMember: The member's updated membership, or None if the member or
+            message does not belong to the chat
+    """
+    message = Message.query.filter_by(id=message_id, chat_id=chat_id).first()
+    if not message:
+        return None
+
+    _move_read_cursor(member_id, message)
+    db.session.commit()
+
+    return ChatMember.query.filter_by(chat_id=chat_id, member_id=member_id).first()
+
+
+def _move_read_cursor(member_id: str, message: Message):
+    unread_after_cursor = (
+        select(func.count(Message.id))
+        .where(
+            Message.chat_id == message.chat_id,
+            Message.sender_id != member_id,
+            keyset_condition(
+                Message.sent_at, Message.id, message.sent_at, message.id, before=False
+            ),
+        )
+        .scalar_subquery()
+    )
+
+    ChatMember.query.filter(
+        ChatMember.chat_id == message.chat_id,
+        ChatMember.member_id == member_id,
+        or_(
+            ChatMember.last_read_at.is_(None),
+            keyset_condition(
+                ChatMember.last_read_at,
+                ChatMember.last_read_message_id,
+                message.sent_at,
+                message.id,
+            ),
+        ),
+    ).update(
+        {
+            ChatMember.last_read_message_id: message.id,
+            ChatMember.last_read_at: message.sent_at,
+            ChatMember.unread_count: unread_after_cursor,
+            ChatMember.version: ChatMember.version + 1,
+        },
+        synchronize_session=False,
+    )
+
+
+class ReadCursorBuffer:
+    """
+    Coalesces read cursor updates sent over the socket.
+
+    Only the newest cursor per (chat, member) is kept and the buffer is
+    written to the database every `READ_CURSOR_FLUSH_INTERVAL` seconds, so
+    scrolling through a busy chat costs one write per flush instead of one
+    per message.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flusher_started = False
+
+    def add(self, chat_id: str, member_id: str, message_id: str):
+        """
+        Queue a read cursor update, replacing any pending one for the member.
+
+        Args:
+            chat_id (str): The chat being read
+            member_id (str): The member reading it
+            message_id (str): The newest message the member has seen
+        """
+        with self._lock:
+            self._pending[(chat_id, member_id)] = message_id
+            start_flusher = not self._flusher_started
+            self._flusher_started = True
+
+        if start_flusher:
+            socketio.start_background_task(self._run, current_app._get_current_object())
+
+    def discard(self, chat_id: str, member_id: str):
+        """
+        Drop the pending update of a member, e.g. because it is being written
+        right away.
+        """
+        with self._lock:
+            self._pending.pop((chat_id, member_id), None)
+
+    def flush(self):
+        """
+        Write every pending read cursor to the database.
+
+        Must be called inside an application context.
+
+        Returns:
+            int: The number of cursors written
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if not pending:
+            return 0
+
+        # Every cursor is written in the same transaction, with the messages
+        # they point to loaded in a single query
+        try:
+            messages = {
+                message.id: message
+                for message in Message.query.filter(
+                    Message.id.in_(set(pending.values()))
+                )
+            }
+            for (chat_id, member_id), message_id in pending.items():
+                message = messages.get(message_id)
+                if message and message.chat_id == chat_id:
+                    _move_read_cursor(member_id, message)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception(
+                "Failed to write %d read cursors", len(pending)
+            )
+            return 0
+
+        return len(pending)
+
+    def _run(self, app):
+        interval = app.config.get("READ_CURSOR_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL)
+        while True:
+            socketio.sleep(interval)
+            with app.app_context():
+                self.flush()
+
+
+read_cursor_buffer = ReadCursorBuffer()
@@ -0,0 +1,188 @@
+import threading
+from functools import wraps
+
+from flask import current_app, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+
+from .cache import TTLCache
+
+# The Flask-SQLAlchemy bind of the replica, see REPLICA_DATABASE_URI
+REPLICA_BIND = "replica"
+
+DEFAULT_REPLICA_STICKY_SECONDS = 5
+DEFAULT_RECENT_WRITERS_SIZE = 100000
+
+# Users who committed a write within the last REPLICA_STICKY_SECONDS, whose
+# reads stay on the primary until the replica has caught up with them
+recent_writers = TTLCache(DEFAULT_RECENT_WRITERS_SIZE)
+
+_counters = {"replica_reads": 0, "sticky_reads": 0}
+_counters_lock = threading.Lock()
+
+
+class RoutingSession(Session):
+    """
+    A Flask-SQLAlchemy session sending reads to the replica bind once
+    use_replica() allowed it.
+
+    Only plain SELECTs go to the replica. Flushes, INSERT/UPDATE/DELETE
+    statements, SELECT ... FOR UPDATE and every read after a write in the
+    same transaction go to the primary, as does everything when no replica
+    is configured.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._reads_from_replica(clause):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _reads_from_replica(self, clause):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info["wrote"] = True
+            return False
+
+        return (
+            self.info.get("use_replica", False)
+            and not self.info.get("wrote", False)
+            and getattr(clause, "is_select", False)
+            and getattr(clause, "_for_update_arg", None) is None
+        )
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _remember_writer(session):
+    if not session.info.pop("wrote", False):
+        return
+
+    # Reloading the committed objects, and the user's next reads, must see
+    # the write, so they stay on the primary until the replica has it
+    session.info["use_replica"] = False
+    if session.info.get("user_id"):
+        record_write(session.info["user_id"])
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _forget_write(session):
+    session.info.pop("wrote", None)
+
+
+def has_replica():
+    """
+    Check whether a read replica is configured.
+
+    Returns:
+        bool: True if SQLALCHEMY_BINDS has a replica bind
+    """
+    return REPLICA_BIND in current_app.config.get("SQLALCHEMY_BINDS", {})
+
+
+def set_session_user(user_id: str):
+    """
+    Attribute the writes committed by the current database session to a
+    user, so their reads stick to the primary afterwards.
+
+    Args:
+        user_id (str): The user making the request
+    """
+    _get_db().session.info["user_id"] = user_id
+
+
+def record_write(user_id: str):
+    """
+    Keep a user's reads on the primary for REPLICA_STICKY_SECONDS, e.g.
+    after committing a message on their behalf.
+
+    Args:
+        user_id (str): The user who wrote
+    """
+    if has_app_context() and has_replica():
+        recent_writers.set(
+            user_id,
+            True,
+            current_app.config.get(
+                "REPLICA_STICKY_SECONDS", DEFAULT_REPLICA_STICKY_SECONDS
+            ),
+        )
+
+
+def replica_bind(user_id: str):
+    """
+    Get the engine to run a user's read-only query on.
+
+    Args:
+        user_id (str): The user the query is for
+
+    Returns:
+        Engine: The replica engine, or None to use the primary because no
+            replica is configured or the user wrote recently
+    """
+    if not has_replica():
+        return None
+
+    if recent_writers.get(user_id):
+        _count("sticky_reads")
+        return None
+
+    _count("replica_reads")
+    return _get_db().engines[REPLICA_BIND]
+
+
+def use_replica(user_id: str):
+    """
+    Send the plain SELECTs of the current database session to the replica,
+    unless the user wrote recently.
+
+    Args:
+        user_id (str): The user making the request
+
+    Returns:
+        bool: True if reads go to the replica
+    """
+    session = _get_db().session
+    session.info["user_id"] = user_id
+    session.info["use_replica"] = replica_bind(user_id) is not None
+    return session.info["use_replica"]
+
+
+def read_only_route(f):
+    """Decorator sending the reads of a read-only route to the replica.
+
+    Goes below access_required, so the route's user is known and their
+    recent writes keep them on the primary. The route must not write.
+    """
+
+    @wraps(f)
+    def decorated(user, *args, **kwargs):
+        use_replica(user.id)
+        return f(user, *args, **kwargs)
+
+    return decorated
+
+
+def replica_stats():
+    """
+    Get the routing counters.
+
+    Returns:
+        dict: Whether a replica is configured, the routes and membership
+            checks whose reads went to it and those kept on the primary
+            because the user wrote recently, and the recent writers cache
+            stats
+    """
+    with _counters_lock:
+        return {
+            "enabled": has_replica(),
+            **_counters,
+            "recent_writers": recent_writers.stats(),
+        }
+
+
+def _count(counter):
+    with _counters_lock:
+        _counters[counter] += 1
+
+
+def _get_db():
+    return current_app.extensions["sqlalchemy"]
@@ -12,13 +12,18 @@ def error_handler(e: AppException):
     :param e: The AppException instance
     :return: A JSON response with the error message, error code, and status code
     """
-    return send_response(
+    response, status_code = send_response(
         data={"error": e.error, "error_code": e.error_code.value},
         message=e.message,
         status_code=e.status_code,
         success=False,
     )
 
+    # Some errors carry headers of their own, e.g. Retry-After
+    response.headers.update(getattr(e, "headers", None) or {})
+
+    return response, status_code
+
 
 def register_app_error_handlers(app: Flask):
     """
@@ -1,10 +1,15 @@
+import hashlib
 from typing import Any
 
-from flask import jsonify
+from flask import jsonify, make_response, request
 
 
 def send_response(
-    data: Any = None, message: str = None, success: bool = True, status_code: int = 200
+    data: Any = None,
+    message: str = None,
+    success: bool = True,
+    status_code: int = 200,
+    etag: str = None,
 ):
     """
     Helper function to return a JSON response with a given status code.
@@ -14,6 +19,7 @@ def send_response(
         provided, a default message indicating success or failure is used.
     :param success: A boolean indicating whether the request was successful
     :param status_code: The HTTP status code to return
+    :param etag: An optional strong ETag identifying the version of the data
 
     :return: A tuple containing the JSON response and the status code
     """
@@ -29,4 +35,53 @@ def send_response(
     if data is not None:
         response["data"] = data
 
-    return jsonify(response), status_code
+    json_response = jsonify(response)
+    if etag:
+        _set_etag(json_response, etag)
+
+    return json_response, status_code
+
+
+def make_etag(*parts: Any):
+    """
+    Build a strong ETag from the version counters a response depends on.
+
+    :param parts: The values identifying the version of the response, e.g.
+        the route name, the user id and the relevant version counters
+
+    :return: The ETag value
+    """
+    key = "|".join(str(part) for part in parts)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def is_not_modified(etag: str):
+    """
+    Check whether the client already has the version identified by the ETag.
+
+    :param etag: The ETag of the current version
+
+    :return: True if the request's If-None-Match header matches the ETag
+    """
+    # If-None-Match uses the weak comparison, so the weakened ETags of
+    # compressed responses still match
+    return request.if_none_match.contains_weak(etag)
+
+
+def send_not_modified(etag: str):
+    """
+    Helper function to return an empty 304 Not Modified response.
+
+    :param etag: The ETag of the current version
+
+    :return: The 304 response
+    """
+    response = make_response("", 304)
+    _set_etag(response, etag)
+    return response
+
+
+def _set_etag(response, etag: str):
+    response.set_etag(etag)
+    # Cached copies must always be revalidated, they are per user
+    response.headers["Cache-Control"] = "private, no-cache"
@@ -14,8 +14,12 @@ def register_routes(app: Flask):
     """
     from ..routes import auth as auth_blueprint
     from ..routes import chats as chats_blueprint
+    from ..routes import metrics as metrics_blueprint
+    from ..routes import sync as sync_blueprint
     from ..routes import users as users_blueprint
 
     app.register_blueprint(chats_blueprint)
     app.register_blueprint(auth_blueprint)
     app.register_blueprint(users_blueprint)
+    app.register_blueprint(sync_blueprint)
+    app.register_blueprint(metrics_blueprint)
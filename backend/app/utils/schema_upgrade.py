@@ -0,0 +1,90 @@
+from sqlalchemy import MetaData, UniqueConstraint, inspect
+from sqlalchemy.engine import Connection
+from sqlalchemy.schema import CreateColumn
+
+
+def upgrade_schema(connection: Connection, metadata: MetaData):
+    """
+    Bring an existing database up to the models, which create_all() does not
+    do for tables that already exist.
+
+    Missing tables are created, missing columns are added with ALTER TABLE,
+    and missing indexes are created. Unique constraints are added as unique
+    indexes of the same name, since SQLite cannot add constraints to an
+    existing table. Running it again on an up to date database changes
+    nothing.
+
+    Args:
+        connection (Connection): The connection to upgrade, in a transaction
+        metadata (MetaData): The metadata of the models
+
+    Returns:
+        list: A description of every change made
+
+    Raises:
+        ValueError: If a missing column is NOT NULL without a server default,
+            so existing rows could not get a value
+    """
+    changes = []
+    existing_tables = set(inspect(connection).get_table_names())
+
+    missing_tables = [
+        table for table in metadata.sorted_tables if table.name not in existing_tables
+    ]
+    metadata.create_all(connection, tables=missing_tables)
+    changes.extend(f"Created table {table.name}" for table in missing_tables)
+
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        inspector = inspect(connection)
+        existing_columns = {
+            column["name"] for column in inspector.get_columns(table.name)
+        }
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            if not column.nullable and column.server_default is None:
+                raise ValueError(
+                    f"Cannot add {table.name}.{column.name}: it is NOT NULL "
+                    "without a server default"
+                )
+
+            column_ddl = CreateColumn(column).compile(dialect=connection.dialect)
+            connection.exec_driver_sql(
+                f"ALTER TABLE {_quote(connection, table.name)} ADD COLUMN {column_ddl}"
+            )
+            changes.append(f"Added column {table.name}.{column.name}")
+
+        existing_indexes = {
+            index["name"] for index in inspector.get_indexes(table.name)
+        } | {
+            constraint["name"]
+            for constraint in inspector.get_unique_constraints(table.name)
+        }
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing_indexes:
+                index.create(connection)
+                changes.append(f"Created index {index.name}")
+
+        for constraint in table.constraints:
+            if (
+                isinstance(constraint, UniqueConstraint)
+                and constraint.name
+                and constraint.name not in existing_indexes
+            ):
+                columns = ", ".join(
+                    _quote(connection, column.name) for column in constraint.columns
+                )
+                connection.exec_driver_sql(
+                    f"CREATE UNIQUE INDEX {_quote(connection, constraint.name)} "
+                    f"ON {_quote(connection, table.name)} ({columns})"
+                )
+                changes.append(f"Created unique index {constraint.name}")
+
+    return changes
+
+
+def _quote(connection, name):
+    return connection.dialect.identifier_preparer.quote(name)
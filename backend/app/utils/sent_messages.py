@@ -0,0 +1,118 @@
+from flask import current_app
+from sqlalchemy import select
+
+from ..extensions import db
+from ..models import Message
+from .cache import TTLCache
+
+DEFAULT_SENT_MESSAGE_CACHE_SIZE = 10000
+DEFAULT_SENT_MESSAGE_CACHE_TTL = 600
+
+MAX_CLIENT_MSG_ID_LENGTH = 64
+
+# Acks of recently sent messages by (sender_id, client_msg_id), so a retry
+# reaching the same worker is answered without touching the database
+sent_message_cache = TTLCache(DEFAULT_SENT_MESSAGE_CACHE_SIZE)
+
+
+def is_valid_client_msg_id(client_msg_id):
+    """
+    Check a client-generated message id, e.g. a UUID.
+
+    Args:
+        client_msg_id: The `client_msg_id` of a send-message event
+
+    Returns:
+        bool: True if it is a non-empty string of at most
+            MAX_CLIENT_MSG_ID_LENGTH characters
+    """
+    return (
+        isinstance(client_msg_id, str)
+        and 0 < len(client_msg_id) <= MAX_CLIENT_MSG_ID_LENGTH
+    )
+
+
+def message_ack(message, duplicate: bool = False):
+    """
+    Build the ack of a send-message event.
+
+    Args:
+        message (Message): The stored message
+        duplicate (bool): Whether the event was a retry of a message that
+            was already stored
+
+    Returns:
+        dict: The server id and sequence number of the message
+    """
+    return {
+        "id": message.id,
+        "seq": message.seq,
+        "chat_id": message.chat_id,
+        "client_msg_id": message.client_msg_id,
+        "sent_at": message.sent_at.isoformat(),
+        "duplicate": duplicate,
+    }
+
+
+def get_sent_message_ack(sender_id: str, client_msg_id: str):
+    """
+    Look up the ack of a message this worker stored recently.
+
+    Args:
+        sender_id (str): The sender
+        client_msg_id (str): The sender's id for the message
+
+    Returns:
+        dict: The ack marked as a duplicate, or None if the message is not
+            cached
+    """
+    ack = sent_message_cache.get((sender_id, client_msg_id))
+    return {**ack, "duplicate": True} if ack else None
+
+
+def remember_sent_message(message: Message):
+    """
+    Cache the ack of a stored message, so retries of it are answered from
+    memory.
+
+    Args:
+        message (Message): The committed message
+    """
+    if message.client_msg_id:
+        sent_message_cache.set(
+            (message.sender_id, message.client_msg_id),
+            message_ack(message),
+            current_app.config.get(
+                "SENT_MESSAGE_CACHE_TTL", DEFAULT_SENT_MESSAGE_CACHE_TTL
+            ),
+        )
+
+
+def sent_message_select(sender_id: str, client_msg_id: str):
+    """
+    Build the SELECT of a message by its sender's id for it, answered from
+    the `(sender_id, client_msg_id)` unique index.
+
+    Returns:
+        Select: The statement, for a sync or async session to execute
+    """
+    return select(Message).where(
+        Message.sender_id == sender_id, Message.client_msg_id == client_msg_id
+    )
+
+
+def find_sent_message(sender_id: str, client_msg_id: str):
+    """
+    Load a message by its sender's id for it, e.g. after inserting a retry
+    failed on the unique constraint.
+
+    Args:
+        sender_id (str): The sender
+        client_msg_id (str): The sender's id for the message
+
+    Returns:
+        Message: The stored message, or None
+    """
+    return db.session.execute(
+        sent_message_select(sender_id, client_msg_id)
+    ).scalar_one_or_none()
@@ -0,0 +1,261 @@
+import re
+from functools import lru_cache
+from operator import attrgetter
+
+# Matches sparse fieldset parameters such as `fields[user]=id,name`
+FIELDSET_PARAM = re.compile(r"^fields\[(\w+)\]$")
+
+# Fields that are always kept, whatever the requested fieldset
+ALWAYS_INCLUDED = frozenset({"id"})
+
+
+class Nested:
+    """
+    A field holding another serialized object, e.g. the sender of a message.
+
+    Args:
+        attribute (str): The attribute holding the nested object, or None to
+            serialize the outer object itself with the nested serializer
+        serializer (Serializer): The serializer of the nested object
+        only (tuple, optional): The nested fields included by default
+    """
+
+    def __init__(self, attribute, serializer, only=None):
+        self.get = attrgetter(attribute) if attribute else None
+        self.serializer = serializer
+        self.only = tuple(only) if only else None
+
+
+class Serializer:
+    """
+    Turns model instances or result rows into response dicts.
+
+    Fields map an output name to an attribute name, a callable or a Nested
+    field. The getters of each combination of fields are resolved once and
+    cached, so serializing a row is a single dict comprehension over
+    precompiled getters.
+
+    Args:
+        type_name (str): The name clients use to select a sparse fieldset,
+            e.g. `fields[user]=id,name`
+        **fields: The output field names and their sources
+    """
+
+    def __init__(self, type_name: str, **fields):
+        self.type_name = type_name
+        self.sources = {
+            name: source for name, source in fields.items() if isinstance(source, str)
+        }
+        self.fields = {
+            name: attrgetter(source) if isinstance(source, str) else source
+            for name, source in fields.items()
+        }
+
+    def compile(self, only=None, fieldsets=()):
+        """
+        Build the function serializing one object.
+
+        Args:
+            only (tuple, optional): The fields included by default, all of
+                them when omitted
+            fieldsets (tuple): The sparse fieldsets requested by the client,
+                as returned by get_fieldsets
+
+        Returns:
+            callable: Takes an object and returns its dict
+        """
+        return self._compile(tuple(only) if only else None, fieldsets)
+
+    @lru_cache(maxsize=256)
+    def _compile(self, only, fieldsets):
+        names = only or tuple(self.fields)
+        requested = dict(fieldsets).get(self.type_name)
+        if requested is not None:
+            names = tuple(
+                name for name in names if name in requested or name in ALWAYS_INCLUDED
+            )
+
+        # Plain attributes are read with a single attrgetter call, computed
+        # and nested fields are added after them
+        attributes = tuple(name for name in names if name in self.sources)
+        computed = tuple(
+            (name, self._compile_field(self.fields[name], fieldsets))
+            for name in names
+            if name not in attributes
+        )
+
+        if not attributes:
+
+            def serialize(obj):
+                return {name: get(obj) for name, get in computed}
+
+            return serialize
+
+        get_attributes = attrgetter(*(self.sources[name] for name in attributes))
+        if len(attributes) == 1:
+            # attrgetter only returns a tuple for several attributes
+            single = get_attributes
+            get_attributes = lambda obj: (single(obj),)  # noqa: E731
+
+        def serialize(obj):
+            data = dict(zip(attributes, get_attributes(obj)))
+            for name, get in computed:
+                data[name] = get(obj)
+            return data
+
+        return serialize
+
+    @staticmethod
+    def _compile_field(field, fieldsets):
+        if not isinstance(field, Nested):
+            return field
+
+        serialize = field.serializer._compile(field.only, fieldsets)
+        if field.get is None:
+            return serialize
+
+        get = field.get
+
+        def serialize_nested(obj):
+            value = get(obj)
+            return serialize(value) if value is not None else None
+
+        return serialize_nested
+
+    def dump(self, obj, only=None, fieldsets=()):
+        """
+        Serialize a single object.
+
+        Args:
+            obj: The object to serialize
+            only (tuple, optional): The fields included by default
+            fieldsets (tuple): The sparse fieldsets requested by the client
+
+        Returns:
+            dict: The serialized object
+        """
+        return self.compile(only, fieldsets)(obj)
+
+    def dump_many(self, objs, only=None, fieldsets=()):
+        """
+        Serialize a list of objects.
+
+        Args:
+            objs: The objects to serialize
+            only (tuple, optional): The fields included by default
+            fieldsets (tuple): The sparse fieldsets requested by the client
+
+        Returns:
+            list: The serialized objects
+        """
+        serialize = self.compile(only, fieldsets)
+        return [serialize(obj) for obj in objs]
+
+
+def get_fieldsets(args):
+    """
+    Read the sparse fieldsets requested with `fields[<type>]=a,b` query
+    parameters.
+
+    Unknown types and fields are ignored, and `id` is always included.
+
+    Args:
+        args: The request arguments
+
+    Returns:
+        tuple: Hashable ((type, frozenset of field names), ...) pairs, sorted
+            by type
+    """
+    fieldsets = []
+    for key in args:
+        match = FIELDSET_PARAM.match(key)
+        if match:
+            names = frozenset(
+                name.strip() for name in args.get(key, "").split(",") if name.strip()
+            )
+            fieldsets.append((match.group(1), names))
+
+    return tuple(sorted(fieldsets, key=lambda fieldset: fieldset[0]))
+
+
+# User profiles, shown wherever another user appears
+user_serializer = Serializer(
+    "user",
+    id="id",
+    name="name",
+    username="username",
+    email="email",
+    profile_picture="profile_picture",
+    last_seen="last_seen",
+)
+
+# The public profile fields, without the email address
+USER_SUMMARY_FIELDS = ("id", "name", "username", "profile_picture")
+
+message_serializer = Serializer(
+    "message",
+    id="id",
+    seq="seq",
+    content="content",
+    sent_at="sent_at",
+    chat_id="chat_id",
+    sender_id="sender_id",
+    sender=Nested("author", user_serializer, only=USER_SUMMARY_FIELDS),
+)
+
+chat_request_serializer = Serializer(
+    "chat_request",
+    id="id",
+    sender_id="sender_id",
+    receiver_id="receiver_id",
+    status="status",
+    created_at="created_at",
+    updated_at="updated_at",
+    sender=Nested("sender", user_serializer, only=USER_SUMMARY_FIELDS),
+)
+
+membership_serializer = Serializer(
+    "membership",
+    chat_id="chat_id",
+    member_id="member_id",
+    member_role="member_role",
+    joined_at="joined_at",
+    last_read_message_id="last_read_message_id",
+    unread_count="unread_count",
+)
+
+# The sender columns of message search result rows, exposed as a user
+search_sender_serializer = Serializer(
+    "user",
+    id="sender_id",
+    name="sender_name",
+    username="sender_username",
+    profile_picture="sender_profile_picture",
+)
+
+search_result_serializer = Serializer(
+    "message",
+    id="id",
+    chat_id="chat_id",
+    snippet="snippet",
+    sent_at="sent_at",
+    sender=Nested(None, search_sender_serializer),
+)
+
+# The last message pointer stored on a chat, exposed as a message
+last_message_serializer = Serializer(
+    "message",
+    id="last_message_id",
+    content="last_message_preview",
+    sent_at="last_message_at",
+    sender=Nested(
+        None,
+        Serializer(
+            "user",
+            id="last_message_sender_id",
+            name=lambda chat: (
+                chat.last_message_sender.username if chat.last_message_sender else None
+            ),
+        ),
+    ),
+)
@@ -0,0 +1,59 @@
+import socketio
+from flask import Flask
+
+from .local_pubsub import LocalPubSubManager
+
+
+def get_socketio_queue_options(app: Flask):
+    """
+    Build the Socket.IO options that route emits through the message queue
+    set in SOCKETIO_MESSAGE_QUEUE, so several worker processes can serve
+    sockets behind a load balancer.
+
+    redis://, amqp://, kafka:// and zmq+tcp:// URLs use python-socketio's own
+    managers. local://host:port uses LocalPubSubManager, see
+    `flask run-socket-broker`.
+
+    Args:
+        app (Flask): The Flask app to read the config from
+
+    Returns:
+        dict: The keyword arguments for SocketIO.init_app
+    """
+    url = app.config.get("SOCKETIO_MESSAGE_QUEUE")
+    if not url:
+        return {}
+
+    channel = app.config.get("SOCKETIO_CHANNEL", "flask-socketio")
+    if url.startswith("local://"):
+        return {
+            "client_manager": LocalPubSubManager(
+                url, authkey=app.config["SECRET_KEY"].encode(), channel=channel
+            )
+        }
+
+    return {"message_queue": url, "channel": channel}
+
+
+def get_async_socketio_manager(app: Flask):
+    """
+    Build the client manager of the asyncio server for the message queue
+    set in SOCKETIO_MESSAGE_QUEUE, see app/asgi.py.
+
+    Args:
+        app (Flask): The Flask app to read the config from
+
+    Returns:
+        AsyncManager: The manager, or None without a message queue
+    """
+    url = app.config.get("SOCKETIO_MESSAGE_QUEUE")
+    if not url:
+        return None
+
+    channel = app.config.get("SOCKETIO_CHANNEL", "flask-socketio")
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return socketio.AsyncRedisManager(url, channel=channel)
+    if url.startswith(("amqp://", "amqps://")):
+        return socketio.AsyncAioPikaManager(url, channel=channel)
+
+    raise ValueError(f"Unsupported message queue for the asyncio server: {url}")
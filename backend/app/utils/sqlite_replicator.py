@@ -0,0 +1,67 @@
+import sqlite3
+import time
+from collections import deque
+from contextlib import closing
+
+
+class SQLiteReplicator:
+    """
+    Stands in for database replication when trying the read replica locally,
+    by copying the primary SQLite file over the replica one.
+
+    Snapshots of the primary are taken every `interval` seconds and applied
+    to the replica `delay` seconds later, so the replica lags behind like a
+    real one would. Each snapshot is a full copy of the database held in
+    memory, which is only meant for development databases.
+
+    Args:
+        primary (str): The path of the primary database
+        replica (str): The path of the replica database
+        delay (float): Seconds between a snapshot and its copy to the replica
+        interval (float): Seconds between snapshots
+    """
+
+    def __init__(self, primary: str, replica: str, delay: float, interval: float):
+        self.primary = primary
+        self.replica = replica
+        self.delay = delay
+        self.interval = interval
+        self._snapshots = deque()
+
+    def take_snapshot(self):
+        """Copy the primary into a new in-memory snapshot."""
+        snapshot = sqlite3.connect(":memory:", check_same_thread=False)
+        with closing(sqlite3.connect(self.primary)) as primary:
+            primary.backup(snapshot)
+        self._snapshots.append((time.monotonic(), snapshot))
+
+    def apply_due_snapshots(self):
+        """
+        Copy the newest snapshot that is at least `delay` seconds old to the
+        replica, dropping the older ones.
+
+        Returns:
+            bool: True if the replica was updated
+        """
+        due = None
+        while (
+            self._snapshots and self._snapshots[0][0] <= time.monotonic() - self.delay
+        ):
+            if due is not None:
+                due.close()
+            _, due = self._snapshots.popleft()
+
+        if due is None:
+            return False
+
+        with closing(sqlite3.connect(self.replica)) as replica:
+            due.backup(replica)
+        due.close()
+        return True
+
+    def serve_forever(self):
+        """Replicate until interrupted."""
+        while True:
+            self.take_snapshot()
+            self.apply_due_snapshots()
+            time.sleep(self.interval)
@@ -0,0 +1,250 @@
+import re
+
+from sqlalchemy import (
+    Float,
+    case,
+    cast,
+    delete,
+    event,
+    func,
+    insert,
+    inspect,
+    literal,
+    select,
+)
+
+from ..extensions import db
+from ..models import User, UserSearchGram
+
+
+def _words(value: str):
+    return re.findall(r"[^\W_]+", (value or "").lower())
+
+
+def _word_grams(word: str, prefix: bool = False):
+    # Pad like pg_trgm so short words and word starts still produce grams.
+    # Prefix words are not padded at the end since the user may still be
+    # typing them.
+    padded = f"  {word}" if prefix else f"  {word} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def user_grams(name: str, username: str):
+    """
+    Build the set of trigrams indexed for a user.
+
+    Args:
+        name (str): The user's full name
+        username (str): The user's username
+
+    Returns:
+        set: The trigrams of every word in the name and username
+    """
+    grams = set()
+    for word in _words(name) + _words(username):
+        grams |= _word_grams(word)
+    return grams
+
+
+def query_grams(search_query: str):
+    """
+    Build the set of trigrams to look up for a search query.
+
+    The last word is treated as a prefix.
+
+    Args:
+        search_query (str): The raw search text
+
+    Returns:
+        set: The trigrams of the query
+    """
+    words = _words(search_query)
+    grams = set()
+    for index, word in enumerate(words):
+        grams |= _word_grams(word, prefix=index == len(words) - 1)
+    return grams
+
+
+def _replace_user_grams(connection, user):
+    connection.execute(
+        delete(UserSearchGram.__table__).where(
+            UserSearchGram.__table__.c.user_id == user.id
+        )
+    )
+    rows = [
+        {"gram": gram, "user_id": user.id}
+        for gram in user_grams(user.name, user.username)
+    ]
+    if rows:
+        connection.execute(insert(UserSearchGram.__table__), rows)
+
+
+@event.listens_for(User, "after_insert")
+def _index_new_user(mapper, connection, target):
+    _replace_user_grams(connection, target)
+
+
+@event.listens_for(User, "after_update")
+def _reindex_updated_user(mapper, connection, target):
+    state = inspect(target)
+    if (
+        state.attrs.name.history.has_changes()
+        or state.attrs.username.history.has_changes()
+    ):
+        _replace_user_grams(connection, target)
+
+
+@event.listens_for(User, "before_delete")
+def _unindex_deleted_user(mapper, connection, target):
+    connection.execute(
+        delete(UserSearchGram.__table__).where(
+            UserSearchGram.__table__.c.user_id == target.id
+        )
+    )
+
+
+def rebuild_user_search_index(batch_size: int = 1000):
+    """
+    Rebuild the search trigrams of every user.
+
+    Args:
+        batch_size (int): The number of users indexed per transaction
+
+    Returns:
+        int: The number of users indexed
+    """
+    indexed = 0
+    last_user_id = ""
+
+    while True:
+        user_batch = (
+            db.session.query(User.id, User.name, User.username)
+            .filter(User.id > last_user_id)
+            .order_by(User.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not user_batch:
+            break
+
+        user_ids = [user.id for user in user_batch]
+        db.session.execute(
+            delete(UserSearchGram).where(UserSearchGram.user_id.in_(user_ids))
+        )
+        rows = [
+            {"gram": gram, "user_id": user.id}
+            for user in user_batch
+            for gram in user_grams(user.name, user.username)
+        ]
+        if rows:
+            db.session.execute(insert(UserSearchGram), rows)
+        db.session.commit()
+
+        indexed += len(user_batch)
+        last_user_id = user_ids[-1]
+
+    return indexed
+
+
+def _like_prefix(value: str):
+    # Match the value literally at the start of a string
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}%"
+
+
+def _matching_users(search_query: str, exclude_user_id: str = None):
+    """
+    Build the subquery of the users sharing enough trigrams with a query.
+
+    Returns:
+        Subquery: The `user_id` and trigram `hits` of every match, or None
+            if the query has no trigrams
+    """
+    grams = query_grams(search_query)
+    if not grams:
+        return None
+
+    # Require half of the query's grams to match, and two of them past the
+    # first letter. This keeps typos in while a single shared trigram, like
+    # the start of any word with the same first letter, is not enough.
+    min_hits = min(len(grams), max(2, (len(grams) + 1) // 2))
+    hits = func.count(UserSearchGram.gram)
+
+    matches = select(
+        UserSearchGram.user_id, hits.label("hits"), literal(len(grams)).label("grams")
+    ).where(UserSearchGram.gram.in_(grams))
+    if exclude_user_id:
+        matches = matches.where(UserSearchGram.user_id != exclude_user_id)
+
+    return matches.group_by(UserSearchGram.user_id).having(hits >= min_hits).subquery()
+
+
+def search_user_ids(
+    search_query: str, exclude_user_id: str = None, offset: int = 0, limit: int = None
+):
+    """
+    Find users whose name or username matches the query.
+
+    Matches are found through the trigram index, so typos still match, and
+    ranked in the database with exact and prefix matches first, so paging
+    never cuts a better match.
+
+    Args:
+        search_query (str): The raw search text
+        exclude_user_id (str, optional): A user to leave out of the results,
+            usually the one searching
+        offset (int): The number of best matches to skip
+        limit (int, optional): The maximum number of ids returned
+
+    Returns:
+        list: The matching user ids, best match first
+    """
+    matches = _matching_users(search_query, exclude_user_id)
+    if matches is None:
+        return []
+
+    query = search_query.strip().lower()
+    prefix = _like_prefix(query)
+    username = func.lower(User.username)
+    name = func.lower(func.coalesce(User.name, ""))
+
+    score = (
+        cast(matches.c.hits, Float) / matches.c.grams
+        + case(
+            (username == query, 3),
+            (username.like(prefix, escape="\\"), 2),
+            else_=0,
+        )
+        + case(
+            (name.like(prefix, escape="\\"), 1.5),
+            (name.like(f"% {prefix}", escape="\\"), 1),
+            else_=0,
+        )
+    )
+
+    ranked = (
+        select(User.id)
+        .join(matches, matches.c.user_id == User.id)
+        .order_by(score.desc(), User.username)
+        .offset(offset)
+        .limit(limit)
+    )
+    return list(db.session.execute(ranked).scalars())
+
+
+def count_matching_users(search_query: str, exclude_user_id: str = None):
+    """
+    Count the users search_user_ids can return for a query.
+
+    Args:
+        search_query (str): The raw search text
+        exclude_user_id (str, optional): A user to leave out of the count
+
+    Returns:
+        int: The number of matching users
+    """
+    matches = _matching_users(search_query, exclude_user_id)
+    if matches is None:
+        return 0
+
+    return db.session.execute(select(func.count()).select_from(matches)).scalar()
@@ -1,7 +1,19 @@
-from werkzeug.security import generate_password_hash
+from sqlalchemy import and_, or_
 
 from ..extensions import db
-from ..models import Chat, ChatMember, ChatRequest, User
+from ..models import ChatRequest, User
+from .auth_cache import invalidate_user_tokens
+from .chat_utility import (
+    bump_member_chat_versions,
+    bump_sender_requests_versions,
+    get_direct_chat,
+    get_direct_chats,
+)
+from .membership_cache import invalidate_chat_membership
+from .password_hashing import password_hasher
+
+# User fields that are shown to the members of the user's chats
+PROFILE_FIELDS = ("name", "username", "email", "profile_picture")
 
 
 def create_user(fullName: str, username: str, email: str, password: str):
@@ -25,7 +37,7 @@ def create_user(fullName: str, username: str, email: str, password: str):
     if User.query.filter_by(username=username).first():
         return None, "Username already taken, please choose a different username", 409
 
-    hashed_password = generate_password_hash(password)
+    hashed_password = password_hasher.hash(password)
     new_user = User(
         name=fullName,
         username=username,
@@ -92,7 +104,14 @@ def update_user(user_id: str, **kwargs):
             if hasattr(user, key):
                 setattr(user, key, value)
 
+        # Chats and chat requests show their members' and senders' profiles,
+        # so their cached views go stale
+        if any(key in PROFILE_FIELDS for key in kwargs):
+            bump_member_chat_versions(user_id)
+            bump_sender_requests_versions(user_id)
+
         db.session.commit()
+        invalidate_user_tokens(user_id)
         return user, "User updated successfully", 200
     except Exception as e:
         db.session.rollback()
@@ -113,6 +132,8 @@ def delete_user(user_id: str):
     try:
         db.session.delete(user)
         db.session.commit()
+        invalidate_user_tokens(user_id)
+        invalidate_chat_membership(member_id=user_id)
         return True, "User deleted successfully"
     except Exception as e:
         db.session.rollback()
@@ -131,8 +152,11 @@ def change_password(user_id: str, new_password: str):
     if not user:
         return False, "User not found"
 
+    # Hashing is done before the try block so a busy hasher surfaces as a 503
+    password_hash = password_hasher.hash(new_password)
+
     try:
-        user.password_hash = generate_password_hash(new_password)
+        user.password_hash = password_hash
         db.session.commit()
         return True, "Password changed successfully"
     except Exception as e:
@@ -142,16 +166,7 @@ def change_password(user_id: str, new_password: str):
 
 def get_relationship_status(user_id: str, other_user_id: str):
     # Check if there is an existing chat (i.e. they are already friends)
-    existing_chat = (
-        Chat.query.filter(Chat.chat_type == "one-on-one")
-        .join(ChatMember)
-        .filter(ChatMember.member_id.in_([user_id, other_user_id]))
-        .group_by(Chat.id)
-        .having(db.func.count(Chat.id) == 2)
-        .first()
-    )
-
-    if existing_chat:
+    if get_direct_chat(user_id, other_user_id):
         return "friends"
 
     # Check if pending chat request exists
@@ -163,3 +178,50 @@ def get_relationship_status(user_id: str, other_user_id: str):
         return "requested"
 
     return "unknown"
+
+
+def get_relationship_statuses(user_id: str, other_user_ids: list):
+    """
+    Resolve the relationship between a user and many other users at once.
+
+    Uses a constant number of queries no matter how many users are passed:
+    one for direct chats and one for pending chat requests.
+
+    Args:
+        user_id (str): The user the relationships are seen from
+        other_user_ids (list): The ids of the other users
+
+    Returns:
+        dict: Maps each other user's id to a (relationship_status, request_id)
+            tuple. The status is "friends", "request_sent", "request_received"
+            or "unknown" and request_id is only set for pending requests.
+    """
+    statuses = {other_user_id: ("unknown", None) for other_user_id in other_user_ids}
+    if not other_user_ids:
+        return statuses
+
+    # Requests first, so an existing chat takes precedence below
+    pending_requests = ChatRequest.query.filter(
+        ChatRequest.status == "pending",
+        or_(
+            and_(
+                ChatRequest.sender_id == user_id,
+                ChatRequest.receiver_id.in_(other_user_ids),
+            ),
+            and_(
+                ChatRequest.receiver_id == user_id,
+                ChatRequest.sender_id.in_(other_user_ids),
+            ),
+        ),
+    ).all()
+
+    for chat_request in pending_requests:
+        if chat_request.sender_id == user_id:
+            statuses[chat_request.receiver_id] = ("request_sent", chat_request.id)
+        elif statuses[chat_request.sender_id][0] != "request_sent":
+            statuses[chat_request.sender_id] = ("request_received", chat_request.id)
+
+    for friend_id in get_direct_chats(user_id, other_user_ids):
+        statuses[friend_id] = ("friends", None)
+
+    return statuses
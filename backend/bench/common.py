@@ -0,0 +1,72 @@
+"""
+Shared setup of the benchmarks.
+
+The benchmarks are run from the backend directory, e.g.
+`python bench/login_storm.py`, which puts this directory on sys.path.
+"""
+
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def remove_database(database):
+    for path in (database, f"{database}-wal", f"{database}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def create_bench_app(database, **config):
+    """
+    Create the app on a fresh SQLite database file.
+
+    The config is read from the environment when config.py is imported, so
+    overrides are set as environment variables before the app is imported.
+
+    Args:
+        database (str): The path of the SQLite file, removed first
+        **config: Config overrides, e.g. PASSWORD_HASH_WORKERS=2
+
+    Returns:
+        Flask: The app, with its tables created
+    """
+    remove_database(database)
+    os.environ["DATABASE_URI"] = f"sqlite:///{os.path.abspath(database)}"
+    os.environ.update({key: str(value) for key, value in config.items()})
+
+    from app import create_app
+    from app.extensions import db
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def make_user(username, password_hash="x"):
+    """Add a user, inside an app context."""
+    from app.extensions import db
+    from app.models import User
+
+    user = User(
+        name=username.title(),
+        username=username,
+        email=f"{username}@example.com",
+        password_hash=password_hash,
+    )
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def access_token(user):
+    from app.utils.jwt_utility import create_access_token
+
+    return create_access_token({"user_id": user.id})
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(0, int(len(ordered) * fraction) - 1)]
@@ -0,0 +1,84 @@
+"""
+Benchmark the encoding and compression of a page of chat messages.
+
+Fetches a page of LIMIT messages from GET /chats/<id>/messages, then times
+encoding its payload with the stdlib and orjson JSON providers, and
+compressing the encoded body with gzip and, when installed, brotli, at the
+levels the app uses by default.
+
+    python bench/json_encoding.py --limit 100
+"""
+
+import argparse
+import gzip
+import json
+import os
+import timeit
+
+from common import BACKEND_DIR, access_token, create_bench_app, make_user
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--number", type=int, default=2000)
+    parser.add_argument(
+        "--database", default=os.path.join(BACKEND_DIR, "bench", "json_encoding.db")
+    )
+    return parser.parse_args()
+
+
+def best_us(number, f):
+    return min(timeit.repeat(f, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    args = parse_args()
+    app = create_bench_app(args.database, RATE_LIMIT_ENABLED="false")
+
+    from app.extensions import db
+    from app.models import Message
+    from app.utils.chat_utility import create_direct_chat, store_message
+    from app.utils.compression import brotli
+    from app.utils.json_provider import IsoDefaultJSONProvider, OrjsonProvider
+
+    with app.app_context():
+        alice, bob = make_user("alice"), make_user("bob")
+        chat_id = create_direct_chat(alice.id, bob.id).id
+        for index in range(args.limit):
+            content = f"hello there, this is message number {index} " * 3
+            store_message(Message(chat_id=chat_id, sender_id=alice.id, content=content))
+        db.session.commit()
+        headers = {"Authorization": f"Bearer {access_token(alice)}"}
+
+    response = app.test_client().get(
+        f"/chats/{chat_id}/messages?limit={args.limit}", headers=headers
+    )
+    assert response.status_code == 200, response.status_code
+    payload = json.loads(response.data)
+    body = json.dumps(payload).encode()
+    print(f"{args.limit} messages, {len(body)} bytes, best of 5")
+
+    for provider_class in (IsoDefaultJSONProvider, OrjsonProvider):
+        provider = provider_class(app)
+        encode_us = best_us(args.number, lambda: provider.dumps(payload))
+        print(f"{provider_class.__name__:24} encode {encode_us:8.1f} us")
+
+    gzip_level = app.config["COMPRESS_GZIP_LEVEL"]
+    compressed = gzip.compress(body, gzip_level)
+    gzip_us = best_us(args.number // 4, lambda: gzip.compress(body, gzip_level))
+    print(f"gzip level {gzip_level:<13} {len(compressed):6} bytes {gzip_us:8.1f} us")
+
+    if brotli is not None:
+        quality = app.config["COMPRESS_BROTLI_QUALITY"]
+        compressed = brotli.compress(body, quality=quality)
+        brotli_us = best_us(
+            args.number // 4, lambda: brotli.compress(body, quality=quality)
+        )
+        print(
+            f"brotli quality {quality:<9} {len(compressed):6} bytes {brotli_us:8.1f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
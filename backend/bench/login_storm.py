@@ -0,0 +1,115 @@
+"""
+Benchmark socket latency during a login storm.
+
+THREADS threads call POST /auth/login in a loop while a socket client times
+join-chat -> joined-chat round trips every 20 ms. The round trips are
+timed once before the storm, then during it. Logins beyond the password
+hashing pool's queue get a 503.
+
+    python bench/login_storm.py --workers 2 --queue 8
+    python bench/login_storm.py --workers 64 --queue 1000   # unbounded
+"""
+
+import argparse
+import os
+import statistics
+import threading
+import time
+
+from common import (
+    BACKEND_DIR,
+    access_token,
+    create_bench_app,
+    make_user,
+    percentile,
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--queue", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--samples", type=int, default=100)
+    parser.add_argument(
+        "--database", default=os.path.join(BACKEND_DIR, "bench", "login_storm.db")
+    )
+    return parser.parse_args()
+
+
+def time_round_trips(app, token, chat_id, samples):
+    from app.extensions import socketio
+
+    latencies = []
+    with app.app_context():
+        client = socketio.test_client(app, auth={"token": token})
+        for _ in range(samples):
+            started = time.perf_counter()
+            client.emit("join-chat", {"chat_id": chat_id})
+            client.get_received()
+            latencies.append((time.perf_counter() - started) * 1000)
+            time.sleep(0.02)
+        client.disconnect()
+    return latencies
+
+
+def main():
+    args = parse_args()
+    app = create_bench_app(
+        args.database,
+        PASSWORD_HASH_WORKERS=args.workers,
+        PASSWORD_HASH_QUEUE_SIZE=args.queue,
+        RATE_LIMIT_ENABLED="false",
+    )
+
+    from app.extensions import db
+    from app.utils.chat_utility import create_direct_chat
+    from app.utils.user_utility import create_user
+
+    with app.app_context():
+        create_user("Storm", "storm", "storm@example.com", "password")
+        alice, bob = make_user("alice"), make_user("bob")
+        chat_id = create_direct_chat(alice.id, bob.id).id
+        db.session.commit()
+        token = access_token(alice)
+
+    idle = time_round_trips(app, token, chat_id, args.samples // 2)
+
+    stop = threading.Event()
+    status_codes = []
+
+    def storm():
+        client = app.test_client()
+        credentials = {
+            "usernameOrEmail": "storm@example.com",
+            "password": "password",
+        }
+        while not stop.is_set():
+            response = client.post("/auth/login", json=credentials)
+            status_codes.append(response.status_code)
+
+    threads = [threading.Thread(target=storm) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.5)
+    try:
+        during = time_round_trips(app, token, chat_id, args.samples)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    print(f"workers={args.workers} queue={args.queue} threads={args.threads}")
+    print(f"idle:  p50 {statistics.median(idle):.1f} ms")
+    print(
+        f"storm: p50 {statistics.median(during):.1f} ms"
+        f"  p99 {percentile(during, 0.99):.1f} ms"
+    )
+    print(
+        f"logins: {status_codes.count(200)} succeeded,"
+        f" {status_codes.count(503)} got a 503"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark socket message throughput with and without the message writer.
+
+Starts the threaded or the asyncio server, connects SENDERS websocket
+clients, each a member of its own direct chat, and has each of them send
+messages in a closed loop, waiting for the ack of a message before sending
+the next one. Reports the acked messages per second and the errors.
+
+Needs the same packages as bench/socket_latency.py.
+
+    python bench/message_writer.py --senders 100
+    python bench/message_writer.py --senders 100 --writer
+    python bench/message_writer.py --mode asgi --senders 100 --writer
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+
+from common import BACKEND_DIR, access_token, create_bench_app, make_user
+from socket_latency import connect, start_server, wait_for_server
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mode", choices=["threading", "asgi"], default="threading")
+    parser.add_argument("--writer", action="store_true", help="Enable the writer.")
+    parser.add_argument("--senders", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=2000, help="In total.")
+    parser.add_argument("--port", type=int, default=5202)
+    parser.add_argument(
+        "--database", default=os.path.join(BACKEND_DIR, "bench", "message_writer.db")
+    )
+    return parser.parse_args()
+
+
+async def send_messages(websocket, chat_id, sender, count, results):
+    for index in range(count):
+        event = {
+            "chat_id": chat_id,
+            "content": f"message {index}",
+            "client_msg_id": f"{sender}-{index}",
+        }
+        await websocket.send(f"42{index}" + json.dumps(["send-message", event]))
+
+        ack_prefix = f"43{index}["
+        while True:
+            packet = await websocket.recv()
+            if packet == "2":
+                await websocket.send("3")
+            elif packet.startswith('42["send-message:error"'):
+                message = json.loads(packet[2:])[1].get("message", "")
+                first_line = message.partition("\n")[0]
+                results[f"error: {first_line[:60]}"] += 1
+            elif packet.startswith(ack_prefix):
+                ack = json.loads(packet[len(ack_prefix) - 1 :])
+                results["acked" if ack and ack[0] else "failed"] += 1
+                break
+
+
+async def run(args, tokens, chat_ids):
+    url = f"ws://127.0.0.1:{args.port}/socket.io/?EIO=4&transport=websocket"
+    websockets = [await wait_for_server(url, tokens[0])]
+    websockets += [await connect(url, token) for token in tokens[1:]]
+
+    per_sender = max(1, args.messages // args.senders)
+    results = Counter()
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(
+            send_messages(websocket, chat_id, sender, per_sender, results)
+            for sender, (websocket, chat_id) in enumerate(zip(websockets, chat_ids))
+        )
+    )
+    seconds = time.perf_counter() - started
+
+    print(f"mode={args.mode} writer={args.writer} senders={args.senders}")
+    print(
+        f"{results.pop('acked', 0) / seconds:.0f} acked messages/s"
+        f" over {seconds:.1f} s, {dict(results) or 'no errors'}"
+    )
+
+
+def main():
+    args = parse_args()
+    app = create_bench_app(
+        args.database,
+        RATE_LIMIT_ENABLED="false",
+        SOCKETIO_MESSAGE_QUEUE="",
+        MESSAGE_WRITER_ENABLED=str(args.writer).lower(),
+    )
+
+    from app.extensions import db
+    from app.utils.chat_utility import create_direct_chat
+
+    with app.app_context():
+        sink = make_user("sink")
+        senders = [make_user(f"sender{index}") for index in range(args.senders)]
+        chat_ids = [create_direct_chat(user.id, sink.id).id for user in senders]
+        db.session.commit()
+        tokens = [access_token(user) for user in senders]
+
+    server = start_server(args.mode, args.port)
+    try:
+        asyncio.run(run(args, tokens, chat_ids))
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
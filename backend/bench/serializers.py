@@ -0,0 +1,90 @@
+"""
+Benchmark the message serializer against hand-built dicts.
+
+Loads MESSAGES messages with their authors joined, as the messages route
+does, and times building the route's message dicts by hand, as the routes
+used to, and through message_serializer, with and without a sparse
+fieldset.
+
+    python bench/serializers.py --messages 5000
+"""
+
+import argparse
+import os
+import timeit
+
+from common import BACKEND_DIR, create_bench_app, make_user
+
+MESSAGE_FIELDS = ("id", "content", "sent_at", "sender")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument(
+        "--database", default=os.path.join(BACKEND_DIR, "bench", "serializers.db")
+    )
+    return parser.parse_args()
+
+
+def hand_built(messages):
+    return [
+        {
+            "id": message.id,
+            "content": message.content,
+            "sent_at": message.sent_at,
+            "sender": {
+                "id": message.sender_id,
+                "name": message.author.name,
+                "username": message.author.username,
+                "profile_picture": message.author.profile_picture,
+            },
+        }
+        for message in messages
+    ]
+
+
+def main():
+    args = parse_args()
+    app = create_bench_app(args.database)
+
+    from sqlalchemy.orm import joinedload
+
+    from app.extensions import db
+    from app.models import Message
+    from app.utils.chat_utility import create_direct_chat
+    from app.utils.serializers import message_serializer
+
+    with app.app_context():
+        alice, bob = make_user("alice"), make_user("bob")
+        chat_id = create_direct_chat(alice.id, bob.id).id
+        db.session.add_all(
+            Message(chat_id=chat_id, sender_id=alice.id, content=f"hi {index}")
+            for index in range(args.messages)
+        )
+        db.session.commit()
+
+        messages = Message.query.options(joinedload(Message.author)).all()
+        fieldsets = (("message", frozenset({"id", "content"})),)
+        candidates = [
+            ("hand-built dicts", lambda: hand_built(messages)),
+            (
+                "serializer",
+                lambda: message_serializer.dump_many(messages, only=MESSAGE_FIELDS),
+            ),
+            (
+                "serializer, id,content",
+                lambda: message_serializer.dump_many(
+                    messages, only=MESSAGE_FIELDS, fieldsets=fieldsets
+                ),
+            ),
+        ]
+
+        print(f"{len(messages)} messages, best of 7")
+        for name, f in candidates:
+            seconds = min(timeit.repeat(f, number=10, repeat=7)) / 10
+            print(f"{name:24} {seconds / len(messages) * 1e6:6.2f} us/row")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Benchmark send-message round trips with idle websocket connections held.
+
+Starts the threaded server (socketio.run) or the asyncio server (uvicorn
+app.asgi), opens IDLE idle websocket connections, then times MESSAGES
+send-message round trips from one member of a direct chat to the other,
+and a burst of BURST messages. The server's RSS and thread count are read
+from /proc once the idle connections are open.
+
+Needs the websockets package, and requirements-async.txt for the asyncio
+server.
+
+    python bench/socket_latency.py --mode threading --idle 3000
+    python bench/socket_latency.py --mode asgi --idle 3000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from common import BACKEND_DIR, access_token, create_bench_app, make_user, percentile
+
+# The origin the app accepts socket connections from
+ORIGIN = "http://localhost:5173"
+
+RUN_THREADED = """
+import sys
+from app import create_app
+from app.extensions import socketio
+socketio.run(
+    create_app(), port=int(sys.argv[1]), allow_unsafe_werkzeug=True, log_output=False
+)
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mode", choices=["threading", "asgi"], default="threading")
+    parser.add_argument("--idle", type=int, default=0)
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--burst", type=int, default=200)
+    parser.add_argument("--port", type=int, default=5201)
+    parser.add_argument(
+        "--database", default=os.path.join(BACKEND_DIR, "bench", "socket_latency.db")
+    )
+    return parser.parse_args()
+
+
+def start_server(mode, port):
+    if mode == "asgi":
+        command = [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.asgi:create_asgi_app",
+            "--factory",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ]
+    else:
+        command = [sys.executable, "-c", RUN_THREADED, str(port)]
+    return subprocess.Popen(command, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL)
+
+
+def server_status(pid):
+    with open(f"/proc/{pid}/status") as status:
+        fields = dict(line.split(":\t", 1) for line in status if ":\t" in line)
+    return fields["VmRSS"].strip(), fields["Threads"].strip()
+
+
+async def connect(url, token):
+    import websockets
+
+    websocket = await websockets.connect(url, origin=ORIGIN, max_queue=None)
+    await websocket.recv()
+    await websocket.send("40" + json.dumps({"token": token}))
+    reply = await websocket.recv()
+    if not reply.startswith("40"):
+        raise ConnectionError(reply)
+    return websocket
+
+
+async def read_events(websocket, events):
+    # Answer the server's pings and queue the events with their arrival time
+    try:
+        async for packet in websocket:
+            if packet == "2":
+                await websocket.send("3")
+            elif packet.startswith("42"):
+                await events.put((time.perf_counter(), json.loads(packet[2:])))
+    except Exception:
+        pass
+
+
+async def wait_for_server(url, token, timeout=20):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return await connect(url, token)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def run(args, server, chat_id, alice_token, bob_token):
+    url = f"ws://127.0.0.1:{args.port}/socket.io/?EIO=4&transport=websocket"
+    alice = await wait_for_server(url, alice_token)
+    bob = await connect(url, bob_token)
+    bob_events = asyncio.Queue()
+    asyncio.create_task(read_events(alice, asyncio.Queue()))
+    asyncio.create_task(read_events(bob, bob_events))
+
+    await bob.send("42" + json.dumps(["join-chat", {"chat_id": chat_id}]))
+    await asyncio.wait_for(bob_events.get(), 10)
+
+    idle, failed = [], 0
+    for _ in range(args.idle):
+        try:
+            idle.append(await connect(url, alice_token))
+        except (OSError, ConnectionError):
+            failed += 1
+    for websocket in idle:
+        asyncio.create_task(read_events(websocket, asyncio.Queue()))
+    rss, threads = server_status(server.pid)
+    print(f"mode={args.mode} idle={len(idle)} ({failed} failed)")
+    print(f"server RSS {rss}, {threads} threads")
+
+    def send(content):
+        event = ["send-message", {"chat_id": chat_id, "content": content}]
+        return alice.send("42" + json.dumps(event))
+
+    latencies = []
+    for index in range(args.messages):
+        started = time.perf_counter()
+        await send(f"message {index}")
+        received_at, _ = await asyncio.wait_for(bob_events.get(), 10)
+        latencies.append((received_at - started) * 1000)
+    print(
+        f"{args.messages} round trips: p50 {percentile(latencies, 0.5):.1f} ms"
+        f"  p99 {percentile(latencies, 0.99):.1f} ms"
+    )
+
+    started = time.perf_counter()
+    for index in range(args.burst):
+        await send(f"burst {index}")
+    for _ in range(args.burst):
+        await asyncio.wait_for(bob_events.get(), 30)
+    print(f"burst of {args.burst}: {(time.perf_counter() - started) * 1000:.0f} ms")
+
+
+def main():
+    args = parse_args()
+    app = create_bench_app(
+        args.database, RATE_LIMIT_ENABLED="false", SOCKETIO_MESSAGE_QUEUE=""
+    )
+
+    from app.extensions import db
+    from app.utils.chat_utility import create_direct_chat
+
+    with app.app_context():
+        alice, bob = make_user("alice"), make_user("bob")
+        chat_id = create_direct_chat(alice.id, bob.id).id
+        db.session.commit()
+        alice_token, bob_token = access_token(alice), access_token(bob)
+
+    server = start_server(args.mode, args.port)
+    try:
+        asyncio.run(run(args, server, chat_id, alice_token, bob_token))
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
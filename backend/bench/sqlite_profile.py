@@ -0,0 +1,171 @@
+"""
+Benchmark chat reads next to a saturated message writer, per SQLite profile.
+
+Runs a reader process that loads the last 50 messages of a chat in a loop
+for DURATION seconds, first alone, then while a writer process keeps the
+message writer saturated. The commit cost of each profile is timed on its
+own first.
+
+    python bench/sqlite_profile.py --profile production
+    python bench/sqlite_profile.py --profile default
+"""
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from common import BACKEND_DIR, create_bench_app, make_user, percentile
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--profile", choices=["production", "default"], default="production"
+    )
+    parser.add_argument("--duration", type=float, default=8)
+    parser.add_argument(
+        "--database", default=os.path.join(BACKEND_DIR, "bench", "sqlite_profile.db")
+    )
+    parser.add_argument("--role", choices=["writer", "reader"], help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def config(args):
+    return {
+        "SQLITE_PROFILE": args.profile,
+        "MESSAGE_WRITER_ENABLED": "true",
+        "MESSAGE_WRITER_QUEUE_SIZE": 100000,
+    }
+
+
+def open_app(args):
+    # The writer and reader processes share the database the main one seeded
+    os.environ["DATABASE_URI"] = f"sqlite:///{os.path.abspath(args.database)}"
+    os.environ.update({key: str(value) for key, value in config(args).items()})
+
+    from app import create_app
+
+    return create_app()
+
+
+def run_writer(args):
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    app = open_app(args)
+
+    from sqlalchemy import select
+
+    from app.extensions import db
+    from app.models import ChatMember, Message
+    from app.utils.message_writer import message_writer
+
+    with app.app_context():
+        members = db.session.execute(
+            select(ChatMember.chat_id, ChatMember.member_id)
+        ).all()
+        while True:
+            futures = [
+                message_writer.submit(
+                    Message(chat_id=chat_id, sender_id=member_id, content="hi")
+                )
+                for chat_id, member_id in members * 5
+            ]
+            for future in futures:
+                future.result()
+
+
+def run_reader(args):
+    app = open_app(args)
+
+    from sqlalchemy import select
+
+    from app.extensions import db
+    from app.models import Chat, Message
+
+    with app.app_context():
+        chat_ids = list(db.session.execute(select(Chat.id)).scalars())
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < args.duration:
+            chat_id = chat_ids[len(latencies) % len(chat_ids)]
+            read_started = time.perf_counter()
+            try:
+                db.session.execute(
+                    select(Message)
+                    .where(Message.chat_id == chat_id)
+                    .order_by(Message.seq.desc())
+                    .limit(50)
+                ).all()
+                db.session.commit()
+                latencies.append((time.perf_counter() - read_started) * 1000)
+            except Exception:
+                db.session.rollback()
+                errors += 1
+
+    print(
+        f"{len(latencies) / args.duration:.0f} reads/s"
+        f"  p50 {percentile(latencies, 0.5):.2f} ms"
+        f"  p99 {percentile(latencies, 0.99):.2f} ms"
+        f"  max {max(latencies):.0f} ms  {errors} errors"
+    )
+
+
+def time_commits(count=200):
+    from app.extensions import db
+    from app.models import Chat
+
+    chat = Chat.query.first()
+    started = time.perf_counter()
+    for index in range(count):
+        chat.name = f"chat {index}"
+        db.session.commit()
+    return (time.perf_counter() - started) / count * 1000
+
+
+def main():
+    args = parse_args()
+    if args.role == "writer":
+        return run_writer(args)
+    if args.role == "reader":
+        return run_reader(args)
+
+    app = create_bench_app(args.database, **config(args))
+
+    from app.extensions import db
+    from app.utils.chat_utility import create_direct_chat
+
+    with app.app_context():
+        sink = make_user("sink")
+        for index in range(10):
+            create_direct_chat(make_user(f"user{index}").id, sink.id)
+        db.session.commit()
+
+        journal_mode = db.session.execute(db.text("PRAGMA journal_mode")).scalar()
+        synchronous = db.session.execute(db.text("PRAGMA synchronous")).scalar()
+        print(
+            f"profile={args.profile} journal_mode={journal_mode}"
+            f" synchronous={synchronous}: {time_commits():.2f} ms per commit"
+        )
+
+    command = [sys.executable, os.path.abspath(__file__), *sys.argv[1:]]
+    for writing in (False, True):
+        writer = None
+        if writing:
+            writer = subprocess.Popen([*command, "--role", "writer"])
+            time.sleep(2)
+        try:
+            reader = subprocess.run(
+                [*command, "--role", "reader"], capture_output=True, text=True
+            )
+        finally:
+            if writer:
+                writer.terminate()
+                writer.wait()
+        label = "saturated writer" if writing else "idle writer"
+        print(f"{label:17} {reader.stdout.strip()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Benchmark user search on a seeded SQLite database.
+
+Seeds USERS users with their search trigrams, then times, for a set of
+queries, the two statements GET /users runs: the ranked page of ids
+(search_user_ids) and the number of matches (count_matching_users). The
+leading wildcard ILIKE search the trigram index replaced is timed as a
+reference.
+
+First names follow a skewed distribution, a handful of them being shared by
+a large part of the users, so short and common queries match a large
+fraction of the table, which is the slowest case of ranking every match.
+
+    python bench/user_search.py --users 1000000
+    python bench/user_search.py --reuse   # skip seeding
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import string
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A few first names shared by many users, like real name distributions
+COMMON_FIRST_NAMES = ["maria", "james", "anna", "mohammed", "li"]
+COMMON_SHARE = 0.3
+
+SEED_BATCH_SIZE = 50000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument(
+        "--database", default=os.path.join(BACKEND_DIR, "bench", "user_search.db")
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--reuse", action="store_true", help="Keep the seeded users.")
+    return parser.parse_args()
+
+
+def random_word(rng, low, high):
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(low, high)))
+
+
+def seed(database, users):
+    from app.utils.user_search import user_grams
+
+    rng = random.Random(1)
+    first_names = [random_word(rng, 3, 8) for _ in range(5000)]
+    last_names = [random_word(rng, 4, 9) for _ in range(5000)]
+
+    started = time.perf_counter()
+    with sqlite3.connect(database) as connection:
+        user_rows, gram_rows = [], []
+        for index in range(users):
+            if rng.random() < COMMON_SHARE:
+                first = rng.choice(COMMON_FIRST_NAMES)
+            else:
+                first = rng.choice(first_names)
+            last = rng.choice(last_names)
+
+            user_id = f"user-{index:08d}"
+            username = f"{first}{last[:2]}{index}"
+            name = f"{first.title()} {last.title()}"
+            user_rows.append((user_id, name, username, f"{username}@example.com"))
+            gram_rows.extend((gram, user_id) for gram in user_grams(name, username))
+
+            if len(user_rows) == SEED_BATCH_SIZE or index == users - 1:
+                connection.executemany(
+                    "INSERT INTO users (id, name, username, email, password_hash,"
+                    " chat_requests_version) VALUES (?, ?, ?, ?, 'x', 1)",
+                    user_rows,
+                )
+                connection.executemany(
+                    "INSERT INTO user_search_grams (gram, user_id) VALUES (?, ?)",
+                    gram_rows,
+                )
+                connection.commit()
+                user_rows, gram_rows = [], []
+
+    print(f"Seeded {users} users in {time.perf_counter() - started:.1f}s")
+    return first_names, last_names
+
+
+def timed(runs, f):
+    started = time.perf_counter()
+    for _ in range(runs):
+        result = f()
+    return (time.perf_counter() - started) / runs * 1000, result
+
+
+def main():
+    args = parse_args()
+    os.environ["DATABASE_URI"] = f"sqlite:///{os.path.abspath(args.database)}"
+    sys.path.insert(0, BACKEND_DIR)
+
+    from sqlalchemy import func, or_
+
+    from app import create_app
+    from app.extensions import db
+    from app.models import User
+    from app.utils.user_search import count_matching_users, search_user_ids
+
+    if not args.reuse and os.path.exists(args.database):
+        os.remove(args.database)
+
+    app = create_app()
+    with app.app_context():
+        if not args.reuse:
+            db.create_all()
+            seed(args.database, args.users)
+
+        total = db.session.query(func.count(User.id)).scalar()
+        queries = [
+            "m",  # a single letter
+            "ma",
+            "maria",  # the most common first name
+            "maria s",  # a common first name and the start of a last name
+            "anna",
+            "mria",  # a typo of the most common name
+            "zzqx",  # nothing
+        ]
+
+        print(f"{total} users, mean of {args.runs} runs")
+        print(
+            f"{'query':12} {'matches':>9} {'page ms':>9} {'count ms':>9}"
+            f" {'ilike+count ms':>15}"
+        )
+        for query in queries:
+            page_ms, _ = timed(args.runs, lambda: search_user_ids(query, limit=10))
+            count_ms, matches = timed(args.runs, lambda: count_matching_users(query))
+
+            pattern = f"%{query}%"
+            ilike = or_(User.username.ilike(pattern), User.name.ilike(pattern))
+            ilike_ms, _ = timed(
+                args.runs,
+                lambda: (
+                    db.session.query(User.id).filter(ilike).limit(10).all(),
+                    db.session.query(func.count(User.id)).filter(ilike).scalar(),
+                ),
+            )
+            print(
+                f"{query!r:12} {matches:>9} {page_ms:>9.1f} {count_ms:>9.1f}"
+                f" {ilike_ms:>15.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,3 +5,132 @@ class Config(object):
     SECRET_KEY = os.getenv("SECRET_KEY", "my_super_secret_key")
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URI", "sqlite:///dev.db")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Read-only routes and socket membership checks read from this replica
+    # when set, except for users who wrote in the last
+    # REPLICA_STICKY_SECONDS, who read their own writes from the primary
+    REPLICA_DATABASE_URI = os.getenv("REPLICA_DATABASE_URI")
+    SQLALCHEMY_BINDS = {"replica": REPLICA_DATABASE_URI} if REPLICA_DATABASE_URI else {}
+    REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", 5))
+
+    # Connection pool of the database, for SQLite files and Postgres alike.
+    # Pooled connections are replaced after DATABASE_POOL_RECYCLE seconds.
+    DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", 10))
+    DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", 20))
+    DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", 30))
+    DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", 1800))
+
+    # SQLite settings applied to every new connection with the "production"
+    # profile, "default" leaves SQLite's own. SQLITE_BUSY_TIMEOUT is in
+    # milliseconds, SQLITE_MMAP_SIZE in bytes and a negative
+    # SQLITE_CACHE_SIZE in KiB.
+    SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "production")
+    SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000))
+    SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+    SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", -64 * 1024))
+    SQLITE_TEMP_STORE = os.getenv("SQLITE_TEMP_STORE", "MEMORY")
+
+    # Seconds between writes of the read cursors sent over the socket
+    READ_CURSOR_FLUSH_INTERVAL = float(os.getenv("READ_CURSOR_FLUSH_INTERVAL", 2.0))
+
+    # Maximum number of messages returned by a single /sync call
+    SYNC_MESSAGE_LIMIT = int(os.getenv("SYNC_MESSAGE_LIMIT", 500))
+
+    # Maximum number of messages returned by a single fetch-range event
+    FETCH_RANGE_LIMIT = int(os.getenv("FETCH_RANGE_LIMIT", 200))
+
+    # Acks of sent messages are cached for SENT_MESSAGE_CACHE_TTL seconds,
+    # so retried sends with the same client_msg_id skip the database
+    SENT_MESSAGE_CACHE_SIZE = int(os.getenv("SENT_MESSAGE_CACHE_SIZE", 10000))
+    SENT_MESSAGE_CACHE_TTL = float(os.getenv("SENT_MESSAGE_CACHE_TTL", 600))
+
+    # Store socket messages from one writer thread that commits up to
+    # MESSAGE_WRITER_BATCH_SIZE of them at once. Batches are the messages
+    # that queued up during the previous commit, MESSAGE_WRITER_MAX_DELAY
+    # seconds makes the writer wait for more. Sends are rejected while
+    # MESSAGE_WRITER_QUEUE_SIZE messages are waiting, and handlers store
+    # their message themselves after waiting MESSAGE_WRITER_TIMEOUT seconds
+    # for the writer to pick it up.
+    MESSAGE_WRITER_ENABLED = (
+        os.getenv("MESSAGE_WRITER_ENABLED", "false").lower() == "true"
+    )
+    MESSAGE_WRITER_BATCH_SIZE = int(os.getenv("MESSAGE_WRITER_BATCH_SIZE", 100))
+    MESSAGE_WRITER_MAX_DELAY = float(os.getenv("MESSAGE_WRITER_MAX_DELAY", 0))
+    MESSAGE_WRITER_QUEUE_SIZE = int(os.getenv("MESSAGE_WRITER_QUEUE_SIZE", 1000))
+    MESSAGE_WRITER_TIMEOUT = float(os.getenv("MESSAGE_WRITER_TIMEOUT", 5))
+
+    # JSON encoder used for responses, "orjson" (falls back to "std" when
+    # orjson is not installed) or "std"
+    JSON_PROVIDER = os.getenv("JSON_PROVIDER", "orjson")
+
+    # Compress JSON responses larger than COMPRESS_MIN_SIZE bytes with
+    # brotli (when installed) or gzip
+    COMPRESS_RESPONSES = os.getenv("COMPRESS_RESPONSES", "true").lower() == "true"
+    COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+    COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", 6))
+    COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", 4))
+
+    # Verified access tokens and their users are cached for up to
+    # TOKEN_CACHE_TTL seconds, never past the token's expiry
+    TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+    TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", 60))
+
+    # werkzeug hash method and work factor for new password hashes. Hashes
+    # made with other parameters are upgraded on the next login.
+    PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+
+    # Threads hashing passwords, and how many hashes may wait for one before
+    # logins are rejected with a 503
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+    PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", 32))
+
+    # Token bucket rate limits, see app/utils/rate_limit.py for the default
+    # policies. RATE_LIMITS overrides them with {name: (limit, period)}.
+    # Use a redis:// RATE_LIMIT_STORAGE_URL to share the buckets between
+    # worker processes.
+    RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    RATE_LIMIT_STORAGE_URL = os.getenv("RATE_LIMIT_STORAGE_URL", "memory://")
+    RATE_LIMITS = {}
+
+    # The number of reverse proxies in front of the app. The "ip" and
+    # "connect" rate limits then take the client address from that many hops
+    # back in X-Forwarded-For, through werkzeug's ProxyFix. Keep it at 0 when
+    # clients connect directly, since they can set the header themselves.
+    PROXY_FIX_X_FOR = int(os.getenv("PROXY_FIX_X_FOR", 0))
+
+    # Confirmed chat memberships are cached for MEMBERSHIP_CACHE_TTL seconds
+    MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", 100000))
+    MEMBERSHIP_CACHE_TTL = float(os.getenv("MEMBERSHIP_CACHE_TTL", 300))
+
+    # Message queue that routes Socket.IO emits between worker processes,
+    # e.g. redis://localhost:6379/0. local://host:port uses the broker
+    # started with `flask run-socket-broker`. Unset for a single worker.
+    SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE")
+    SOCKETIO_CHANNEL = os.getenv("SOCKETIO_CHANNEL", "textify")
+
+    # Where online users are tracked, shared between workers when it is a
+    # redis:// URL. Defaults to the message queue.
+    PRESENCE_STORAGE_URL = os.getenv("PRESENCE_STORAGE_URL", SOCKETIO_MESSAGE_QUEUE)
+
+    # Presence changes are sent to the users sharing a chat at most once
+    # every PRESENCE_FLUSH_INTERVAL seconds. Workers refresh the heartbeats
+    # of their connections every PRESENCE_HEARTBEAT_INTERVAL seconds, and
+    # connections without one for PRESENCE_TIMEOUT seconds are dropped.
+    PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", 1.0))
+    PRESENCE_HEARTBEAT_INTERVAL = float(os.getenv("PRESENCE_HEARTBEAT_INTERVAL", 15))
+    PRESENCE_TIMEOUT = float(os.getenv("PRESENCE_TIMEOUT", 60))
+
+    # Database URI of the asyncio server (app/asgi.py), derived from
+    # SQLALCHEMY_DATABASE_URI with an asyncio driver when unset
+    ASYNC_DATABASE_URI = os.getenv("ASYNC_DATABASE_URI")
+
+    # Batch the new messages of a chat room emitted within
+    # EMIT_COALESCE_WINDOW seconds into one `new-messages` event of at most
+    # EMIT_COALESCE_MAX_BATCH messages. Clients must handle the batch event.
+    EMIT_COALESCE_ENABLED = (
+        os.getenv("EMIT_COALESCE_ENABLED", "false").lower() == "true"
+    )
+    EMIT_COALESCE_WINDOW = float(os.getenv("EMIT_COALESCE_WINDOW", 0.005))
+    EMIT_COALESCE_MAX_BATCH = int(os.getenv("EMIT_COALESCE_MAX_BATCH", 32))
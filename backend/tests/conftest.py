@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """
+    An app on a fresh SQLite database file.
+
+    The config is read from the environment when config.py is imported, so
+    the database URI is set on the Config class instead.
+    """
+    from config import Config
+
+    monkeypatch.setattr(
+        Config, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'test.db'}"
+    )
+
+    from app import create_app
+    from app.extensions import db
+
+    app = create_app()
+    app.config["TESTING"] = True
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(app):
+    from app.extensions import db
+    from app.models import User
+
+    def make_user(username):
+        user = User(
+            name=username.title(),
+            username=username,
+            email=f"{username}@example.com",
+            password_hash="x",
+        )
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    return make_user
+
+
+@pytest.fixture
+def auth_headers():
+    from app.utils.jwt_utility import create_access_token
+
+    def auth_headers(user):
+        token = create_access_token({"user_id": user.id})
+        return {"Authorization": f"Bearer {token}"}
+
+    return auth_headers
@@ -0,0 +1,120 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+import socketio
+
+from app.extensions import db
+from app.utils.chat_utility import create_direct_chat
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RUN_WORKER = """
+import sys
+from app import create_app
+from app.extensions import socketio
+socketio.run(create_app(), port=int(sys.argv[1]), allow_unsafe_werkzeug=True)
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Nothing is listening on port {port}")
+
+
+@pytest.fixture
+def processes():
+    started = []
+    yield started
+    for process in started:
+        process.terminate()
+    for process in started:
+        process.wait(timeout=10)
+
+
+def send_until_received(alice_client, bob_client, chat_id, attempts=10):
+    received = threading.Event()
+    bob_client.on("new-message", lambda data: received.set())
+    # The workers subscribe to the broker in the background, so the first
+    # messages may be published before both are listening
+    for attempt in range(attempts):
+        alice_client.emit(
+            "send-message", {"chat_id": chat_id, "content": f"hi {attempt}"}
+        )
+        if received.wait(timeout=1):
+            return True
+    return False
+
+
+@pytest.mark.parametrize("restart_broker", [False, True])
+def test_emit_reaches_a_client_of_another_worker(
+    app, make_user, auth_headers, processes, restart_broker
+):
+    alice, bob = make_user("alice"), make_user("bob")
+    chat_id = create_direct_chat(alice.id, bob.id).id
+    db.session.commit()
+    alice_token = auth_headers(alice)["Authorization"][len("Bearer ") :]
+    bob_token = auth_headers(bob)["Authorization"][len("Bearer ") :]
+
+    broker_port, alice_port, bob_port = free_port(), free_port(), free_port()
+    env = {
+        **os.environ,
+        "DATABASE_URI": app.config["SQLALCHEMY_DATABASE_URI"],
+        "SOCKETIO_MESSAGE_QUEUE": f"local://127.0.0.1:{broker_port}",
+    }
+
+    def start(*args):
+        process = subprocess.Popen([sys.executable, *args], cwd=BACKEND_DIR, env=env)
+        processes.append(process)
+        return process
+
+    broker_args = ("-m", "flask", "--app", "app:create_app", "run-socket-broker")
+    broker = start(*broker_args)
+    wait_for_port(broker_port)
+    start("-c", RUN_WORKER, str(alice_port))
+    start("-c", RUN_WORKER, str(bob_port))
+    wait_for_port(alice_port)
+    wait_for_port(bob_port)
+
+    bob_client, alice_client = socketio.Client(), socketio.Client()
+    try:
+        bob_client.connect(
+            f"http://127.0.0.1:{bob_port}",
+            auth={"token": bob_token},
+            transports=["polling"],
+        )
+        bob_client.emit("join-chat", {"chat_id": chat_id})
+        alice_client.connect(
+            f"http://127.0.0.1:{alice_port}",
+            auth={"token": alice_token},
+            transports=["polling"],
+        )
+        assert send_until_received(alice_client, bob_client, chat_id)
+
+        if restart_broker:
+            broker.terminate()
+            broker.wait(timeout=10)
+            start(*broker_args)
+            wait_for_port(broker_port)
+            # The workers reconnect on their next publish, and the listeners
+            # after a backoff of a few seconds
+            assert send_until_received(alice_client, bob_client, chat_id, 20)
+    finally:
+        alice_client.disconnect()
+        bob_client.disconnect()
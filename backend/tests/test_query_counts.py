@@ -0,0 +1,101 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from app.extensions import db
+from app.models import Chat, ChatMember, ChatRequest, Message
+from app.utils.chat_utility import create_direct_chat, store_message
+
+
+@contextmanager
+def count_statements():
+    """Count the SQL statements run on the primary engine."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+def populate(make_user, user, size):
+    """
+    Give a user `size` direct chats, a group chat of `size` members, all with
+    messages, and `size` pending chat requests.
+    """
+    others = [make_user(f"{user.username}-friend-{i}") for i in range(size)]
+
+    group = Chat(name="group", chat_type="group")
+    db.session.add(group)
+    db.session.flush()
+    for member in [user, *others]:
+        db.session.add(
+            ChatMember(chat_id=group.id, member_id=member.id, member_role="member")
+        )
+
+    for other in others:
+        chat = create_direct_chat(user.id, other.id)
+        # The user sends the last message of the direct chats, so the other
+        # members are not already loaded as last message senders
+        store_message(Message(chat_id=group.id, sender_id=other.id, content="hi"))
+        store_message(Message(chat_id=chat.id, sender_id=user.id, content="hi"))
+
+        sender = make_user(f"{user.username}-sender-{other.username}")
+        db.session.add(ChatRequest(sender_id=sender.id, receiver_id=user.id))
+
+    db.session.commit()
+    db.session.remove()
+
+
+def get_statement_count(client, url, headers):
+    # The first request fills the token and membership caches
+    assert client.get(url, headers=headers).status_code == 200
+    db.session.remove()
+
+    with count_statements() as statements:
+        response = client.get(url, headers=headers)
+    db.session.remove()
+
+    assert response.status_code == 200
+    return len(statements)
+
+
+@pytest.mark.parametrize("url", ["/chats/", "/chats/requests"])
+def test_list_query_count_does_not_grow(app, client, make_user, auth_headers, url):
+    counts = []
+    for size in (2, 12):
+        user = make_user(f"user-{size}")
+        headers = auth_headers(user)
+        populate(make_user, user, size)
+        counts.append(get_statement_count(client, url, headers))
+
+    assert counts[0] == counts[1]
+
+
+def test_user_search_query_count_does_not_grow(app, client, make_user, auth_headers):
+    user = make_user("searcher")
+    headers = auth_headers(user)
+
+    # Matching users with every relationship status: friends, received and
+    # sent requests, and strangers
+    matches = [make_user(f"match-{i}") for i in range(40)]
+    for friend in matches[0::4]:
+        create_direct_chat(user.id, friend.id)
+    for sender in matches[1::4]:
+        db.session.add(ChatRequest(sender_id=sender.id, receiver_id=user.id))
+    for receiver in matches[2::4]:
+        db.session.add(ChatRequest(sender_id=user.id, receiver_id=receiver.id))
+    db.session.commit()
+    db.session.remove()
+
+    counts = [
+        get_statement_count(client, f"/users?query=match&per_page={per_page}", headers)
+        for per_page in (2, 40)
+    ]
+
+    assert counts[0] == counts[1]